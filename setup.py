@@ -61,8 +61,8 @@ if __name__ == '__main__':
             maintainer='Tim Savannah',
             url='https://github.com/kata198/usrsvc',
             maintainer_email='kata198@gmail.com',
-            requires=['configobj', 'NamedAtomicLock', 'func_timeout'],
-            install_requires=['configobj', 'NamedAtomicLock>=1.1.0', 'func_timeout', 'python-subprocess2'],
+            requires=['configobj', 'NamedAtomicLock'],
+            install_requires=['configobj', 'NamedAtomicLock>=1.1.0', 'python-subprocess2'],
             description=summary,
             long_description=long_description,
             license='GPLv2',
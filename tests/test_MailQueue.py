@@ -0,0 +1,230 @@
+'''
+    Copyright (c) 2016 Tim Savannah All Rights Reserved.
+    This software is licensed under the terms of the GPLv3.
+    This may change at my discretion, retroactively, and without notice.
+
+    You should have received a copy of this with the source distribution as a file titled, LICENSE.
+
+    The most current license can be found at:
+    https://github.com/kata198/usrsvc/LICENSE
+
+    This location may need to be changed at some point in the future, in which case
+    you are may email Tim Savannah <kata198 at gmail dot com>, or find them on the
+    current website intended for distribution of usrsvc.
+
+
+    Tests of MailQueue digests, rate limits, the pending limit, and flushing on stop.
+
+      Run with:  python -m pytest tests   or   python -m unittest discover -s tests
+'''
+
+# vim:set ts=4 shiftwidth=4 softtabstop=4 expandtab :
+
+import threading
+import time
+import unittest
+
+from usrsvcmod import MailQueue as MailQueueModule
+from usrsvcmod.MailQueue import MailQueue
+
+
+class RecordingSender(object):
+    '''
+        RecordingSender - A sendFunction which records what it is given. Fails the first #numFailures# sends to recipients in #failFor#.
+    '''
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        # list of (to, subject, body)
+        self.sent = []
+        self.failFor = set()
+        self.numFailures = 0
+
+    def __call__(self, to, subject, body):
+        with self.lock:
+            if to in self.failFor and self.numFailures > 0:
+                self.numFailures -= 1
+                raise Exception('Failing on purpose')
+            self.sent.append( (to, subject, body) )
+
+    def getSentTo(self, to):
+        with self.lock:
+            return [item for item in self.sent if item[0] == to]
+
+
+def flush(mailQueue):
+    '''
+        flush - Stop #mailQueue#, and send everything queued from this thread
+    '''
+    mailQueue.stop()
+    mailQueue.runWorker()
+
+
+class TestMailQueue(unittest.TestCase):
+
+    def setUp(self):
+        self.oldRetryBackoff = MailQueueModule.RETRY_BACKOFF
+        self.oldRateLimitPeriod = MailQueueModule.RATE_LIMIT_PERIOD
+
+        self.sender = RecordingSender()
+        self.workerThread = None
+
+    def tearDown(self):
+        MailQueueModule.RETRY_BACKOFF = self.oldRetryBackoff
+        MailQueueModule.RATE_LIMIT_PERIOD = self.oldRateLimitPeriod
+
+    def _startWorker(self, mailQueue):
+        self.workerThread = threading.Thread(target=mailQueue.runWorker)
+        self.workerThread.daemon = True
+        self.workerThread.start()
+
+    def _stopWorker(self, mailQueue):
+        mailQueue.stop()
+        self.workerThread.join(10)
+        self.assertFalse(self.workerThread.is_alive())
+
+    def _waitFor(self, condition, timeout=10):
+        deadline = time.time() + timeout
+        while not condition():
+            if time.time() >= deadline:
+                self.fail('Timed out waiting')
+            time.sleep(.02)
+
+    def test_digestCoalescesByRecipient(self):
+        mailQueue = MailQueue(self.sender, digestWindow=.5)
+        self._startWorker(mailQueue)
+        try:
+            mailQueue.add('a@example.com', 'One', 'Body one', 'prog1')
+            mailQueue.add('b@example.com', 'Other', 'Body other', 'prog1')
+            mailQueue.add('a@example.com', 'Two', 'Body two', 'prog2')
+            mailQueue.add('a@example.com', 'Three', 'Body three', 'prog1')
+
+            # Held for the digest window
+            time.sleep(.2)
+            self.assertEqual(self.sender.sent, [])
+
+            self._waitFor(lambda : len(self.sender.sent) >= 2)
+        finally:
+            self._stopWorker(mailQueue)
+
+        self.assertEqual(len(self.sender.sent), 2)
+
+        digests = self.sender.getSentTo('a@example.com')
+        self.assertEqual(len(digests), 1)
+        (_to, subject, body) = digests[0]
+        self.assertEqual(subject, 'usrsvcd digest - 3 alerts for prog1, prog2')
+        # In the order they were queued
+        self.assertTrue(body.index('==== One ====') < body.index('==== Two ====') < body.index('==== Three ===='))
+        self.assertTrue('Body three' in body)
+
+        # A single message is sent as it was
+        self.assertEqual(self.sender.getSentTo('b@example.com'), [('b@example.com', 'Other', 'Body other')])
+
+        stats = mailQueue.getStats()
+        self.assertEqual(stats['queued'], 4)
+        self.assertEqual(stats['sent'], 2)
+        self.assertEqual(stats['digests'], 1)
+        self.assertEqual(stats['pending'], 0)
+
+    def test_rateLimitNotesSuppressedInNextMail(self):
+        MailQueueModule.RATE_LIMIT_PERIOD = .3
+
+        mailQueue = MailQueue(self.sender, rateLimit=1)
+        self.assertTrue(mailQueue.add('a@example.com', 'First', 'Body', 'prog1'))
+        self.assertFalse(mailQueue.add('a@example.com', 'Second', 'Body', 'prog1'))
+        self.assertFalse(mailQueue.add('a@example.com', 'Third', 'Body', 'prog1'))
+        # Other programs have their own limit, and messages about no program are never limited
+        self.assertTrue(mailQueue.add('b@example.com', 'Other', 'Body', 'prog2'))
+        self.assertTrue(mailQueue.add('b@example.com', 'Daemon', 'Body', None))
+        self.assertTrue(mailQueue.add('b@example.com', 'Daemon', 'Body', None))
+
+        stats = mailQueue.getStats()
+        self.assertEqual(stats['suppressed'], 2)
+        self.assertEqual(stats['suppressed_by_program'], {'prog1' : 2})
+
+        flush(mailQueue)
+
+        (_to, subject, body) = self.sender.getSentTo('a@example.com')[0]
+        self.assertEqual(subject, 'First')
+        self.assertTrue('2 further alerts about prog1 were suppressed by mail_rate_limit.' in body)
+        self.assertTrue('suppressed' not in self.sender.getSentTo('b@example.com')[0][2])
+
+        self.assertEqual(mailQueue.getStats()['suppressed_by_program'], {})
+
+        # Once the period has passed, messages are accepted again, and the count was already noted
+        time.sleep(.35)
+        self.assertTrue(mailQueue.add('a@example.com', 'Fourth', 'Body', 'prog1'))
+        flush(mailQueue)
+
+        (_to, subject, body) = self.sender.getSentTo('a@example.com')[1]
+        self.assertEqual(subject, 'Fourth')
+        self.assertTrue('suppressed' not in body)
+
+    def test_maxPendingDropsOldest(self):
+        mailQueue = MailQueue(self.sender, digestWindow=3600)
+
+        numExtra = 5
+        for i in range(MailQueueModule.MAX_PENDING + numExtra):
+            mailQueue.add('r%d@example.com' %(i, ), 'Subject %d' %(i, ), 'Body')
+
+        stats = mailQueue.getStats()
+        self.assertEqual(stats['pending'], MailQueueModule.MAX_PENDING)
+        self.assertEqual(stats['dropped'], numExtra)
+
+        flush(mailQueue)
+
+        self.assertEqual(len(self.sender.sent), MailQueueModule.MAX_PENDING)
+        # The oldest were dropped
+        self.assertEqual(self.sender.sent[0][1], 'Subject %d' %(numExtra, ))
+        self.assertEqual(self.sender.sent[-1][1], 'Subject %d' %(MailQueueModule.MAX_PENDING + numExtra - 1, ))
+
+    def test_maxPendingDropsOldestOfDigest(self):
+        mailQueue = MailQueue(self.sender, digestWindow=3600)
+
+        for i in range(MailQueueModule.MAX_PENDING + 1):
+            mailQueue.add('a@example.com', 'Subject %d' %(i, ), 'Body')
+
+        self.assertEqual(mailQueue.getStats()['dropped'], 1)
+        flush(mailQueue)
+
+        (_to, subject, body) = self.sender.sent[0]
+        self.assertEqual(subject, 'usrsvcd digest - %d alerts' %(MailQueueModule.MAX_PENDING, ))
+        self.assertTrue('==== Subject 0 ====' not in body)
+        self.assertTrue('==== Subject 1 ====' in body)
+
+    def test_stopFlushesEverything(self):
+        MailQueueModule.RETRY_BACKOFF = 3600
+        self.sender.failFor.add('c@example.com')
+        self.sender.numFailures = 1
+
+        mailQueue = MailQueue(self.sender, digestWindow=0)
+        self._startWorker(mailQueue)
+
+        # Fails once, and is held for an hour before it is tried again
+        mailQueue.add('c@example.com', 'Retried', 'Body')
+        self._waitFor(lambda : mailQueue.getStats()['retried'] == 1)
+
+        # Held for an hour for the digest
+        mailQueue.configure(3600, 0)
+        mailQueue.add('a@example.com', 'One', 'Body')
+        mailQueue.add('a@example.com', 'Two', 'Body')
+        mailQueue.add('b@example.com', 'Other', 'Body')
+        time.sleep(.1)
+        self.assertEqual(self.sender.sent, [])
+
+        self._stopWorker(mailQueue)
+
+        self.assertEqual(sorted([item[0] for item in self.sender.sent]), ['a@example.com', 'b@example.com', 'c@example.com'])
+        self.assertEqual(self.sender.getSentTo('a@example.com')[0][1], 'usrsvcd digest - 2 alerts')
+
+        stats = mailQueue.getStats()
+        self.assertEqual(stats['pending'], 0)
+        self.assertEqual(stats['sent'], 3)
+        self.assertEqual(stats['failed'], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
+
+
+# vim:set ts=4 shiftwidth=4 softtabstop=4 expandtab :
@@ -0,0 +1,285 @@
+'''
+    Copyright (c) 2016 Tim Savannah All Rights Reserved.
+    This software is licensed under the terms of the GPLv3.
+    This may change at my discretion, retroactively, and without notice.
+
+    You should have received a copy of this with the source distribution as a file titled, LICENSE.
+
+    The most current license can be found at:
+    https://github.com/kata198/usrsvc/LICENSE
+
+    This location may need to be changed at some point in the future, in which case
+    you are may email Tim Savannah <kata198 at gmail dot com>, or find them on the
+    current website intended for distribution of usrsvc.
+
+
+    Tests of SMTPTransport (and MailQueue retries through it), against a small SMTP server on a local socket.
+
+      Run with:  python -m pytest tests   or   python -m unittest discover -s tests
+'''
+
+# vim:set ts=4 shiftwidth=4 softtabstop=4 expandtab :
+
+import socket
+import threading
+import time
+import unittest
+
+from usrsvcmod import MailQueue as MailQueueModule
+from usrsvcmod.mail import SMTPTransport, SendmailFailedException
+from usrsvcmod.MailQueue import MailQueue
+
+
+class StubSMTPServer(object):
+    '''
+        StubSMTPServer - Just enough of an SMTP server to accept messages, on an ephemeral port of localhost.
+
+            Recipients in #refusedRecipients# are refused, the next #numTempFailures# messages are refused with a 451,
+              and #dropConnections# closes every open connection from the server side.
+    '''
+
+    def __init__(self):
+        self.listenSocket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.listenSocket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.listenSocket.bind( ('127.0.0.1', 0) )
+        self.listenSocket.listen(5)
+        self.port = self.listenSocket.getsockname()[1]
+
+        self.lock = threading.Lock()
+        self.refusedRecipients = set()
+        self.numTempFailures = 0
+
+        # list of (recipients, data) of accepted messages
+        self.messages = []
+        # Times a message was offered (MAIL FROM), accepted or not
+        self.attemptTimes = []
+        self.numConnections = 0
+        self.connections = []
+
+        self.keepGoing = True
+        self.thread = threading.Thread(target=self._acceptMain)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def _acceptMain(self):
+        while self.keepGoing:
+            try:
+                (conn, _addr) = self.listenSocket.accept()
+            except (socket.error, OSError):
+                return
+            with self.lock:
+                self.numConnections += 1
+                self.connections.append(conn)
+            thread = threading.Thread(target=self._serve, args=(conn, ))
+            thread.daemon = True
+            thread.start()
+
+    def _serve(self, conn):
+        connFile = conn.makefile('rb')
+        def reply(line):
+            conn.sendall(line.encode('ascii') + b'\r\n')
+
+        try:
+            reply('220 stub ESMTP')
+            recipients = []
+            while True:
+                line = connFile.readline()
+                if not line:
+                    return
+                line = line.decode('ascii').rstrip('\r\n')
+                command = line[:4].upper()
+
+                if command in ('EHLO', 'HELO'):
+                    reply('250 stub')
+                elif command == 'MAIL':
+                    with self.lock:
+                        self.attemptTimes.append(time.time())
+                        isTempFailure = self.numTempFailures > 0
+                        if isTempFailure:
+                            self.numTempFailures -= 1
+                    if isTempFailure:
+                        reply('451 try again later')
+                    else:
+                        recipients = []
+                        reply('250 OK')
+                elif command == 'RCPT':
+                    recipient = line[line.index('<') + 1:line.index('>')]
+                    if recipient in self.refusedRecipients:
+                        reply('550 no such user')
+                    else:
+                        recipients.append(recipient)
+                        reply('250 OK')
+                elif command == 'DATA':
+                    reply('354 go ahead')
+                    dataLines = []
+                    while True:
+                        dataLine = connFile.readline()
+                        if not dataLine or dataLine == b'.\r\n':
+                            break
+                        dataLines.append(dataLine)
+                    with self.lock:
+                        self.messages.append( (recipients, b''.join(dataLines)) )
+                    reply('250 queued')
+                elif command in ('RSET', 'NOOP'):
+                    reply('250 OK')
+                elif command == 'QUIT':
+                    reply('221 bye')
+                    return
+                else:
+                    reply('500 unknown command')
+        except (socket.error, OSError, ValueError):
+            return
+        finally:
+            connFile.close()
+            conn.close()
+
+    def dropConnections(self):
+        with self.lock:
+            connections = self.connections
+            self.connections = []
+        for conn in connections:
+            try:
+                conn.shutdown(socket.SHUT_RDWR)
+            except (socket.error, OSError):
+                pass
+
+    def close(self):
+        self.keepGoing = False
+        self.dropConnections()
+        # Close alone does not stop a blocked accept, which would keep accepting
+        try:
+            self.listenSocket.shutdown(socket.SHUT_RDWR)
+        except (socket.error, OSError):
+            pass
+        self.listenSocket.close()
+        self.thread.join(5)
+
+
+class TestSMTPTransport(unittest.TestCase):
+
+    def setUp(self):
+        self.server = StubSMTPServer()
+        self.transport = SMTPTransport('127.0.0.1', self.server.port, timeout=5)
+
+    def tearDown(self):
+        self.transport.close()
+        self.server.close()
+
+    def test_reusesConnection(self):
+        for i in range(3):
+            self.assertTrue(self.transport.send('a@example.com', 'Subject %d' %(i, ), 'Body'))
+
+        self.assertEqual(len(self.server.messages), 3)
+        self.assertEqual(self.server.numConnections, 1)
+        self.assertEqual(self.transport.numConnects, 1)
+
+        (recipients, data) = self.server.messages[0]
+        self.assertEqual(recipients, ['a@example.com'])
+        self.assertTrue(b'Subject: Subject 0' in data)
+
+    def test_reconnectsAfterServerDrops(self):
+        self.assertTrue(self.transport.send('a@example.com', 'First', 'Body'))
+        self.server.dropConnections()
+        # Give the server side a moment to close
+        time.sleep(.1)
+
+        self.assertTrue(self.transport.send('a@example.com', 'Second', 'Body'))
+
+        self.assertEqual(len(self.server.messages), 2)
+        self.assertEqual(self.transport.numConnects, 2)
+
+    def test_reconnectsAfterMaxIdle(self):
+        self.transport.maxIdle = 0
+        self.assertTrue(self.transport.send('a@example.com', 'First', 'Body'))
+        time.sleep(.05)
+        self.assertTrue(self.transport.send('a@example.com', 'Second', 'Body'))
+
+        self.assertEqual(self.transport.numConnects, 2)
+
+    def test_refusedRecipientRaises(self):
+        self.server.refusedRecipients.add('nobody@example.com')
+
+        # Some refused
+        self.assertRaises(SendmailFailedException, self.transport.send, 'a@example.com, nobody@example.com', 'Subject', 'Body')
+        # All refused
+        self.assertRaises(SendmailFailedException, self.transport.send, 'nobody@example.com', 'Subject', 'Body')
+
+        # The connection is still good for the next message
+        self.assertTrue(self.transport.send('a@example.com', 'Subject', 'Body'))
+        self.assertEqual(self.transport.numConnects, 1)
+
+    def test_connectFailureRaises(self):
+        self.server.close()
+        transport = SMTPTransport('127.0.0.1', self.server.port, timeout=5)
+
+        self.assertRaises(SendmailFailedException, transport.send, 'a@example.com', 'Subject', 'Body')
+
+
+class TestMailQueueRetry(unittest.TestCase):
+
+    def setUp(self):
+        self.oldRetryBackoff = MailQueueModule.RETRY_BACKOFF
+        MailQueueModule.RETRY_BACKOFF = .2
+
+        self.server = StubSMTPServer()
+        self.transport = SMTPTransport('127.0.0.1', self.server.port, timeout=5)
+
+    def tearDown(self):
+        MailQueueModule.RETRY_BACKOFF = self.oldRetryBackoff
+        self.transport.close()
+        self.server.close()
+
+    def _runQueue(self, mailQueue, waitUntil, timeout=10):
+        thread = threading.Thread(target=mailQueue.runWorker)
+        thread.daemon = True
+        thread.start()
+
+        deadline = time.time() + timeout
+        while not waitUntil() and time.time() < deadline:
+            time.sleep(.02)
+
+        mailQueue.stop()
+        thread.join(timeout)
+        self.assertFalse(thread.is_alive())
+
+    def test_retriesWithBackoff(self):
+        self.server.numTempFailures = 2
+
+        mailQueue = MailQueue(self.transport.send)
+        mailQueue.add('a@example.com', 'Subject', 'Body')
+        self._runQueue(mailQueue, lambda : len(self.server.messages) >= 1)
+
+        self.assertEqual(len(self.server.messages), 1)
+
+        attemptTimes = self.server.attemptTimes
+        self.assertEqual(len(attemptTimes), 3)
+        # Backoff doubles with each attempt
+        self.assertTrue(attemptTimes[1] - attemptTimes[0] >= .2 * .9)
+        self.assertTrue(attemptTimes[2] - attemptTimes[1] >= .4 * .9)
+
+        stats = mailQueue.getStats()
+        self.assertEqual(stats['sent'], 1)
+        self.assertEqual(stats['retried'], 2)
+        self.assertEqual(stats['failed'], 0)
+
+    def test_givesUpAfterMaxAttempts(self):
+        self.server.numTempFailures = MailQueueModule.MAX_SEND_ATTEMPTS
+        MailQueueModule.RETRY_BACKOFF = .02
+
+        mailQueue = MailQueue(self.transport.send)
+        mailQueue.add('a@example.com', 'Subject', 'Body')
+        self._runQueue(mailQueue, lambda : mailQueue.getStats()['failed'] >= 1)
+
+        self.assertEqual(len(self.server.messages), 0)
+        self.assertEqual(len(self.server.attemptTimes), MailQueueModule.MAX_SEND_ATTEMPTS)
+
+        stats = mailQueue.getStats()
+        self.assertEqual(stats['failed'], 1)
+        self.assertEqual(stats['retried'], MailQueueModule.MAX_SEND_ATTEMPTS - 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
+
+
+# vim:set ts=4 shiftwidth=4 softtabstop=4 expandtab :
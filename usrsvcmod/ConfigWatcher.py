@@ -0,0 +1,428 @@
+'''
+    Copyright (c) 2016 Tim Savannah All Rights Reserved.
+    This software is licensed under the terms of the GPLv3.
+    This may change at my discretion, retroactively, and without notice.
+
+    You should have received a copy of this with the source distribution as a file titled, LICENSE.
+
+    The most current license can be found at:
+    https://github.com/kata198/usrsvc/LICENSE
+
+    This location may need to be changed at some point in the future, in which case
+    you are may email Tim Savannah <kata198 at gmail dot com>, or find them on the
+    current website intended for distribution of usrsvc.
+
+
+    ConfigWatcher - Watches the main config file and config_dir for changes (for auto_reload), using inotify when available.
+'''
+
+# vim:set ts=4 shiftwidth=4 softtabstop=4 expandtab :
+
+import errno
+import fcntl
+import glob
+import os
+import select
+import struct
+import threading
+import time
+
+from .logging import logErr
+
+__all__ = ('ConfigWatcher', 'hasInotify')
+
+# From sys/inotify.h
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = 0o2000000
+
+# Files are watched through their directory, so a file replaced by rename (as most editors and deploy tools do) is still seen.
+WATCH_MASK = IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR
+
+# struct inotify_event, without the variable length name which follows
+_EVENT_HEADER = struct.Struct('=iIII')
+
+# A reload happens once no change has been seen for this many seconds, so a burst of writes (like a deploy) causes a single reload.
+DEBOUNCE_SECONDS = .5
+
+# Without inotify, how often to compare the mtime/size of every config file. Also how often to retry watching a missing config_dir.
+POLL_INTERVAL = 2.0
+
+_libc = None
+
+def _getLibc():
+    global _libc
+    if _libc is None:
+        import ctypes
+        import ctypes.util
+        _libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+    return _libc
+
+
+def _raiseErrno():
+    import ctypes
+    err = ctypes.get_errno()
+    raise OSError(err, os.strerror(err))
+
+
+def inotifyInit():
+    '''
+        inotifyInit - Create a non-blocking, close-on-exec inotify fd.
+
+        @return <int> - The fd
+
+        @raises OSError - If inotify is not supported
+    '''
+    fd = _getLibc().inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+    if fd < 0:
+        _raiseErrno()
+    return fd
+
+
+def inotifyAddWatch(fd, path, mask):
+    '''
+        inotifyAddWatch - Add (or replace) a watch on a path
+
+        @param fd <int> - inotify fd
+        @param path <str> - Path to watch
+        @param mask <int> - IN_* events to watch
+
+        @return <int> - The watch descriptor
+
+        @raises OSError - If the path cannot be watched (like it does not exist)
+    '''
+    if not isinstance(path, bytes):
+        path = path.encode('utf-8')
+    wd = _getLibc().inotify_add_watch(fd, path, mask)
+    if wd < 0:
+        _raiseErrno()
+    return wd
+
+
+global _HAS_INOTIFY
+_HAS_INOTIFY = None
+
+def hasInotify():
+    '''
+        hasInotify - Check if inotify is supported on this system.
+
+        @return <bool> - True if supported. Result is cached after first call.
+    '''
+    global _HAS_INOTIFY
+    if _HAS_INOTIFY is None:
+        try:
+            os.close(inotifyInit())
+            _HAS_INOTIFY = True
+        except:
+            _HAS_INOTIFY = False
+
+    return _HAS_INOTIFY
+
+
+def _getStatKey(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_mtime, st.st_size, st.st_ino)
+
+
+class ConfigWatcher(object):
+    '''
+        ConfigWatcher - Calls #onChange# from a background thread whenever the main config file, or any *.cfg in config_dir,
+            is written, created, removed, or renamed, once they have been quiet for DEBOUNCE_SECONDS.
+
+            Uses inotify when supported, otherwise compares the mtime/size of every config file every POLL_INTERVAL seconds.
+    '''
+
+    def __init__(self, mainConfigFile, configDir, onChange, debounce=DEBOUNCE_SECONDS):
+        '''
+            @param mainConfigFile <str> - Path to the main config ( $HOME/usrsvc.cfg )
+            @param configDir <str/None> - config_dir from [Main], or None if not set
+            @param onChange <function> - Called with no arguments to reload the config. If it returns False (like the new config
+                failed to parse), nothing more happens until the next change.
+            @param debounce <float> - Seconds without a change before #onChange# is called
+        '''
+        self.mainConfigFile = mainConfigFile
+        self.mainConfigDir = os.path.dirname(mainConfigFile) or '.'
+        self.mainConfigName = os.path.basename(mainConfigFile)
+        self.configDir = configDir
+        self.onChange = onChange
+        self.debounce = debounce
+
+        self.lock = threading.Lock()
+        self.keepGoing = True
+        self.thread = None
+
+        # Time of the last change seen, or None if none is pending
+        self.lastChangeAt = None
+
+        self.inotifyFd = None
+        # Path of directory -> watch descriptor, and the reverse
+        self.watchedDirs = {}
+        self.wdToDir = {}
+        # Set when #setConfigDir# changes what we watch
+        self.watchesChanged = True
+
+        # For polling, path -> (mtime, size, inode)
+        self.lastSnapshot = None
+
+        (self.wakeReadFd, self.wakeWriteFd) = os.pipe()
+        for fd in (self.wakeReadFd, self.wakeWriteFd):
+            fcntl.fcntl(fd, fcntl.F_SETFL, fcntl.fcntl(fd, fcntl.F_GETFL) | os.O_NONBLOCK)
+            fcntl.fcntl(fd, fcntl.F_SETFD, fcntl.fcntl(fd, fcntl.F_GETFD) | fcntl.FD_CLOEXEC)
+
+        if hasInotify():
+            try:
+                self.inotifyFd = inotifyInit()
+            except OSError:
+                self.inotifyFd = None
+
+    def usesInotify(self):
+        '''
+            usesInotify - Check if changes are seen through inotify (or False if polling)
+
+            @return <bool>
+        '''
+        return self.inotifyFd is not None
+
+    def start(self):
+        '''
+            start - Start watching, in a background thread.
+        '''
+        self.thread = threading.Thread(target=self._watchMain)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        '''
+            stop - Stop watching, and wait for the thread to exit.
+        '''
+        self.keepGoing = False
+        self._wake()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+        for fd in (self.inotifyFd, self.wakeReadFd, self.wakeWriteFd):
+            if fd is not None:
+                try:
+                    os.close(fd)
+                except:
+                    pass
+        self.inotifyFd = None
+
+    def setConfigDir(self, configDir):
+        '''
+            setConfigDir - Update the config_dir being watched (like after config_dir was changed in a reload)
+
+            @param configDir <str/None> - config_dir from [Main]
+        '''
+        with self.lock:
+            if configDir == self.configDir:
+                return
+            self.configDir = configDir
+            self.watchesChanged = True
+            self.lastSnapshot = None
+        self._wake()
+
+    def _wake(self):
+        try:
+            os.write(self.wakeWriteFd, b'x')
+        except OSError as e:
+            # EAGAIN means the pipe is full, so a wakeup is already pending.
+            if e.errno != errno.EAGAIN:
+                raise
+
+    def _isConfigFile(self, dirPath, name):
+        if dirPath == self.mainConfigDir and name == self.mainConfigName:
+            return True
+        if dirPath == self.configDir and name.endswith('.cfg'):
+            return True
+        return False
+
+    def _getWantedDirs(self):
+        with self.lock:
+            wantDirs = set([self.mainConfigDir])
+            if self.configDir:
+                wantDirs.add(self.configDir)
+        return wantDirs
+
+    def _updateWatches(self):
+        '''
+            _updateWatches - Watch exactly the directories we need to, as far as they exist.
+        '''
+        self.watchesChanged = False
+        wantDirs = self._getWantedDirs()
+
+        for dirPath in list(self.watchedDirs.keys()):
+            if dirPath not in wantDirs:
+                wd = self.watchedDirs.pop(dirPath)
+                self.wdToDir.pop(wd, None)
+                try:
+                    _getLibc().inotify_rm_watch(self.inotifyFd, wd)
+                except:
+                    pass
+
+        for dirPath in wantDirs:
+            if dirPath in self.watchedDirs:
+                continue
+            try:
+                wd = inotifyAddWatch(self.inotifyFd, dirPath, WATCH_MASK)
+            except OSError:
+                # Does not exist (yet). Retried every POLL_INTERVAL.
+                continue
+            self.watchedDirs[dirPath] = wd
+            self.wdToDir[wd] = dirPath
+
+    def _readEvents(self):
+        '''
+            _readEvents - Read all pending inotify events.
+
+            @return <bool> - True if any of them touched a config file
+        '''
+        changed = False
+        while True:
+            try:
+                data = os.read(self.inotifyFd, 65536)
+            except OSError as e:
+                if e.errno in (errno.EAGAIN, errno.EINTR):
+                    break
+                raise
+            if not data:
+                break
+
+            offset = 0
+            dataLen = len(data)
+            while offset + _EVENT_HEADER.size <= dataLen:
+                (wd, mask, cookie, nameLen) = _EVENT_HEADER.unpack_from(data, offset)
+                offset += _EVENT_HEADER.size
+                name = data[offset:offset + nameLen].rstrip(b'\0').decode('utf-8', 'replace')
+                offset += nameLen
+
+                if mask & IN_Q_OVERFLOW:
+                    # Lost events, so assume anything could have changed
+                    changed = True
+                    continue
+
+                dirPath = self.wdToDir.get(wd, None)
+                if dirPath is None:
+                    continue
+
+                if mask & (IN_DELETE_SELF | IN_MOVE_SELF | IN_IGNORED):
+                    # The directory itself went away. Watch again once it is back.
+                    self.watchedDirs.pop(dirPath, None)
+                    self.wdToDir.pop(wd, None)
+                    changed = True
+                    continue
+
+                if self._isConfigFile(dirPath, name):
+                    changed = True
+
+        return changed
+
+    def _getSnapshot(self):
+        with self.lock:
+            configDir = self.configDir
+
+        snapshot = { self.mainConfigFile : _getStatKey(self.mainConfigFile) }
+        if configDir:
+            snapshot[configDir] = _getStatKey(configDir)
+            for fname in glob.glob(configDir + '/*.cfg'):
+                snapshot[fname] = _getStatKey(fname)
+        return snapshot
+
+    def _pollForChanges(self):
+        snapshot = self._getSnapshot()
+        if self.lastSnapshot is None:
+            self.lastSnapshot = snapshot
+            return False
+
+        if snapshot != self.lastSnapshot:
+            self.lastSnapshot = snapshot
+            return True
+
+        return False
+
+    def _watchMain(self):
+        allWatched = True
+        lastPollAt = time.time()
+        while self.keepGoing is True:
+            try:
+                if self.inotifyFd is not None:
+                    if self.watchesChanged is True:
+                        self._updateWatches()
+                    elif allWatched is False and time.time() - lastPollAt >= POLL_INTERVAL:
+                        lastPollAt = time.time()
+                        numWatchedBefore = len(self.watchedDirs)
+                        self._updateWatches()
+                        if len(self.watchedDirs) > numWatchedBefore:
+                            # A directory which was missing is back. Anything in it is new to us.
+                            self.lastChangeAt = time.time()
+                    allWatched = not (self._getWantedDirs() - set(self.watchedDirs.keys()))
+
+                now = time.time()
+                if self.lastChangeAt is not None:
+                    timeout = max(self.lastChangeAt + self.debounce - now, 0)
+                elif self.inotifyFd is None or allWatched is False:
+                    timeout = max(lastPollAt + POLL_INTERVAL - now, 0)
+                else:
+                    timeout = None
+
+                readFds = [self.wakeReadFd]
+                if self.inotifyFd is not None:
+                    readFds.append(self.inotifyFd)
+
+                try:
+                    (readable, _w, _x) = select.select(readFds, [], [], timeout)
+                except (select.error, IOError, OSError):
+                    # EINTR
+                    readable = []
+
+                if self.wakeReadFd in readable:
+                    try:
+                        while os.read(self.wakeReadFd, 4096):
+                            pass
+                    except OSError:
+                        pass
+
+                if self.keepGoing is False:
+                    break
+
+                if self.inotifyFd is not None:
+                    if self.inotifyFd in readable and self._readEvents():
+                        self.lastChangeAt = time.time()
+                        if not (self._getWantedDirs() - set(self.watchedDirs.keys())):
+                            continue
+                        # A directory was removed, so start retrying it
+                        allWatched = False
+                elif time.time() - lastPollAt >= POLL_INTERVAL:
+                    lastPollAt = time.time()
+                    if self._pollForChanges():
+                        self.lastChangeAt = lastPollAt
+
+                if self.lastChangeAt is not None and time.time() - self.lastChangeAt >= self.debounce:
+                    # Files have been stable for the debounce period
+                    self.lastChangeAt = None
+                    self.onChange()
+                    if self.inotifyFd is None:
+                        # Don't see our own reload as a change
+                        self.lastSnapshot = self._getSnapshot()
+            except Exception as e:
+                logErr('Error watching config files: %s\n' %(str(e),))
+                time.sleep(POLL_INTERVAL)
+
+
+# vim:set ts=4 shiftwidth=4 softtabstop=4 expandtab :
@@ -0,0 +1,251 @@
+'''
+    Copyright (c) 2016 Tim Savannah All Rights Reserved.
+    This software is licensed under the terms of the GPLv3.
+    This may change at my discretion, retroactively, and without notice.
+
+    You should have received a copy of this with the source distribution as a file titled, LICENSE.
+
+    The most current license can be found at:
+    https://github.com/kata198/usrsvc/LICENSE
+
+    This location may need to be changed at some point in the future, in which case
+    you are may email Tim Savannah <kata198 at gmail dot com>, or find them on the
+    current website intended for distribution of usrsvc.
+
+
+    ControlSocket - The UNIX domain socket through which the usrsvc client talks to a running usrsvcd.
+
+        The protocol is one request per connection. The client sends a single line of JSON, like:
+
+            {"action": "status", "program": "myprog"}
+
+        and the daemon answers with a single line of JSON, which always contains "returnCode" (a ReturnCodes value).
+'''
+
+# vim:set ts=4 shiftwidth=4 softtabstop=4 expandtab :
+
+import json
+import os
+import socket
+import struct
+import threading
+
+from .constants import ReturnCodes
+from .logging import logErr
+
+__all__ = ('ControlServer', 'ControlClient', 'getControlSocketPath', 'CONTROL_ACTIONS')
+
+# Actions understood by the daemon
+CONTROL_ACTIONS = ('status', 'start', 'stop', 'restart', 'list', 'stats')
+
+# From asm-generic/socket.h , for pythons which do not define socket.SO_PEERCRED
+SO_PEERCRED = getattr(socket, 'SO_PEERCRED', 17)
+
+# Max size of a single request or response line
+MAX_MESSAGE_SIZE = 1024 * 1024
+
+
+def getControlSocketPath(uid=None):
+    '''
+        getControlSocketPath - Get the path of the control socket for a user.
+
+            This is fixed (not configurable), so the client can find the daemon without parsing any config.
+
+        @param uid <int/None> - uid, or None for current user
+
+        @return <str> - Path
+    '''
+    if uid is None:
+        uid = os.getuid()
+    return os.environ.get('HOME', '/tmp') + '/.%d_usrsvcd.sock' %(uid, )
+
+
+def _readLine(sock):
+    chunks = []
+    size = 0
+    while True:
+        chunk = sock.recv(65536)
+        if not chunk:
+            break
+        chunks.append(chunk)
+        size += len(chunk)
+        if b'\n' in chunk:
+            break
+        if size > MAX_MESSAGE_SIZE:
+            raise ValueError('Message too large')
+
+    data = b''.join(chunks)
+    if b'\n' not in data:
+        raise ValueError('Incomplete message')
+
+    return json.loads(data[:data.index(b'\n')].decode('utf-8'))
+
+
+def _writeLine(sock, obj):
+    # default=str so any odd value (like a Program attribute) is sent as its string, rather than failing the whole response
+    sock.sendall(json.dumps(obj, default=str).encode('utf-8') + b'\n')
+
+
+class ControlServer(object):
+    '''
+        ControlServer - Listens on the control socket, and answers each request in its own thread.
+
+            Only connections from our own uid (checked with SO_PEERCRED) are answered, and the socket is created mode 0600.
+    '''
+
+    def __init__(self, handler, path=None):
+        '''
+            @param handler <function> - Called as handler(request <dict>) and returns the response <dict>. Called from a connection thread.
+            @param path <str/None> - Socket path, or None for the default (getControlSocketPath())
+        '''
+        self.handler = handler
+        self.path = path or getControlSocketPath()
+
+        self.sock = None
+        self.keepGoing = True
+        self.thread = None
+
+    def start(self):
+        '''
+            start - Bind the socket and start accepting connections in a background thread.
+
+                Any existing socket file is removed first, so only call this once we know no other usrsvcd is running.
+
+            @raises socket.error/OSError if the socket cannot be created
+        '''
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        oldUmask = os.umask(0o177)
+        try:
+            sock.bind(self.path)
+        finally:
+            os.umask(oldUmask)
+        os.chmod(self.path, 0o600)
+
+        sock.listen(16)
+        # So we notice a shutdown
+        sock.settimeout(1.0)
+        self.sock = sock
+
+        self.thread = threading.Thread(target=self._acceptMain)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def _acceptMain(self):
+        while self.keepGoing is True:
+            try:
+                (conn, _addr) = self.sock.accept()
+            except socket.timeout:
+                continue
+            except (socket.error, IOError, OSError) as e:
+                if self.keepGoing is False:
+                    break
+                logErr('Error accepting control connection: %s\n' %(str(e),))
+                continue
+
+            thread = threading.Thread(target=self._handleConnection, args=(conn,))
+            thread.daemon = True
+            thread.start()
+
+    def _handleConnection(self, conn):
+        try:
+            conn.settimeout(None)
+            (peerPid, peerUid, peerGid) = struct.unpack('3i', conn.getsockopt(socket.SOL_SOCKET, SO_PEERCRED, struct.calcsize('3i')))
+            if peerUid != os.getuid():
+                logErr('Refusing control connection from uid=%d pid=%d\n' %(peerUid, peerPid))
+                return
+
+            request = _readLine(conn)
+            if not isinstance(request, dict):
+                raise ValueError('Request must be an object')
+
+            try:
+                response = self.handler(request)
+            except Exception as e:
+                logErr('Error handling control request %s: %s\n' %(str(request), str(e)))
+                response = {'returnCode' : int(ReturnCodes.UNKNOWN_FAILURE), 'error' : str(e)}
+
+            _writeLine(conn, response)
+        except Exception as e:
+            logErr('Error on control connection: %s\n' %(str(e),))
+        finally:
+            try:
+                conn.close()
+            except:
+                pass
+
+    def stop(self):
+        '''
+            stop - Stop accepting connections, and remove the socket file.
+        '''
+        self.keepGoing = False
+        if self.sock is not None:
+            try:
+                self.sock.close()
+            except:
+                pass
+            self.sock = None
+
+        try:
+            os.unlink(self.path)
+        except:
+            pass
+
+
+class ControlClient(object):
+    '''
+        ControlClient - Sends requests to usrsvcd over the control socket.
+    '''
+
+    def __init__(self, path=None, connectTimeout=2.0):
+        '''
+            @param path <str/None> - Socket path, or None for the default (getControlSocketPath())
+            @param connectTimeout <float> - Seconds to wait on connecting
+        '''
+        self.path = path or getControlSocketPath()
+        self.connectTimeout = connectTimeout
+
+    def isAvailable(self):
+        '''
+            isAvailable - Quick check if a daemon may be listening (the socket file exists)
+
+            @return <bool>
+        '''
+        return os.path.exists(self.path)
+
+    def request(self, action, programName=None, timeout=None):
+        '''
+            request - Send a request and wait for the response
+
+            @param action <str> - One of CONTROL_ACTIONS
+            @param programName <str/None> - Program name, for actions which take one
+            @param timeout <float/None> - Max seconds to wait for the response, or None to wait as long as the action takes.
+
+            @return <dict> - The response. Always has "returnCode"
+
+            @raises socket.error/IOError/OSError if the daemon cannot be reached, ValueError on a bad response.
+        '''
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.settimeout(self.connectTimeout)
+            sock.connect(self.path)
+            sock.settimeout(timeout)
+
+            request = {'action' : action}
+            if programName is not None:
+                request['program'] = programName
+            _writeLine(sock, request)
+
+            response = _readLine(sock)
+        finally:
+            sock.close()
+
+        if not isinstance(response, dict) or 'returnCode' not in response:
+            raise ValueError('Invalid response from usrsvcd: %s' %(str(response),))
+
+        return response
+
+
+# vim:set ts=4 shiftwidth=4 softtabstop=4 expandtab :
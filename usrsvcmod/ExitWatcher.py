@@ -0,0 +1,242 @@
+'''
+    Copyright (c) 2016 Tim Savannah All Rights Reserved.
+    This software is licensed under the terms of the GPLv3.
+    This may change at my discretion, retroactively, and without notice.
+
+    You should have received a copy of this with the source distribution as a file titled, LICENSE.
+
+    The most current license can be found at:
+    https://github.com/kata198/usrsvc/LICENSE
+
+    This location may need to be changed at some point in the future, in which case
+    you are may email Tim Savannah <kata198 at gmail dot com>, or find them on the
+    current website intended for distribution of usrsvc.
+
+
+    ExitWatcher - Event-driven detection of program exit, using pidfds where the kernel supports them.
+'''
+
+# vim:set ts=4 shiftwidth=4 softtabstop=4 expandtab :
+
+import errno
+import fcntl
+import os
+import select
+import threading
+
+__all__ = ('ExitWatcher', 'hasPidfd', 'pidfdOpen')
+
+# pidfd_open uses the same syscall number on every architecture (added in Linux 5.3)
+SYS_PIDFD_OPEN = 434
+
+_libc = None
+
+def pidfdOpen(pid):
+    '''
+        pidfdOpen - Obtain a pidfd (a file descriptor referring to a process) for the given pid.
+
+            Uses os.pidfd_open if available (python 3.9+), otherwise calls the syscall directly through libc.
+
+            The returned fd is always close-on-exec.
+
+        @param pid <int> - Process ID
+
+        @return <int> - The pidfd
+
+        @raises OSError - If the process does not exist (ESRCH) or pidfd is not supported (ENOSYS)
+    '''
+    if hasattr(os, 'pidfd_open'):
+        return os.pidfd_open(pid)
+
+    global _libc
+    if _libc is None:
+        import ctypes
+        import ctypes.util
+        _libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+
+    import ctypes
+    fd = _libc.syscall(SYS_PIDFD_OPEN, int(pid), 0)
+    if fd < 0:
+        err = ctypes.get_errno()
+        raise OSError(err, os.strerror(err))
+    return fd
+
+
+global _HAS_PIDFD
+_HAS_PIDFD = None
+
+def hasPidfd():
+    '''
+        hasPidfd - Check if pidfds are supported on this system.
+
+        @return <bool> - True if supported. Result is cached after first call.
+    '''
+    global _HAS_PIDFD
+    if _HAS_PIDFD is None:
+        try:
+            fd = pidfdOpen(os.getpid())
+            os.close(fd)
+            _HAS_PIDFD = True
+        except:
+            _HAS_PIDFD = False
+
+    return _HAS_PIDFD
+
+
+def _setNonBlockingCloexec(fd):
+    flags = fcntl.fcntl(fd, fcntl.F_GETFL)
+    fcntl.fcntl(fd, fcntl.F_SETFL, flags | os.O_NONBLOCK)
+    flags = fcntl.fcntl(fd, fcntl.F_GETFD)
+    fcntl.fcntl(fd, fcntl.F_SETFD, flags | fcntl.FD_CLOEXEC)
+
+
+class ExitWatcher(object):
+    '''
+        ExitWatcher - Holds a pidfd for every watched program, and waits on all of them at once.
+
+            #wait# returns as soon as any watched process exits, when #wake# is called (like from a signal handler),
+              or when the timeout expires. When pidfds are not supported (or disabled), #wait# is simply an interruptible sleep,
+              so the caller's polling remains the fallback.
+    '''
+
+    def __init__(self, usePidfd=True):
+        '''
+            @param usePidfd <bool> - If False, never use pidfds (just an interruptible sleep).
+        '''
+        self.usePidfd = bool(usePidfd and hasPidfd())
+
+        # programName -> (pid, pidfd)
+        self.watched = {}
+        # pidfd -> programName
+        self.fdToName = {}
+
+        self.lock = threading.Lock()
+
+        (self.wakeReadFd, self.wakeWriteFd) = os.pipe()
+        _setNonBlockingCloexec(self.wakeReadFd)
+        _setNonBlockingCloexec(self.wakeWriteFd)
+
+        self.poller = select.poll()
+        self.poller.register(self.wakeReadFd, select.POLLIN)
+
+    def watch(self, programName, pid):
+        '''
+            watch - Start watching a program's pid. If the program is already watched with a different pid, the old one is dropped.
+
+            @param programName <str> - Name of program
+            @param pid <int> - pid of the running program
+
+            @return <bool> - True if the pid is being watched, False if pidfds are unavailable or the process is already gone.
+        '''
+        if not self.usePidfd:
+            return False
+
+        with self.lock:
+            if programName in self.watched:
+                if self.watched[programName][0] == pid:
+                    return True
+                self._unwatch(programName)
+
+            try:
+                pidfd = pidfdOpen(pid)
+            except OSError:
+                # Process is gone already (or pidfd not permitted). Next check will catch it.
+                return False
+
+            self.watched[programName] = (pid, pidfd)
+            self.fdToName[pidfd] = programName
+            self.poller.register(pidfd, select.POLLIN)
+
+        # A #wait# already in progress (in another thread) only polls the fds registered when it began, so have it start over.
+        self.wake()
+
+        return True
+
+    def unwatch(self, programName):
+        '''
+            unwatch - Stop watching a program, if watched.
+
+            @param programName <str> - Name of program
+        '''
+        with self.lock:
+            self._unwatch(programName)
+
+    def _unwatch(self, programName):
+        if programName not in self.watched:
+            return
+
+        (pid, pidfd) = self.watched.pop(programName)
+        self.fdToName.pop(pidfd, None)
+        try:
+            self.poller.unregister(pidfd)
+        except:
+            pass
+        try:
+            os.close(pidfd)
+        except:
+            pass
+
+    def unwatchAll(self):
+        '''
+            unwatchAll - Stop watching all programs
+        '''
+        with self.lock:
+            for programName in list(self.watched.keys()):
+                self._unwatch(programName)
+
+    def getWatchedNames(self):
+        '''
+            getWatchedNames - Get the names of all programs currently watched
+
+            @return list<str> - Program names
+        '''
+        with self.lock:
+            return list(self.watched.keys())
+
+    def wake(self):
+        '''
+            wake - Cause a current (or the next) #wait# to return immediately. Safe to call from a signal handler.
+        '''
+        try:
+            os.write(self.wakeWriteFd, b'x')
+        except OSError as e:
+            # EAGAIN means the pipe is full, so a wakeup is already pending.
+            if e.errno != errno.EAGAIN:
+                raise
+
+    def wait(self, timeout):
+        '''
+            wait - Wait up to #timeout# seconds for a watched program to exit, or for #wake# to be called.
+
+                Programs which have exited are removed from the watch list.
+
+            @param timeout <float> - Max number of seconds to wait
+
+            @return list<str> - Names of programs whose watched pid exited. Empty list on timeout or wake.
+        '''
+        try:
+            events = self.poller.poll(int(timeout * 1000))
+        except (select.error, IOError, OSError) as e:
+            # EINTR - a signal was delivered, treat as a wakeup.
+            events = []
+
+        exited = []
+        for (fd, event) in events:
+            if fd == self.wakeReadFd:
+                try:
+                    while os.read(self.wakeReadFd, 4096):
+                        pass
+                except OSError:
+                    pass
+                continue
+
+            with self.lock:
+                programName = self.fdToName.get(fd, None)
+                if programName is not None:
+                    exited.append(programName)
+                    self._unwatch(programName)
+
+        return exited
+
+
+# vim:set ts=4 shiftwidth=4 softtabstop=4 expandtab :
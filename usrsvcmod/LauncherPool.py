@@ -0,0 +1,390 @@
+'''
+    Copyright (c) 2016 Tim Savannah All Rights Reserved.
+    This software is licensed under the terms of the GPLv3.
+    This may change at my discretion, retroactively, and without notice.
+
+    You should have received a copy of this with the source distribution as a file titled, LICENSE.
+
+    The most current license can be found at:
+    https://github.com/kata198/usrsvc/LICENSE
+
+    This location may need to be changed at some point in the future, in which case
+    you are may email Tim Savannah <kata198 at gmail dot com>, or find them on the
+    current website intended for distribution of usrsvc.
+
+
+    LauncherPool - A small pool of pre-forked workers which perform start/stop/restart actions for usrsvcd.
+'''
+
+# vim:set ts=4 shiftwidth=4 softtabstop=4 expandtab :
+
+import fcntl
+import os
+import select
+import signal
+import threading
+import time
+
+from collections import deque
+
+from .constants import ReturnCodes
+from .logging import logMsg, logErr, logForkLock
+
+__all__ = ('LauncherPool', 'LauncherRequest')
+
+# Number of seconds an idle worker waits for a request before reaping its children
+WORKER_REAP_INTERVAL = .5
+
+# A worker which exits unexpectedly is replaced, unless it had been running for less than this many seconds
+#  (so one which dies right away is not forked over and over). Once none are left, actions fork per action.
+WORKER_MIN_LIFETIME = 10
+
+
+class LauncherRequest(object):
+    '''
+        LauncherRequest - A handle on an action submitted to the LauncherPool.
+
+            Has the same is_alive / join / exitcode interface as the multiprocessing.Process usrsvcd used to create for each action.
+    '''
+
+    def __init__(self, action, programConfig):
+        '''
+            @param action <str> - start/stop/restart
+            @param programConfig <ProgramConfig> - Config of the program
+        '''
+        self.action = action
+        self.programConfig = programConfig
+
+        self.exitcode = None
+        self.completedEvent = threading.Event()
+
+    def is_alive(self):
+        return not self.completedEvent.is_set()
+
+    def join(self, timeout=None):
+        self.completedEvent.wait(timeout)
+
+    def _complete(self, exitcode):
+        self.exitcode = exitcode
+        self.completedEvent.set()
+
+    def __str__(self):
+        return 'LauncherRequest< %s %s exitcode=%s >' %(self.action, self.programConfig.name, str(self.exitcode))
+
+
+def _setCloexec(fd):
+    # Programs are launched with close_fds=False, so make sure they never inherit (and hold open) our pipes.
+    flags = fcntl.fcntl(fd, fcntl.F_GETFD)
+    fcntl.fcntl(fd, fcntl.F_SETFD, flags | fcntl.FD_CLOEXEC)
+
+
+def _reapWorkerChildren(conn):
+    '''
+        _reapWorkerChildren - Reap any programs this worker launched which have since exited, and report their status to usrsvcd.
+    '''
+    while True:
+        try:
+            (pid, status) = os.waitpid(-1, os.WNOHANG)
+        except OSError as e:
+            # ECHILD - No children
+            return
+        if pid == 0:
+            return
+        conn.send( ('exit', pid, status) )
+
+
+def _ignoreSignal(*args, **kwargs):
+    pass
+
+
+def _launcherWorkerMain(conn, usrsvc):
+    '''
+        _launcherWorkerMain - Main of a launcher worker process. Handles one request at a time.
+
+            Programs started here remain our children, so while idle we reap them and forward their exit status.
+              SIGCHLD wakes us (through the signal wakeup fd), so that happens right when they exit.
+    '''
+    # Prevent signals from interrupting us (same as usrsvc), and don't carry over usrsvcd's handlers.
+    #  These get a no-op handler rather than SIG_IGN, so programs we start do not inherit them as ignored
+    #  (a program ignoring SIGTERM could only be stopped by SIGKILL).
+    for signum in (signal.SIGTERM, signal.SIGINT, signal.SIGUSR1):
+        signal.signal(signum, _ignoreSignal)
+
+    (wakeReadFd, wakeWriteFd) = os.pipe()
+    for fd in (wakeReadFd, wakeWriteFd):
+        _setCloexec(fd)
+        fcntl.fcntl(fd, fcntl.F_SETFL, fcntl.fcntl(fd, fcntl.F_GETFL) | os.O_NONBLOCK)
+    signal.set_wakeup_fd(wakeWriteFd)
+    signal.signal(signal.SIGCHLD, _ignoreSignal)
+
+    connFd = conn.fileno()
+    while True:
+        try:
+            try:
+                (readable, _w, _x) = select.select([connFd, wakeReadFd], [], [], WORKER_REAP_INTERVAL)
+            except (select.error, IOError, OSError):
+                # EINTR
+                readable = []
+
+            if wakeReadFd in readable:
+                try:
+                    os.read(wakeReadFd, 4096)
+                except OSError:
+                    pass
+
+            _reapWorkerChildren(conn)
+            if connFd not in readable:
+                continue
+
+            request = conn.recv()
+        except (EOFError, IOError, OSError):
+            # usrsvcd went away. Our programs are reparented when we exit.
+            break
+
+        if request is None:
+            # Shutdown
+            break
+
+        (requestId, action, programConfig) = request
+        try:
+            ret = usrsvc.doLockedProgramAction(action, programConfig)
+        except Exception as e:
+            logErr('Launcher worker got exception performing %s on %s: %s\n' %(action, programConfig.name, str(e)))
+            ret = ReturnCodes.UNKNOWN_FAILURE
+
+        try:
+            # Like a program this action stopped, so usrsvcd has its exit status along with the result
+            _reapWorkerChildren(conn)
+            conn.send( ('result', requestId, int(ret)) )
+        except (IOError, OSError):
+            break
+
+    try:
+        conn.close()
+    except:
+        pass
+
+
+class _LauncherWorker(object):
+
+    def __init__(self, process, conn):
+        self.process = process
+        self.conn = conn
+        self.startedAt = time.time()
+        # The LauncherRequest currently being handled, and its id
+        self.currentRequest = None
+        self.currentRequestId = None
+
+
+class LauncherPool(object):
+    '''
+        LauncherPool - Pre-forked launcher workers, which receive start/stop/restart requests over a pipe and send back ReturnCodes.
+
+            Create this early, before usrsvcd starts other threads, so the workers are lean copies which hold no thread's locks.
+
+            Requests are queued while every worker is busy. A single reader thread collects results, and the exit status
+              of programs which workers have reaped (see #onChildExit#). A worker which exits unexpectedly is replaced
+              (see WORKER_MIN_LIFETIME).
+    '''
+
+    def __init__(self, config, numWorkers, onChildExit=None):
+        '''
+            @param config <UsrsvcConfig> - Config at the time of fork. Each request carries the current ProgramConfig, so this need not be kept up to date.
+            @param numWorkers <int> - Number of workers to fork
+            @param onChildExit <None/function> - If provided, called as onChildExit(pid, status) from the reader thread
+                whenever a worker reaps one of the programs it launched.
+        '''
+        import multiprocessing
+        from .client.usrsvc import Usrsvc
+
+        if hasattr(multiprocessing, 'get_context'):
+            # Workers must be forked, whatever the platform default start method is.
+            multiprocessing = multiprocessing.get_context('fork')
+
+        self.onChildExit = onChildExit
+        self.multiprocessing = multiprocessing
+        self.usrsvc = Usrsvc(config)
+
+        self.lock = threading.Lock()
+        self.pendingRequests = deque()
+        self.idleWorkers = []
+        self.workers = []
+        self.nextRequestId = 1
+
+        self.keepGoing = True
+        with self.lock:
+            for i in range(numWorkers):
+                self._startWorker()
+
+        self.readerThread = threading.Thread(target=self._readerMain)
+        self.readerThread.daemon = True
+        self.readerThread.start()
+
+    def _startWorker(self):
+        # Must hold self.lock
+        (parentConn, childConn) = self.multiprocessing.Pipe(duplex=True)
+        _setCloexec(parentConn.fileno())
+        _setCloexec(childConn.fileno())
+        process = self.multiprocessing.Process(target=_launcherWorkerMain, args=(childConn, self.usrsvc))
+        process.daemon = False
+        try:
+            # A replacement is forked while usrsvcd's other threads run
+            with logForkLock:
+                process.start()
+        finally:
+            childConn.close()
+
+        worker = _LauncherWorker(process, parentConn)
+        self.workers.append(worker)
+        self.idleWorkers.append(worker)
+        return worker
+
+    def getWorkerPids(self):
+        '''
+            getWorkerPids - Get the pids of all live workers
+
+            @return list<int>
+        '''
+        return [worker.process.pid for worker in self.workers]
+
+    def hasWorkers(self):
+        '''
+            hasWorkers - Check if any worker is still alive to take requests
+
+            @return <bool>
+        '''
+        return bool(self.workers)
+
+    def submit(self, action, programConfig):
+        '''
+            submit - Submit an action to be performed by a worker.
+
+            @param action <str> - start/stop/restart
+            @param programConfig <ProgramConfig> - Current config of the program
+
+            @return <LauncherRequest> - Handle to poll for completion, like a multiprocessing.Process
+        '''
+        request = LauncherRequest(action, programConfig)
+        with self.lock:
+            if not self.workers:
+                request._complete(ReturnCodes.UNKNOWN_FAILURE)
+                return request
+
+            requestId = self.nextRequestId
+            self.nextRequestId += 1
+            self.pendingRequests.append( (requestId, request) )
+            self._dispatch()
+
+        return request
+
+    def _dispatch(self):
+        # Must hold self.lock
+        while self.pendingRequests and self.idleWorkers:
+            worker = self.idleWorkers.pop()
+            (requestId, request) = self.pendingRequests.popleft()
+            try:
+                worker.conn.send( (requestId, request.action, request.programConfig) )
+            except (IOError, OSError) as e:
+                logErr('Launcher worker pid=%d could not take a request: %s\n' %(worker.process.pid, str(e)))
+                self.pendingRequests.appendleft( (requestId, request) )
+                self._removeWorker(worker, replace=True)
+                continue
+
+            worker.currentRequestId = requestId
+            worker.currentRequest = request
+
+    def _removeWorker(self, worker, replace=False):
+        # Must hold self.lock
+        if worker not in self.workers:
+            return
+
+        self.workers.remove(worker)
+        if worker in self.idleWorkers:
+            self.idleWorkers.remove(worker)
+
+        if worker.currentRequest is not None:
+            worker.currentRequest._complete(ReturnCodes.UNKNOWN_FAILURE)
+            worker.currentRequest = None
+
+        try:
+            worker.conn.close()
+        except:
+            pass
+
+        if replace is True and self.keepGoing is True:
+            if time.time() - worker.startedAt < WORKER_MIN_LIFETIME:
+                logErr('Launcher worker pid=%d exited within %d seconds of starting, so is not replaced. %d workers remain.\n' %(worker.process.pid, WORKER_MIN_LIFETIME, len(self.workers)))
+            else:
+                try:
+                    newWorker = self._startWorker()
+                    logMsg('Started launcher worker pid=%d to replace pid=%d\n' %(newWorker.process.pid, worker.process.pid))
+                except Exception as e:
+                    logErr('Failed to start a launcher worker to replace pid=%d: %s\n' %(worker.process.pid, str(e)))
+
+        if not self.workers:
+            # Nobody left to handle these
+            while self.pendingRequests:
+                (requestId, request) = self.pendingRequests.popleft()
+                request._complete(ReturnCodes.UNKNOWN_FAILURE)
+
+    def _readerMain(self):
+        while self.keepGoing is True:
+            with self.lock:
+                connToWorker = dict( [ (worker.conn.fileno(), worker) for worker in self.workers ] )
+
+            if not connToWorker:
+                return
+
+            try:
+                (readable, _w, _x) = select.select(list(connToWorker.keys()), [], [], 1.0)
+            except (select.error, IOError, OSError) as e:
+                # EINTR
+                continue
+
+            for fileno in readable:
+                worker = connToWorker[fileno]
+                try:
+                    message = worker.conn.recv()
+                except (EOFError, IOError, OSError):
+                    if self.keepGoing is True:
+                        logErr('Launcher worker pid=%d exited unexpectedly.\n' %(worker.process.pid, ))
+                    with self.lock:
+                        self._removeWorker(worker, replace=True)
+                        self._dispatch()
+                    continue
+
+                if message[0] == 'exit':
+                    (_unused, pid, status) = message
+                    if self.onChildExit is not None:
+                        try:
+                            self.onChildExit(pid, status)
+                        except Exception as e:
+                            logErr('Error handling exit of pid=%d: %s\n' %(pid, str(e)))
+                    continue
+
+                (_unused, requestId, ret) = message
+                with self.lock:
+                    if worker.currentRequestId == requestId:
+                        worker.currentRequest._complete(ret)
+                        worker.currentRequest = None
+                        worker.currentRequestId = None
+                        self.idleWorkers.append(worker)
+                    self._dispatch()
+
+    def shutdown(self):
+        '''
+            shutdown - Tell all workers to exit once they finish their current request. Programs they launched are left running.
+        '''
+        self.keepGoing = False
+        with self.lock:
+            for worker in self.workers:
+                try:
+                    worker.conn.send(None)
+                except:
+                    pass
+
+        for worker in self.workers[:]:
+            worker.process.join(5)
+
+
+# vim:set ts=4 shiftwidth=4 softtabstop=4 expandtab :
@@ -0,0 +1,440 @@
+'''
+    Copyright (c) 2016 Tim Savannah All Rights Reserved.
+    This software is licensed under the terms of the GPLv3.
+    This may change at my discretion, retroactively, and without notice.
+
+    You should have received a copy of this with the source distribution as a file titled, LICENSE.
+
+    The most current license can be found at:
+    https://github.com/kata198/usrsvc/LICENSE
+
+    This location may need to be changed at some point in the future, in which case
+    you are may email Tim Savannah <kata198 at gmail dot com>, or find them on the
+    current website intended for distribution of usrsvc.
+
+
+    LogIndex - A sparse time -> byte offset index of a program's log file, kept next to it as $FILE.idx
+
+        The index is a series of fixed size records (time, offset, kind), in the order they were written. A record means
+          everything before #offset# in the log was written by #time#, and everything after it was written at or after #time#.
+          A range of time is found by bisecting the records (read through mmap) rather than reading the log.
+
+        Records are written by the log pump as it writes (log_mode=managed), or by usrsvcd as it sees the file grow (log_mode=file).
+          usrsvcd also records each restart it performs. Every record is a single O_APPEND write, so these may be mixed freely.
+'''
+
+# vim:set ts=4 shiftwidth=4 softtabstop=4 expandtab :
+
+import bisect
+import mmap
+import os
+import struct
+import time
+
+__all__ = ('LogIndex', 'LogIndexWriter', 'LogIndexSampler', 'getIndexPath', 'recordLogEvent', 'readLogRange', 'parseLogTime',
+    'RECORD_POSITION', 'RECORD_RESTART',
+)
+
+# Record kinds. Every record is also a position, so all take part in lookups by time.
+RECORD_POSITION = 0
+RECORD_RESTART = 1
+
+# time (epoch, double), offset (unsigned 64), kind (unsigned 32), padding
+INDEX_RECORD = struct.Struct('<dQI4x')
+RECORD_SIZE = INDEX_RECORD.size
+
+# Minimum seconds between position records. Lookups are accurate to about this.
+INDEX_INTERVAL = 1.0
+
+# Size of each write when copying a range of the log out
+COPY_CHUNK_SIZE = 1024 * 1024
+
+
+def getIndexPath(logPath):
+    '''
+        getIndexPath - Get the path of the index of a log file
+
+        @param logPath <str> - Path of the log file
+
+        @return <str> - Path of the index
+    '''
+    return logPath + '.idx'
+
+
+def _appendRecord(indexPath, recordTime, offset, kind):
+    fd = os.open(indexPath, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o666)
+    try:
+        os.write(fd, INDEX_RECORD.pack(recordTime, offset, kind))
+    finally:
+        os.close(fd)
+
+
+def _readLastRecord(indexPath, kind=None):
+    '''
+        _readLastRecord - Read the last complete record of an index, dropping any partial record after it (like from a crash mid-write).
+
+        @param kind <int/None> - If provided, the last record of this RECORD_* kind
+
+        @return <tuple/None> - (time, offset, kind), or None if there are no (matching) records.
+    '''
+    try:
+        fd = os.open(indexPath, os.O_RDWR)
+    except OSError:
+        return None
+
+    try:
+        indexSize = os.fstat(fd).st_size
+        if indexSize % RECORD_SIZE:
+            indexSize -= indexSize % RECORD_SIZE
+            os.ftruncate(fd, indexSize)
+
+        # Other kinds are rare, so this is almost always the very last record
+        pos = indexSize
+        while pos > 0:
+            readSize = min(pos, RECORD_SIZE * 64)
+            pos -= readSize
+            os.lseek(fd, pos, os.SEEK_SET)
+            data = os.read(fd, readSize)
+            for recordOffset in range(len(data) - RECORD_SIZE, -1, -RECORD_SIZE):
+                record = INDEX_RECORD.unpack_from(data, recordOffset)
+                if kind is None or record[2] == kind:
+                    return record
+
+        return None
+    finally:
+        os.close(fd)
+
+
+class LogIndexWriter(object):
+    '''
+        LogIndexWriter - Adds position records to the index of one log file, at most one every #interval# seconds.
+
+            The index file is opened for each record, so it may be renamed (on rotation) or removed at any time. Errors writing the
+              index are ignored; it is only an aid to finding things in the log.
+    '''
+
+    def __init__(self, logPath, interval=INDEX_INTERVAL):
+        '''
+            @param logPath <str> - Path of the log file
+            @param interval <float> - Minimum seconds between position records
+        '''
+        self.logPath = logPath
+        self.indexPath = getIndexPath(logPath)
+        self.interval = interval
+
+        self.reset()
+
+    def reset(self):
+        '''
+            reset - Forget what has been recorded, so the index is read again on the next record. Call after the index is rotated.
+        '''
+        # None until the existing index (if any) has been read
+        self.lastTime = None
+        self.lastOffset = None
+
+    def addPosition(self, offset, now=None):
+        '''
+            addPosition - Record that the log was #offset# bytes long at #now#, if the interval has passed and it has grown.
+
+                If the log is now shorter than last recorded, it has been truncated or replaced, and the old index is discarded.
+
+            @param offset <int> - Current size of the log, or offset of the next byte to be written
+            @param now <float/None> - Time, default now
+        '''
+        if now is None:
+            now = time.time()
+
+        try:
+            if self.lastOffset is None:
+                # Only our own kind of record says how far the log had been written. Others (like a restart, recorded by
+                #  usrsvcd at whatever size it saw) may be at an offset from before a rotation.
+                lastRecord = _readLastRecord(self.indexPath, RECORD_POSITION)
+                if lastRecord is None:
+                    # Nothing yet, so even offset 0 (when the log began) is recorded
+                    (self.lastTime, self.lastOffset) = (0, -1)
+                else:
+                    (self.lastTime, self.lastOffset) = lastRecord[:2]
+
+            if offset < self.lastOffset:
+                # The offsets in the index no longer point into this file
+                fd = os.open(self.indexPath, os.O_WRONLY | os.O_TRUNC | os.O_CREAT, 0o666)
+                os.close(fd)
+            elif offset == self.lastOffset or now - self.lastTime < self.interval:
+                return
+
+            _appendRecord(self.indexPath, now, offset, RECORD_POSITION)
+            (self.lastTime, self.lastOffset) = (now, offset)
+        except (IOError, OSError):
+            pass
+
+
+class LogIndexSampler(object):
+    '''
+        LogIndexSampler - Indexes log files written directly by their programs (log_mode=file), by sampling their size.
+
+            usrsvcd calls #sample# as part of checking on a program, so the index is as fine as the check_interval.
+    '''
+
+    def __init__(self, interval=INDEX_INTERVAL):
+        '''
+            @param interval <float> - Minimum seconds between position records of a log
+        '''
+        self.interval = interval
+        # logPath -> LogIndexWriter
+        self.writers = {}
+
+    def sample(self, logPath, now=None):
+        '''
+            sample - Record the current size of a log file in its index, if it has grown.
+
+            @param logPath <str> - Path of the log file
+            @param now <float/None> - Time, default now
+        '''
+        try:
+            logSize = os.stat(logPath).st_size
+        except OSError:
+            return
+
+        writer = self.writers.get(logPath, None)
+        if writer is None:
+            writer = self.writers[logPath] = LogIndexWriter(logPath, self.interval)
+        writer.addPosition(logSize, now)
+
+
+def recordLogEvent(logPath, kind=RECORD_RESTART, now=None):
+    '''
+        recordLogEvent - Record an event (like a restart) in the index of a log file, at the current end of the log.
+
+        @param logPath <str> - Path of the log file
+        @param kind <int> - RECORD_* kind
+        @param now <float/None> - Time, default now
+
+        @return <bool> - True if recorded
+    '''
+    if now is None:
+        now = time.time()
+    try:
+        logSize = os.stat(logPath).st_size
+    except OSError:
+        logSize = 0
+
+    try:
+        _appendRecord(getIndexPath(logPath), now, logSize, kind)
+    except (IOError, OSError):
+        return False
+    return True
+
+
+class _RecordTimes(object):
+    # Sequence of the record times, for bisect, which only reads the few records it compares against.
+
+    def __init__(self, logIndex):
+        self.logIndex = logIndex
+
+    def __len__(self):
+        return self.logIndex.numRecords
+
+    def __getitem__(self, idx):
+        return self.logIndex.getRecord(idx)[0]
+
+
+class LogIndex(object):
+    '''
+        LogIndex - Reads the index of a log file, through mmap.
+    '''
+
+    def __init__(self, logPath):
+        '''
+            @param logPath <str> - Path of the log file. A missing index is treated as empty.
+        '''
+        self.logPath = logPath
+        self.indexPath = getIndexPath(logPath)
+
+        self.mmap = None
+        self.numRecords = 0
+
+        try:
+            with open(self.indexPath, 'rb') as indexFile:
+                indexSize = os.fstat(indexFile.fileno()).st_size
+                self.numRecords = indexSize // RECORD_SIZE
+                if self.numRecords:
+                    self.mmap = mmap.mmap(indexFile.fileno(), self.numRecords * RECORD_SIZE, access=mmap.ACCESS_READ)
+        except (IOError, OSError):
+            self.numRecords = 0
+
+    def close(self):
+        if self.mmap is not None:
+            self.mmap.close()
+            self.mmap = None
+        self.numRecords = 0
+
+    def __len__(self):
+        return self.numRecords
+
+    def getRecord(self, idx):
+        '''
+            getRecord - Get a record
+
+            @param idx <int> - Index of record, 0 is the oldest
+
+            @return tuple<float, int, int> - (time, offset, kind)
+        '''
+        return INDEX_RECORD.unpack_from(self.mmap, idx * RECORD_SIZE)
+
+    def getStartOffset(self, since):
+        '''
+            getStartOffset - Get an offset in the log, at or before the first byte written at or after #since#
+
+            @param since <float> - Epoch time
+
+            @return <int> - Offset
+        '''
+        idx = bisect.bisect_right(_RecordTimes(self), since) - 1
+        if idx < 0:
+            return 0
+        return self.getRecord(idx)[1]
+
+    def getEndOffset(self, until):
+        '''
+            getEndOffset - Get an offset in the log, at or after the last byte written at or before #until#
+
+            @param until <float> - Epoch time
+
+            @return <int/None> - Offset, or None for the end of the log
+        '''
+        idx = bisect.bisect_right(_RecordTimes(self), until)
+        if idx >= self.numRecords:
+            return None
+        return self.getRecord(idx)[1]
+
+    def getEvents(self, kind=RECORD_RESTART, limit=None):
+        '''
+            getEvents - Get the most recent records of a kind, newest first. Reads backwards from the end, and stops at #limit#.
+
+            @param kind <int> - RECORD_* kind
+            @param limit <int/None> - Max number to return, or None for all
+
+            @return list<tuple> - List of (time, offset, kind)
+        '''
+        events = []
+        for idx in range(self.numRecords - 1, -1, -1):
+            record = self.getRecord(idx)
+            if record[2] != kind:
+                continue
+            events.append(record)
+            if limit is not None and len(events) >= limit:
+                break
+        return events
+
+
+def readLogRange(logPath, outFile, since=None, until=None):
+    '''
+        readLogRange - Write the lines of a log written between two times (to the accuracy of its index) to a file.
+
+            The log is mmap'd, and only the range found through the index is read. The range is widened to whole lines.
+
+        @param logPath <str> - Path of the log file
+        @param outFile <file> - Binary file object to write to
+        @param since <float/None> - Epoch time, or None for the start of the log
+        @param until <float/None> - Epoch time, or None for the end of the log
+
+        @return <int> - Number of bytes written
+
+        @raises IOError/OSError if the log cannot be read
+    '''
+    with open(logPath, 'rb') as logFile:
+        logSize = os.fstat(logFile.fileno()).st_size
+        if logSize == 0:
+            return 0
+
+        logIndex = LogIndex(logPath)
+        try:
+            start = 0
+            end = logSize
+            if since is not None:
+                start = min(logIndex.getStartOffset(since), logSize)
+            if until is not None:
+                endOffset = logIndex.getEndOffset(until)
+                if endOffset is not None:
+                    end = min(endOffset, logSize)
+        finally:
+            logIndex.close()
+
+        if start >= end:
+            return 0
+
+        logMmap = mmap.mmap(logFile.fileno(), logSize, access=mmap.ACCESS_READ)
+        try:
+            # Begin at the start of a line, and finish at the end of one
+            if start > 0 and logMmap[start - 1:start] != b'\n':
+                start = logMmap.find(b'\n', start, end) + 1
+                if start == 0:
+                    return 0
+            if end < logSize and logMmap[end - 1:end] != b'\n':
+                newlineIdx = logMmap.find(b'\n', end)
+                end = logSize if newlineIdx == -1 else newlineIdx + 1
+
+            offset = start
+            while offset < end:
+                chunkEnd = min(offset + COPY_CHUNK_SIZE, end)
+                outFile.write(logMmap[offset:chunkEnd])
+                offset = chunkEnd
+        finally:
+            logMmap.close()
+
+    return end - start
+
+
+# Suffixes for relative times, like "-10m"
+_TIME_UNITS = {'s' : 1, 'm' : 60, 'h' : 3600, 'd' : 86400}
+
+# Absolute formats, tried in order. Those without a date are today.
+_TIME_FORMATS = ('%Y-%m-%d %H:%M:%S', '%Y-%m-%dT%H:%M:%S', '%Y-%m-%d %H:%M', '%Y-%m-%dT%H:%M', '%Y-%m-%d')
+_TIME_OF_DAY_FORMATS = ('%H:%M:%S', '%H:%M')
+
+
+def parseLogTime(value, now=None):
+    '''
+        parseLogTime - Parse a time given on the command line
+
+        @param value <str> - One of: seconds since epoch, "YYYY-mm-dd[ HH:MM[:SS]]", "HH:MM[:SS]" (today),
+            or a time ago, like "-90s", "-10m", "-2h", "-1d"
+        @param now <float/None> - Time relative values are from, default now
+
+        @return <float> - Epoch time
+
+        @raises ValueError if not understood
+    '''
+    value = value.strip()
+    if now is None:
+        now = time.time()
+
+    if value.startswith('-') and len(value) > 2 and value[-1] in _TIME_UNITS:
+        try:
+            return now - float(value[1:-1]) * _TIME_UNITS[value[-1]]
+        except ValueError:
+            pass
+    else:
+        try:
+            return float(value)
+        except ValueError:
+            pass
+
+    for timeFormat in _TIME_FORMATS:
+        try:
+            return time.mktime(time.strptime(value, timeFormat))
+        except ValueError:
+            continue
+
+    for timeFormat in _TIME_OF_DAY_FORMATS:
+        try:
+            timeOfDay = time.strptime(value, timeFormat)
+        except ValueError:
+            continue
+        today = time.localtime(now)
+        return time.mktime( (today.tm_year, today.tm_mon, today.tm_mday, timeOfDay.tm_hour, timeOfDay.tm_min, timeOfDay.tm_sec, 0, 0, -1) )
+
+    raise ValueError('Cannot parse time "%s". Use seconds since epoch, "YYYY-mm-dd HH:MM[:SS]", "HH:MM[:SS]", or a time ago like "-10m".' %(value, ))
+
+
+# vim:set ts=4 shiftwidth=4 softtabstop=4 expandtab :
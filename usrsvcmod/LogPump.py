@@ -0,0 +1,576 @@
+'''
+    Copyright (c) 2016 Tim Savannah All Rights Reserved.
+    This software is licensed under the terms of the GPLv3.
+    This may change at my discretion, retroactively, and without notice.
+
+    You should have received a copy of this with the source distribution as a file titled, LICENSE.
+
+    The most current license can be found at:
+    https://github.com/kata198/usrsvc/LICENSE
+
+    This location may need to be changed at some point in the future, in which case
+    you are may email Tim Savannah <kata198 at gmail dot com>, or find them on the
+    current website intended for distribution of usrsvc.
+
+
+    LogPump - Writes the output of a program with log_mode=managed to its log file, rotating it by size and age.
+
+        The program writes to a pipe, and a pump process (python -m usrsvcmod.LogPump) reads from the other end with large reads,
+          and writes to the file in large appends. The file is rotated by renaming it (no copy, and no truncate), always on a line
+          boundary, and rotated segments are compressed in the background.
+
+        The pump is its own process in its own session, rather than a thread of usrsvcd, so the program's output keeps flowing
+          while usrsvcd is restarted (or is not running at all, for programs started by the usrsvc tool). It runs until every
+          writer has closed the pipe, that is the program (and any children it passed its output on to) has exited.
+
+        Only one pump writes a log file at a time. Each pump holds an exclusive lock on FILE.pump while it runs, and a pump
+          is not started for a log which another one still has (like one left over from before a restart, kept alive by a
+          process which still holds the program's old output, or the pump of another program given the same file).
+'''
+
+# vim:set ts=4 shiftwidth=4 softtabstop=4 expandtab :
+
+import errno
+import fcntl
+import os
+import re
+import select
+import signal
+import subprocess
+import sys
+import threading
+import time
+
+from .LogIndex import LogIndexWriter, getIndexPath
+
+__all__ = ('LogPump', 'startLogPump', 'getRotatedLogs', 'getPumpLockPath', 'LogInUseException', 'LOG_MODES')
+
+# Values for the log_mode Program option
+LOG_MODES = ('file', 'managed')
+
+# Max bytes read from the pipe at once
+READ_SIZE = 1024 * 1024
+
+# Buffered output is written once there is this much of it, or it has waited FLUSH_INTERVAL seconds
+FLUSH_SIZE = 256 * 1024
+FLUSH_INTERVAL = 1.0
+
+# Rotated segments are named path.YYYYmmdd-HHMMSS , with .N added if that name is taken, and .gz once compressed.
+ROTATED_TIME_FORMAT = '%Y%m%d-%H%M%S'
+
+ROTATED_SUFFIX_PATTERN = re.compile(r'^[\.](?P<stamp>[\d]{8}[\-][\d]{6})(?:[\.](?P<num>[\d]+))?(?P<gz>[\.]gz)?$')
+
+# Seconds startLogPump waits for the previous pump of a log to finish (it may still be writing the last output
+#  of a program being restarted, or compressing), before giving up.
+PUMP_LOCK_TIMEOUT = 10
+
+
+class LogInUseException(Exception):
+    '''
+        LogInUseException - Raised when a log file is already being written by another log pump
+    '''
+    pass
+
+
+def _setCloexec(fd):
+    flags = fcntl.fcntl(fd, fcntl.F_GETFD)
+    fcntl.fcntl(fd, fcntl.F_SETFD, flags | fcntl.FD_CLOEXEC)
+
+
+def getPumpLockPath(path):
+    '''
+        getPumpLockPath - Get the path of the file locked by the pump of a log
+
+        @param path <str> - Path of the log file
+
+        @return <str> - Path of the lock file
+    '''
+    return path + '.pump'
+
+
+def _readPumpPid(lockFd):
+    try:
+        os.lseek(lockFd, 0, os.SEEK_SET)
+        return int(os.read(lockFd, 32).strip())
+    except (OSError, ValueError):
+        return None
+
+
+def _writePumpPid(lockFd, pid):
+    os.ftruncate(lockFd, 0)
+    os.lseek(lockFd, 0, os.SEEK_SET)
+    os.write(lockFd, str(pid).encode('ascii'))
+
+
+def _lockLog(path, timeout=0):
+    '''
+        _lockLog - Take the exclusive lock on a log, held for as long as its pump runs.
+
+        @param path <str> - Path of the log file
+        @param timeout <float> - Seconds to wait for another pump to release it
+
+        @return <int> - The locked file descriptor (close-on-exec)
+
+        @raises LogInUseException if another pump still holds the lock after #timeout# seconds
+    '''
+    lockFd = os.open(getPumpLockPath(path), os.O_RDWR | os.O_CREAT, 0o666)
+    _setCloexec(lockFd)
+
+    deadline = time.time() + timeout
+    while True:
+        try:
+            fcntl.flock(lockFd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return lockFd
+        except (IOError, OSError) as e:
+            if e.errno not in (errno.EAGAIN, errno.EACCES):
+                os.close(lockFd)
+                raise
+
+        if time.time() >= deadline:
+            pumpPid = _readPumpPid(lockFd)
+            os.close(lockFd)
+            raise LogInUseException('%s is already being written by another log pump (pid=%s). Each log file must belong to only one program, and any process of an earlier run which still holds its output must exit first.' %(path, str(pumpPid)))
+
+        time.sleep(.1)
+
+
+def _getRotatedSortKey(item):
+    return item[0]
+
+
+def getRotatedLogs(path):
+    '''
+        getRotatedLogs - Get the rotated segments of a log file, oldest first.
+
+        @param path <str> - Path of the log file
+
+        @return list<str> - Paths of the rotated segments (compressed or not)
+    '''
+    dirName = os.path.dirname(path) or '.'
+    baseName = os.path.basename(path)
+
+    try:
+        names = os.listdir(dirName)
+    except OSError:
+        return []
+
+    rotated = []
+    for name in names:
+        if not name.startswith(baseName):
+            continue
+        matchObj = ROTATED_SUFFIX_PATTERN.match(name[len(baseName):])
+        if not matchObj:
+            continue
+        rotated.append( ((matchObj.group('stamp'), int(matchObj.group('num') or 0)), os.path.join(dirName, name)) )
+
+    rotated.sort(key=_getRotatedSortKey)
+    return [rotatedPath for (_key, rotatedPath) in rotated]
+
+
+def _getRotatedTime(path, rotatedPath):
+    matchObj = ROTATED_SUFFIX_PATTERN.match(os.path.basename(rotatedPath)[len(os.path.basename(path)):])
+    if not matchObj:
+        return None
+    return time.mktime(time.strptime(matchObj.group('stamp'), ROTATED_TIME_FORMAT))
+
+
+class LogPump(object):
+    '''
+        LogPump - Copies everything read from #inputFd# to the log file at #path#, until end of file.
+
+            Output is written in large chunks (FLUSH_SIZE, or whatever has arrived after FLUSH_INTERVAL seconds). When the file
+              has reached #maxSize# bytes, or is #maxAge# seconds old, it is renamed to path.YYYYmmdd-HHMMSS once the line being
+              written is complete, and a new file is started. Only the newest #keep# rotated segments are kept.
+
+            Where each write begins is recorded in the log's index (see LogIndex), at most once a second.
+
+            Problems the pump runs into (like a segment failing to compress) are written into the log itself.
+    '''
+
+    def __init__(self, path, maxSize=0, maxAge=0, keep=7, compress=True, inputFd=0):
+        '''
+            @param path <str> - Path of the log file
+            @param maxSize <int> - Rotate once the file reaches this many bytes, 0 to not rotate on size
+            @param maxAge <float> - Rotate once the file has been written for this many seconds, 0 to not rotate on age
+            @param keep <int> - Number of rotated segments to keep
+            @param compress <bool> - If True, rotated segments are compressed with gzip
+            @param inputFd <int> - File descriptor to read output from. Default is stdin.
+        '''
+        self.path = path
+        self.maxSize = int(maxSize)
+        self.maxAge = maxAge
+        self.keep = max(int(keep), 1)
+        self.compress = compress
+        self.inputFd = inputFd
+
+        self.fd = None
+        # Bytes in the current segment, and when it was started
+        self.size = 0
+        self.segmentStart = None
+        # If the last byte written ended a line. Rotation only happens on a line boundary.
+        self.atLineStart = True
+
+        # Bytes which could not be written (like on ENOSPC), noted in the log once writes succeed again
+        self.numDroppedBytes = 0
+        # Messages from the compress thread, written into the log by the main thread
+        self.pendingErrors = []
+
+        # Compression and pruning run one at a time, in the background
+        self.compressLock = threading.Lock()
+        self.compressThreads = []
+
+        # Time -> offset index of the current segment, for "usrsvc logs"
+        self.index = LogIndexWriter(path)
+
+    def _openSegment(self):
+        self.fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o666)
+        _setCloexec(self.fd)
+        self.size = os.fstat(self.fd).st_size
+
+        now = time.time()
+        self.segmentStart = now
+        if self.size > 0:
+            # Carried over from a previous pump. It was started at the last rotation, if we know when that was.
+            rotatedLogs = getRotatedLogs(self.path)
+            if rotatedLogs:
+                rotatedTime = _getRotatedTime(self.path, rotatedLogs[-1])
+                if rotatedTime is not None and rotatedTime <= now:
+                    self.segmentStart = rotatedTime
+            try:
+                self.atLineStart = self._readLastByte() == b'\n'
+            except OSError:
+                self.atLineStart = True
+        else:
+            self.atLineStart = True
+
+    def _readLastByte(self):
+        readFd = os.open(self.path, os.O_RDONLY)
+        try:
+            os.lseek(readFd, -1, os.SEEK_END)
+            return os.read(readFd, 1)
+        finally:
+            os.close(readFd)
+
+    def _writeSegment(self, data):
+        dataLen = len(data)
+        offset = 0
+        try:
+            while offset < dataLen:
+                offset += os.write(self.fd, data[offset:offset + FLUSH_SIZE])
+        except OSError:
+            self.numDroppedBytes += dataLen - offset
+        finally:
+            self.size += offset
+
+        if offset:
+            self.atLineStart = data[offset - 1:offset] == b'\n'
+
+    def _isRotateDue(self, dataLen, now):
+        if self.size <= 0:
+            return False
+        if self.maxSize > 0 and self.size + dataLen > self.maxSize:
+            return True
+        if self.maxAge > 0 and now - self.segmentStart >= self.maxAge:
+            return True
+        return False
+
+    def write(self, data, arrivedAt=None):
+        '''
+            write - Write output to the log, rotating first if due.
+
+            @param data <bytes> - Output
+            @param arrivedAt <float/None> - When the output arrived (it may have been buffered), for the index. Default now.
+        '''
+        if self.pendingErrors or self.numDroppedBytes:
+            self._writeNotes()
+
+        now = time.time()
+        if self._isRotateDue(len(data), now):
+            if self.atLineStart is False:
+                # Finish the line being written, then rotate.
+                idx = data.find(b'\n')
+                if idx != -1:
+                    self._writeSegment(data[:idx + 1])
+                    data = data[idx + 1:]
+            if self.atLineStart is True:
+                self.rotate()
+
+        if data:
+            self.index.addPosition(self.size, arrivedAt or now)
+            self._writeSegment(data)
+
+    def _writeNotes(self):
+        notes = []
+        if self.numDroppedBytes:
+            notes.append('Dropped %d bytes of output which could not be written.' %(self.numDroppedBytes, ))
+            self.numDroppedBytes = 0
+        while self.pendingErrors:
+            notes.append(self.pendingErrors.pop(0))
+
+        prefix = b'' if self.atLineStart else b'\n'
+        self._writeSegment(prefix + ''.join(['[usrsvc log pump %s] %s\n' %(time.ctime(), note) for note in notes]).encode('utf-8'))
+
+    def rotate(self):
+        '''
+            rotate - Rename the current log file to a rotated segment, and start a new one. Does nothing if the file is empty.
+        '''
+        if self.size <= 0:
+            return
+
+        now = time.time()
+        rotatedPath = self.path + '.' + time.strftime(ROTATED_TIME_FORMAT, time.localtime(now))
+        num = 0
+        while os.path.exists(rotatedPath) or os.path.exists(rotatedPath + '.gz'):
+            num += 1
+            rotatedPath = '%s.%s.%d' %(self.path, time.strftime(ROTATED_TIME_FORMAT, time.localtime(now)), num)
+
+        try:
+            os.rename(self.path, rotatedPath)
+        except OSError as e:
+            self.pendingErrors.append('Failed to rotate %s to %s: %s' %(self.path, rotatedPath, str(e)))
+            # Try again after another maxAge, rather than on every write
+            self.segmentStart = now
+            return
+
+        # The index goes with its segment
+        try:
+            os.rename(getIndexPath(self.path), getIndexPath(rotatedPath))
+        except OSError:
+            pass
+        self.index.reset()
+
+        os.close(self.fd)
+        self._openSegment()
+
+        thread = threading.Thread(target=self._compressAndPrune, args=(rotatedPath, ))
+        thread.daemon = True
+        thread.start()
+        self.compressThreads = [oldThread for oldThread in self.compressThreads if oldThread.is_alive()] + [thread]
+
+    def _compressAndPrune(self, rotatedPath):
+        with self.compressLock:
+            if self.compress:
+                try:
+                    self._compressSegment(rotatedPath)
+                    # Offsets into the uncompressed segment are no use
+                    self._removeIfExists(getIndexPath(rotatedPath))
+                except Exception as e:
+                    self.pendingErrors.append('Failed to compress %s: %s' %(rotatedPath, str(e)))
+
+            for oldPath in getRotatedLogs(self.path)[:-self.keep]:
+                try:
+                    os.unlink(oldPath)
+                except OSError as e:
+                    self.pendingErrors.append('Failed to remove old log %s: %s' %(oldPath, str(e)))
+                self._removeIfExists(getIndexPath(oldPath))
+
+    @staticmethod
+    def _removeIfExists(path):
+        try:
+            os.unlink(path)
+        except OSError:
+            pass
+
+    def _compressSegment(self, rotatedPath):
+        import gzip
+        import shutil
+
+        tmpPath = rotatedPath + '.gz.tmp'
+        try:
+            with open(rotatedPath, 'rb') as inFile:
+                gzFile = gzip.open(tmpPath, 'wb')
+                try:
+                    shutil.copyfileobj(inFile, gzFile, READ_SIZE)
+                finally:
+                    gzFile.close()
+            os.rename(tmpPath, rotatedPath + '.gz')
+        except:
+            try:
+                os.unlink(tmpPath)
+            except OSError:
+                pass
+            raise
+
+        os.unlink(rotatedPath)
+
+    def run(self):
+        '''
+            run - Pump output until end of file on #inputFd#, then write what remains and wait for compression to finish.
+        '''
+        self._openSegment()
+
+        inputFd = self.inputFd
+        buffered = []
+        bufferedSize = 0
+        # When the oldest output still buffered arrived
+        bufferedSince = None
+
+        while True:
+            now = time.time()
+            if buffered:
+                timeout = max(bufferedSince + FLUSH_INTERVAL - now, 0)
+            elif self.maxAge > 0 and self.size > 0:
+                # Wake to rotate an idle log once it is old enough
+                timeout = max(self.segmentStart + self.maxAge - now, 0) + .01
+            else:
+                timeout = None
+
+            try:
+                (readable, _w, _x) = select.select([inputFd], [], [], timeout)
+            except (select.error, OSError, IOError) as e:
+                if e.args[0] == errno.EINTR:
+                    continue
+                raise
+
+            if readable:
+                try:
+                    data = os.read(inputFd, READ_SIZE)
+                except OSError as e:
+                    if e.errno in (errno.EINTR, errno.EAGAIN):
+                        continue
+                    raise
+                if not data:
+                    break
+                if not buffered:
+                    bufferedSince = time.time()
+                buffered.append(data)
+                bufferedSize += len(data)
+
+            now = time.time()
+            if buffered and (bufferedSize >= FLUSH_SIZE or now - bufferedSince >= FLUSH_INTERVAL):
+                self.write(b''.join(buffered), bufferedSince)
+                buffered = []
+                bufferedSize = 0
+            elif not buffered and self.atLineStart is True and self._isRotateDue(0, now):
+                self.rotate()
+
+        if buffered:
+            self.write(b''.join(buffered), bufferedSince)
+        if self.pendingErrors or self.numDroppedBytes:
+            self._writeNotes()
+
+        for thread in self.compressThreads:
+            thread.join()
+        if self.pendingErrors:
+            self._writeNotes()
+
+        os.close(self.fd)
+        self.fd = None
+
+
+def startLogPump(path, maxSize=0, maxAge=0, keep=7, compress=True):
+    '''
+        startLogPump - Start a log pump process for a log file.
+
+        @param path <str> - Path of the log file
+        @param maxSize <int> - Rotate once the file reaches this many bytes, 0 to not rotate on size
+        @param maxAge <float> - Rotate once the file has been written for this many seconds, 0 to not rotate on age
+        @param keep <int> - Number of rotated segments to keep
+        @param compress <bool> - If True, rotated segments are compressed with gzip
+
+        @return <int> - The write end of the pipe, for the program's output. It is close-on-exec; the caller must close it
+            once the program has been launched.
+
+        @raises IOError/OSError if the log file cannot be opened for writing, or the pump cannot be started.
+    '''
+    # Fail here, rather than in the pump where nobody would see it
+    open(path, 'ab').close()
+
+    lockFd = _lockLog(path, PUMP_LOCK_TIMEOUT)
+    try:
+        (readFd, writeFd) = os.pipe()
+    except:
+        os.close(lockFd)
+        raise
+    _setCloexec(readFd)
+    _setCloexec(writeFd)
+
+    env = dict(os.environ)
+    packageParent = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    if env.get('PYTHONPATH'):
+        env['PYTHONPATH'] = packageParent + os.pathsep + env['PYTHONPATH']
+    else:
+        env['PYTHONPATH'] = packageParent
+
+    args = [sys.executable, '-m', 'usrsvcmod.LogPump', '--max-size=%d' %(maxSize, ), '--max-age=%f' %(maxAge, ), '--keep=%d' %(keep, ), '--lock-fd=%d' %(lockFd, )]
+    if not compress:
+        args.append('--no-compress')
+    args.append(path)
+
+    # In its own session, so signals sent to the program's process group (or usrsvcd's) do not reach it.
+    #  It inherits the locked descriptor, so the lock is held until it exits.
+    if sys.version_info >= (3, 2):
+        popenKwargs = {'start_new_session' : True, 'close_fds' : True, 'pass_fds' : (lockFd, )}
+    else:
+        def _preexec():
+            os.setsid()
+            fcntl.fcntl(lockFd, fcntl.F_SETFD, fcntl.fcntl(lockFd, fcntl.F_GETFD) & ~fcntl.FD_CLOEXEC)
+        # No pass_fds, and close_fds would close the lock before _preexec could keep it
+        popenKwargs = {'preexec_fn' : _preexec, 'close_fds' : False}
+
+    devnull = open(os.devnull, 'r+b')
+    try:
+        pipe = subprocess.Popen(args, stdin=readFd, stdout=devnull, stderr=devnull, env=env, cwd='/', **popenKwargs)
+        _writePumpPid(lockFd, pipe.pid)
+    except:
+        os.close(writeFd)
+        raise
+    finally:
+        os.close(readFd)
+        os.close(lockFd)
+        devnull.close()
+
+    return writeFd
+
+
+def main(args):
+    maxSize = 0
+    maxAge = 0
+    keep = 7
+    compress = True
+    lockFd = None
+    path = None
+
+    for arg in args[1:]:
+        if arg.startswith('--max-size='):
+            maxSize = int(arg[len('--max-size='):])
+        elif arg.startswith('--max-age='):
+            maxAge = float(arg[len('--max-age='):])
+        elif arg.startswith('--keep='):
+            keep = int(arg[len('--keep='):])
+        elif arg.startswith('--lock-fd='):
+            lockFd = int(arg[len('--lock-fd='):])
+        elif arg == '--no-compress':
+            compress = False
+        elif path is None and not arg.startswith('--'):
+            path = arg
+        else:
+            sys.stderr.write('Unknown argument: %s\n' %(arg, ))
+            return 1
+
+    if not path:
+        sys.stderr.write('Usage: %s [--max-size=BYTES] [--max-age=SECONDS] [--keep=N] [--no-compress] path\n' %(args[0], ))
+        return 1
+
+    if lockFd is None:
+        # Run by hand. Take the lock ourselves.
+        try:
+            lockFd = _lockLog(path)
+        except LogInUseException as e:
+            sys.stderr.write('%s\n' %(str(e), ))
+            return 1
+        _writePumpPid(lockFd, os.getpid())
+
+    # Only end of input stops the pump, so nothing the program writes is lost when everything is signalled (like on shutdown).
+    for signum in (signal.SIGHUP, signal.SIGINT, signal.SIGTERM, signal.SIGUSR1):
+        signal.signal(signum, signal.SIG_IGN)
+
+    LogPump(path, maxSize, maxAge, keep, compress).run()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
+
+
+# vim:set ts=4 shiftwidth=4 softtabstop=4 expandtab :
@@ -0,0 +1,292 @@
+'''
+    Copyright (c) 2016 Tim Savannah All Rights Reserved.
+    This software is licensed under the terms of the GPLv3.
+    This may change at my discretion, retroactively, and without notice.
+
+    You should have received a copy of this with the source distribution as a file titled, LICENSE.
+
+    The most current license can be found at:
+    https://github.com/kata198/usrsvc/LICENSE
+
+    This location may need to be changed at some point in the future, in which case
+    you are may email Tim Savannah <kata198 at gmail dot com>, or find them on the
+    current website intended for distribution of usrsvc.
+
+
+
+    MailQueue - Queue of outgoing email alerts, sent by a single worker thread, with digests and per-program rate limits.
+'''
+
+# vim:set ts=4 shiftwidth=4 softtabstop=4 expandtab :
+
+import heapq
+import threading
+import time
+
+from collections import OrderedDict, deque
+
+from .logging import logMsg, logErr
+
+__all__ = ('MailQueue', )
+
+# Max number of messages waiting to be sent. Beyond this the oldest are dropped.
+MAX_PENDING = 1000
+
+# The period mail_rate_limit applies to, in seconds
+RATE_LIMIT_PERIOD = 3600
+
+# Number of times a message is tried before it is given up on
+MAX_SEND_ATTEMPTS = 4
+
+# Seconds before the first retry of a failed message. Doubles with each attempt.
+RETRY_BACKOFF = 10
+
+
+class _PendingMail(object):
+
+    __slots__ = ('queuedAt', 'programName', 'subject', 'body')
+
+    def __init__(self, queuedAt, programName, subject, body):
+        self.queuedAt = queuedAt
+        self.programName = programName
+        self.subject = subject
+        self.body = body
+
+
+class MailQueue(object):
+    '''
+        MailQueue - Outgoing mail, sent one message at a time by a single worker (#runWorker#), so a storm of alerts never
+          means a thread (and a sendmail process) per message.
+
+            With a #digestWindow#, messages to the same recipients are held for up to that many seconds after the first,
+              and then sent together as one digest.
+
+            With a #rateLimit#, at most that many messages per program are accepted per hour. The rest are counted as suppressed,
+              and the count is noted in the next message about that program which is sent.
+
+            A message which fails to send is tried again after RETRY_BACKOFF seconds, doubling each time, up to MAX_SEND_ATTEMPTS.
+    '''
+
+    def __init__(self, sendFunction, digestWindow=0, rateLimit=0):
+        '''
+            @param sendFunction <function> - Called as sendFunction(to, subject, body) from the worker thread to send a message. Raises on failure.
+                See usrsvcmod.mail.MailTransport
+            @param digestWindow <float> - Seconds to hold messages to coalesce them into a digest, or 0 to send each as soon as possible
+            @param rateLimit <int> - Max messages accepted per program per hour, or 0 for no limit
+        '''
+        self.sendFunction = sendFunction
+        self.digestWindow = digestWindow
+        self.rateLimit = rateLimit
+
+        self.condition = threading.Condition(threading.Lock())
+        # recipients <str> -> list<_PendingMail>, oldest recipients first
+        self.pending = OrderedDict()
+        self.numPending = 0
+
+        # Heap of (dueAt, sequence, attempt, to, subject, body) of messages to try again
+        self.retries = []
+        self.retrySequence = 0
+
+        # programName -> deque of times a message was accepted, for the rate limit
+        self.acceptedTimes = {}
+        # programName -> number of messages suppressed since the last one sent
+        self.suppressedCounts = {}
+
+        self.keepGoing = True
+
+        # Totals, for stats
+        self.numQueued = 0
+        self.numSent = 0
+        self.numDigests = 0
+        self.numFailed = 0
+        self.numSuppressed = 0
+        self.numDropped = 0
+        self.numRetried = 0
+
+    def configure(self, digestWindow, rateLimit):
+        '''
+            configure - Change the digest window and rate limit (like after a config reload). Applies to messages already queued.
+
+            @param digestWindow <float> - see #__init__#
+            @param rateLimit <int> - see #__init__#
+        '''
+        with self.condition:
+            self.digestWindow = digestWindow
+            self.rateLimit = rateLimit
+            self.condition.notify_all()
+
+    def add(self, to, subject, body, programName=None):
+        '''
+            add - Queue a message
+
+            @param to <str> - Recipients
+            @param subject <str> - Subject
+            @param body <str> - Body
+            @param programName <str/None> - Program the message is about, which the rate limit applies to. None is never rate limited.
+
+            @return <bool> - True if queued, False if suppressed by the rate limit.
+        '''
+        now = time.time()
+        with self.condition:
+            if programName is not None and self.rateLimit > 0:
+                acceptedTimes = self.acceptedTimes.get(programName, None)
+                if acceptedTimes is None:
+                    acceptedTimes = self.acceptedTimes[programName] = deque()
+                while acceptedTimes and acceptedTimes[0] <= now - RATE_LIMIT_PERIOD:
+                    acceptedTimes.popleft()
+
+                if len(acceptedTimes) >= self.rateLimit:
+                    numSuppressed = self.suppressedCounts.get(programName, 0) + 1
+                    self.suppressedCounts[programName] = numSuppressed
+                    self.numSuppressed += 1
+                    if numSuppressed == 1:
+                        logMsg('Suppressing email alerts about %s, as mail_rate_limit (%d per hour) has been reached.\n' %(programName, self.rateLimit))
+                    return False
+
+                acceptedTimes.append(now)
+
+            if self.numPending >= MAX_PENDING:
+                # Drop the oldest message
+                (oldestTo, oldestMails) = next(iter(self.pending.items()))
+                oldestMails.pop(0)
+                if not oldestMails:
+                    del self.pending[oldestTo]
+                self.numPending -= 1
+                self.numDropped += 1
+
+            mails = self.pending.get(to, None)
+            if mails is None:
+                mails = self.pending[to] = []
+            mails.append( _PendingMail(now, programName, subject, body) )
+            self.numPending += 1
+            self.numQueued += 1
+
+            self.condition.notify_all()
+
+        return True
+
+    def _popDue(self, flushAll=False):
+        # Must hold self.condition. Returns the next message due, as (to, subject, body, attempt, numMails), or None and the time the next is due.
+        now = time.time()
+        nextDue = None
+
+        if self.retries:
+            if flushAll or self.retries[0][0] <= now:
+                (_dueAt, _sequence, attempt, to, subject, body) = heapq.heappop(self.retries)
+                return ( (to, subject, body, attempt, 1), None)
+            nextDue = self.retries[0][0]
+
+        for (to, mails) in self.pending.items():
+            dueAt = mails[0].queuedAt + self.digestWindow
+            if flushAll or dueAt <= now:
+                del self.pending[to]
+                self.numPending -= len(mails)
+                (subject, body) = self._buildMessage(mails)
+                return ( (to, subject, body, 1, len(mails)), None)
+            if nextDue is None or dueAt < nextDue:
+                nextDue = dueAt
+
+        return (None, nextDue)
+
+    def _buildMessage(self, mails):
+        # Must hold self.condition, as it takes the suppressed counts.
+        if len(mails) == 1:
+            (subject, body) = (mails[0].subject, mails[0].body)
+        else:
+            programNames = []
+            for mail in mails:
+                if mail.programName is not None and mail.programName not in programNames:
+                    programNames.append(mail.programName)
+
+            subject = 'usrsvcd digest - %d alerts' %(len(mails), )
+            if programNames:
+                subject += ' for ' + ', '.join(programNames)
+
+            bodyParts = []
+            for mail in mails:
+                bodyParts.append('==== %s ====\n\n%s\n' %(mail.subject, mail.body))
+            body = '\n'.join(bodyParts)
+
+        notes = []
+        for programName in set([mail.programName for mail in mails if mail.programName is not None]):
+            numSuppressed = self.suppressedCounts.pop(programName, 0)
+            if numSuppressed:
+                notes.append('%d further alerts about %s were suppressed by mail_rate_limit.' %(numSuppressed, programName))
+        if notes:
+            body += '\n' + '\n'.join(sorted(notes)) + '\n'
+
+        return (subject, body)
+
+    def _send(self, to, subject, body, attempt, numMails):
+        try:
+            self.sendFunction(to, subject, body)
+        except Exception as e:
+            with self.condition:
+                if attempt < MAX_SEND_ATTEMPTS and self.keepGoing is True:
+                    retryIn = RETRY_BACKOFF * (2 ** (attempt - 1))
+                    logErr('Failed to send mail (attempt %d of %d, trying again in %d seconds): %s\nMail was: %s\n' %(attempt, MAX_SEND_ATTEMPTS, retryIn, str(e), str({'to' : to, 'subject' : subject})) )
+                    self.retrySequence += 1
+                    heapq.heappush(self.retries, (time.time() + retryIn, self.retrySequence, attempt + 1, to, subject, body) )
+                    self.numRetried += 1
+                else:
+                    logErr('Failed to send mail: %s\nMail was: %s\n' %(str(e), str({'to' : to, 'subject' : subject})) )
+                    self.numFailed += 1
+            return False
+
+        with self.condition:
+            self.numSent += 1
+            if numMails > 1:
+                self.numDigests += 1
+        return True
+
+    def runWorker(self):
+        '''
+            runWorker - Send messages as they come due, until #stop# is called. Anything still queued is then sent right away.
+        '''
+        while True:
+            with self.condition:
+                while True:
+                    flushAll = not self.keepGoing
+                    (due, nextDue) = self._popDue(flushAll)
+                    if due is not None or flushAll:
+                        break
+                    if nextDue is None:
+                        self.condition.wait()
+                    else:
+                        self.condition.wait(max(nextDue - time.time(), .01))
+
+                if due is None:
+                    # Stopped, and nothing left to send
+                    return
+
+            self._send(*due)
+
+    def stop(self):
+        '''
+            stop - Have #runWorker# send whatever is queued, and return.
+        '''
+        with self.condition:
+            self.keepGoing = False
+            self.condition.notify_all()
+
+    def getStats(self):
+        '''
+            getStats - Get counters
+
+            @return <dict>
+        '''
+        with self.condition:
+            return {
+                'pending' : self.numPending + len(self.retries),
+                'queued' : self.numQueued,
+                'sent' : self.numSent,
+                'digests' : self.numDigests,
+                'failed' : self.numFailed,
+                'retried' : self.numRetried,
+                'suppressed' : self.numSuppressed,
+                'dropped' : self.numDropped,
+                'suppressed_by_program' : dict(self.suppressedCounts),
+            }
+
+
+# vim:set ts=4 shiftwidth=4 softtabstop=4 expandtab :
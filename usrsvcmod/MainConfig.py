@@ -21,6 +21,7 @@
 import os
 
 from .util import findProgramPath
+from .configcommon import getConfigValueBool, getConfigValueInt, getConfigValueFloat
 
 __all__ = ('MainConfig', )
 
@@ -32,7 +33,7 @@ class MainConfig(object):
         The main op iterations should fetch the relevant sections, and on next loop fetch from new.
     '''
 
-    def __init__(self, config_dir=None, pidfile=None, usrsvcd_stdout=None, usrsvcd_stderr=None, sendmail_path='auto', **kwargs):
+    def __init__(self, config_dir=None, pidfile=None, usrsvcd_stdout=None, usrsvcd_stderr=None, sendmail_path='auto', use_pidfd=False, subreaper=False, launcher_workers=4, control_socket=True, auto_reload=False, monitor_workers=8, mail_digest_window=0, mail_rate_limit=0, mail_transport='sendmail', smtp_host='localhost', smtp_port=25, **kwargs):
         if kwargs:
             raise ValueError('Unknown config options in Main section: %s\n' %(str(list(kwargs.keys())),))
 
@@ -71,6 +72,31 @@ class MainConfig(object):
 
         self.sendmail_path = sendmail_path
 
+        self.use_pidfd = getConfigValueBool(use_pidfd, 'use_pidfd')
+        self.subreaper = getConfigValueBool(subreaper, 'subreaper')
+        self.launcher_workers = getConfigValueInt(launcher_workers, 'launcher_workers')
+        self.control_socket = getConfigValueBool(control_socket, 'control_socket')
+        self.auto_reload = getConfigValueBool(auto_reload, 'auto_reload')
+        self.monitor_workers = getConfigValueInt(monitor_workers, 'monitor_workers')
+        if self.monitor_workers < 1:
+            raise ValueError('monitor_workers in [Main] must be at least 1.')
+
+        self.mail_digest_window = getConfigValueFloat(mail_digest_window, 'mail_digest_window')
+        if self.mail_digest_window < 0:
+            raise ValueError('mail_digest_window in [Main] must be 0 to disable, or a positive number of seconds.')
+        self.mail_rate_limit = getConfigValueInt(mail_rate_limit, 'mail_rate_limit')
+        if self.mail_rate_limit < 0:
+            raise ValueError('mail_rate_limit in [Main] must be 0 to disable, or a positive number of emails per program per hour.')
+
+        if mail_transport not in ('sendmail', 'smtp'):
+            raise ValueError('mail_transport in [Main] must be "sendmail" or "smtp".')
+        self.mail_transport = mail_transport
+        if not smtp_host:
+            raise ValueError('smtp_host in [Main] must not be empty.')
+        self.smtp_host = smtp_host
+        self.smtp_port = getConfigValueInt(smtp_port, 'smtp_port')
+        if self.smtp_port <= 0 or self.smtp_port > 65535:
+            raise ValueError('smtp_port in [Main] must be a port number.')
 
 
     def getProgramConfigDir(self):
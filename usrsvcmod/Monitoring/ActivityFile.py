@@ -21,13 +21,11 @@
 import os
 import time
 
-from func_timeout import FunctionTimedOut
-
 from . import MonitoringBase
 from ..logging import logMsg, logErr
 
-# TODO: We need to implement the check here as launching and joining on a thread, so that we don't lockup all monitoring if someone
-#  uses an NFS file on a disconnected device or anything else that will result in an indefinite uninterruptable ("D") state.
+# Checks run on a MonitorPool worker with a deadline, so an NFS file on a disconnected device (or anything else that will result
+#  in an indefinite uninterruptable ("D") state) only ties up that one worker, rather than locking up all monitoring.
 
 class ActivityFileMonitor(MonitoringBase):
     '''
@@ -74,10 +72,6 @@ class ActivityFileMonitor(MonitoringBase):
             if lastModified < threshold:
                 self.setReason('Restarting %s because it has not modified activity file ( %s ) in %.4f seconds. Limit is %d seconds.\n' %(programName, activityFile, float(now - lastModified), activityFileLimit) )
                 return True
-        except FunctionTimedOut:
-            logErr('MONITOR: ActivityFile timed out on %s\n' %(programName,))
-            raise
-
         except Exception as e:
             # If we got an exception, just log and try again next round.
             logErr('Got an exception in activity file monitoring. Not restarting program. Program="%s" activityfile="%s"\nlocals: %s\n' %(programName, activityFile, str(locals())))
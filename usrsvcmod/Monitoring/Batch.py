@@ -0,0 +1,163 @@
+'''
+    Copyright (c) 2016 Tim Savannah All Rights Reserved.
+    This software is licensed under the terms of the GPLv3.
+    This may change at my discretion, retroactively, and without notice.
+
+    You should have received a copy of this with the source distribution as a file titled, LICENSE.
+
+    The most current license can be found at:
+    https://github.com/kata198/usrsvc/LICENSE
+
+    This location may need to be changed at some point in the future, in which case
+    you are may email Tim Savannah <kata198 at gmail dot com>, or find them on the
+    current website intended for distribution of usrsvc.
+
+
+    ThresholdBatch - Check the simple limits (like rss_limit and fd_limit) of many programs at once.
+'''
+
+# vim:set ts=4 shiftwidth=4 softtabstop=4 expandtab :
+
+import time
+
+from array import array
+
+from .RSSLimit import RSSLimitMonitor
+from .FDLimit import FDLimitMonitor
+from ..logging import logErr
+
+__all__ = ('ThresholdBatch', 'collectMetrics', 'BATCH_METRICS')
+
+# metric name -> function(pid) which reads it. These are checked in this order.
+BATCH_METRICS = (
+    ('rss', RSSLimitMonitor.getRSSKB),
+    ('fds', FDLimitMonitor.getNumFds),
+)
+
+_METRIC_READERS = dict(BATCH_METRICS)
+
+# Value of a metric which could not be read (like the process exited). Never exceeds a limit.
+MISSING_VALUE = -1.0
+
+
+def collectMetrics(pids, limits):
+    '''
+        collectMetrics - Read metrics of many processes in one sweep.
+
+        @param pids <array/list<int>> - Process IDs, one per row
+        @param limits <dict> - metric name <str> -> array<float> of limits, one per row. A metric is only read for rows with a limit > 0.
+
+        @return <dict> - metric name -> array<float> of values, one per row. MISSING_VALUE where not read.
+    '''
+    numRows = len(pids)
+    columns = {}
+    readers = []
+    for (metric, metricLimits) in limits.items():
+        column = array('d', [MISSING_VALUE]) * numRows
+        columns[metric] = column
+        readers.append( (_METRIC_READERS[metric], metricLimits, column) )
+
+    for row in range(numRows):
+        pid = pids[row]
+        for (reader, metricLimits, column) in readers:
+            if metricLimits[row] <= 0:
+                continue
+            try:
+                column[row] = reader(pid)
+            except (IOError, OSError, ValueError, IndexError):
+                # Exited since we found it. The main thread will notice.
+                pass
+
+    return columns
+
+
+class ThresholdBatch(object):
+    '''
+        ThresholdBatch - Collects the metrics (see BATCH_METRICS) of every program added into parallel arrays, in one sweep,
+          and then compares each metric column against its column of limits in a single pass.
+
+            Monitors take part through MonitoringBase.getBatchThreshold. The results are in the same form as MonitoringList.executeList,
+              so a restart goes through the same path.
+    '''
+
+    def __init__(self):
+        # One row per program
+        self.programs = []
+        self.pids = array('l')
+
+        # metric -> array<float> of limits (0 for none), and metric -> list of the monitor with that limit (or None)
+        self.limits = {}
+        self.monitors = {}
+
+    def __len__(self):
+        return len(self.programs)
+
+    def add(self, program, monitors):
+        '''
+            add - Add a running program to the batch
+
+            @param program <usrsvcmod.Program> - The running program
+            @param monitors list<MonitoringBase> - Monitors of the program which have a batch threshold (see MonitoringBase.getBatchThreshold)
+        '''
+        row = len(self.programs)
+        self.programs.append(program)
+        self.pids.append(program.pid)
+
+        for metricLimits in self.limits.values():
+            metricLimits.append(0.0)
+        for metricMonitors in self.monitors.values():
+            metricMonitors.append(None)
+
+        for monitor in monitors:
+            (metric, limit) = monitor.getBatchThreshold()
+            if metric not in self.limits:
+                self.limits[metric] = array('d', [0.0]) * (row + 1)
+                self.monitors[metric] = [None] * (row + 1)
+            self.limits[metric][row] = limit
+            self.monitors[metric][row] = monitor
+
+    def run(self):
+        '''
+            run - Collect the metrics and check them against the limits.
+
+            @return <dict> - program name -> results, as MonitoringList.executeList, for each program which exceeded a limit.
+        '''
+        startTime = time.time()
+
+        columns = collectMetrics(self.pids, self.limits)
+
+        ret = {}
+        for (metric, _reader) in BATCH_METRICS:
+            if metric not in columns:
+                continue
+
+            values = columns[metric]
+            metricLimits = self.limits[metric]
+            exceeded = [row for (row, value, limit) in zip(range(len(values)), values, metricLimits) if 0 < limit < value]
+
+            for row in exceeded:
+                program = self.programs[row]
+                monitor = self.monitors[metric][row]
+                if monitor.programName in ret:
+                    # Already restarting for an earlier metric
+                    continue
+                try:
+                    if monitor.shouldRestartFromBatch(program, values[row]) is not True:
+                        continue
+                except Exception as e:
+                    logErr('Unexpected exception in batch check of %s on %s: %s\n' %(monitor.name, monitor.programName, str(e)))
+                    continue
+
+                ret[monitor.programName] = {
+                    'doRestart' : True,
+                    'triggeredAlert' : monitor,
+                    'reason' : monitor.getReason(),
+                    'runtime' : time.time() - startTime,
+                    'numRan' : 1,
+                    'alerts' : [],
+                }
+
+        return ret
+
+
+# vim:set ts=4 shiftwidth=4 softtabstop=4 expandtab :
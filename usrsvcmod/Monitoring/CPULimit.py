@@ -0,0 +1,192 @@
+'''
+    Copyright (c) 2016 Tim Savannah All Rights Reserved.
+    This software is licensed under the terms of the GPLv3.
+    This may change at my discretion, retroactively, and without notice.
+
+    You should have received a copy of this with the source distribution as a file titled, LICENSE.
+
+    The most current license can be found at:
+    https://github.com/kata198/usrsvc/LICENSE
+
+    This location may need to be changed at some point in the future, in which case
+    you are may email Tim Savannah <kata198 at gmail dot com>, or find them on the
+    current website intended for distribution of usrsvc.
+
+
+    CPULimitMonitor - Monitor CPU usage (percent of one core) over a window of time
+'''
+
+# vim:set ts=4 shiftwidth=4 softtabstop=4 expandtab :
+
+import time
+
+from array import array
+
+from . import MonitoringBase
+from ..logging import logMsg, logErr
+from ..ProcessTable import readProcCpuTicks, CLOCK_TICKS
+from ..Program import Program
+
+__all__ = ('CPULimitMonitor', )
+
+# Bounds on the number of samples kept
+MIN_SAMPLES = 4
+MAX_SAMPLES = 1024
+
+
+class CPULimitMonitor(MonitoringBase):
+    '''
+        CPULimitMonitor - Class for monitoring CPU usage.
+
+            Each check records a sample of (time, CPU ticks used) in a ring buffer. Usage is the ticks used between the newest sample and
+              the newest sample at least #cpuLimitWindow# seconds older, as a percentage of one core. A restart is triggered once usage
+              has been over #cpuLimit# on every check for #cpuLimitDuration# seconds.
+    '''
+
+    def __init__(self, programName, cpuLimit, cpuLimitDuration=60, cpuLimitWindow=10, cpuLimitScope='process', monitorInterval=5):
+        '''
+            @param programName <str> - Name of program
+            @param cpuLimit <float> - Max percent of one core (so 200 is two full cores)
+            @param cpuLimitDuration <float> - Seconds usage must stay over #cpuLimit# before restarting
+            @param cpuLimitWindow <float> - Seconds over which usage is measured
+            @param cpuLimitScope <str> - "process" for only the program's process, or "tree" to include all of its descendants
+            @param monitorInterval <float> - Seconds between checks, used to size the ring buffer
+        '''
+        MonitoringBase.__init__(self)
+
+        self.programName = programName
+        self.cpuLimit = cpuLimit
+        self.cpuLimitDuration = cpuLimitDuration
+        self.cpuLimitWindow = cpuLimitWindow
+        self.cpuLimitScope = cpuLimitScope
+
+        # Enough samples to span the window even if checks run at twice the rate (adaptive_interval)
+        self.numSamples = min(max(int(cpuLimitWindow * 2.0 / monitorInterval) + 3, MIN_SAMPLES), MAX_SAMPLES)
+
+        self.sampleTimes = array('d', [0.0]) * self.numSamples
+        self.sampleTicks = array('d', [0.0]) * self.numSamples
+        self.reset()
+
+    @classmethod
+    def createFromConfig(cls, programConfig):
+        monitoringConfig = programConfig.Monitoring
+        if not monitoringConfig.cpu_limit:
+            return None
+
+        return cls(programConfig.name, monitoringConfig.cpu_limit, monitoringConfig.cpu_limit_duration, monitoringConfig.cpu_limit_window,
+            monitoringConfig.cpu_limit_scope, monitoringConfig.monitor_interval)
+
+    def reset(self):
+        MonitoringBase.reset(self)
+
+        # Next slot to write, and number of valid samples
+        self.sampleIdx = 0
+        self.sampleCount = 0
+
+        # pid the samples are from
+        self.pid = None
+        # Time usage was first seen over the limit, in the current streak
+        self.overLimitSince = None
+
+    def getTicks(self, pid):
+        '''
+            getTicks - Get the CPU ticks used by the process (or process tree, depending on scope)
+
+            @param pid <int> - pid of the program
+
+            @return <int> - Clock ticks
+        '''
+        if self.cpuLimitScope != 'tree':
+            return readProcCpuTicks(pid)
+
+        # Include children which have exited (cutime/cstime), so the total does not drop when one does.
+        ticks = readProcCpuTicks(pid, includeChildren=True)
+        for childPid in Program.getAllChildPidsInTree(pid):
+            try:
+                ticks += readProcCpuTicks(childPid, includeChildren=True)
+            except (IOError, OSError, ValueError):
+                # Exited since we listed it
+                pass
+        return ticks
+
+    def addSample(self, sampleTime, ticks):
+        '''
+            addSample - Record a sample
+
+            @param sampleTime <float> - Epoch time of sample
+            @param ticks <int> - Total CPU ticks at that time
+        '''
+        idx = self.sampleIdx
+        self.sampleTimes[idx] = sampleTime
+        self.sampleTicks[idx] = ticks
+        self.sampleIdx = (idx + 1) % self.numSamples
+        if self.sampleCount < self.numSamples:
+            self.sampleCount += 1
+
+    def getUsage(self):
+        '''
+            getUsage - Get CPU usage over the window, from the recorded samples.
+
+            @return <float/None> - Percent of one core, or None if we do not yet have samples spanning the window.
+        '''
+        if self.sampleCount < 2:
+            return None
+
+        numSamples = self.numSamples
+        newestIdx = (self.sampleIdx - 1) % numSamples
+        newestTime = self.sampleTimes[newestIdx]
+        windowStart = newestTime - self.cpuLimitWindow
+
+        # Walk back from the newest, to the newest sample at least a window older
+        for i in range(1, self.sampleCount):
+            idx = (newestIdx - i) % numSamples
+            if self.sampleTimes[idx] <= windowStart:
+                elapsed = newestTime - self.sampleTimes[idx]
+                usedTicks = self.sampleTicks[newestIdx] - self.sampleTicks[idx]
+                if elapsed <= 0:
+                    return None
+                # A process in the tree which exits without being waited for takes its ticks with it, so never report negative.
+                return max(usedTicks, 0) / float(CLOCK_TICKS) / elapsed * 100.0
+
+        return None
+
+    def shouldRestart(self, program):
+        cpuLimit = self.cpuLimit
+
+        if cpuLimit <= 0:
+            # Yes this is checked twice if created through createFromConfig, but it may be called otherwise so better safe.
+            return False
+
+        try:
+            if program.pid != self.pid:
+                # New process, the old samples are meaningless.
+                self.reset()
+                self.pid = program.pid
+
+            now = time.time()
+            self.addSample(now, self.getTicks(program.pid))
+
+            usage = self.getUsage()
+            if usage is None:
+                return False
+
+            if usage <= cpuLimit:
+                self.overLimitSince = None
+                return False
+
+            if self.overLimitSince is None:
+                # The usage measured covers the window before now, so the streak began at the start of it.
+                self.overLimitSince = now - self.cpuLimitWindow
+
+            overLimitFor = now - self.overLimitSince
+            if overLimitFor >= self.cpuLimitDuration:
+                self.setReason('Restarting %s because CPU usage %.1f%% has exceeded limit of %.1f%% for %d seconds' %(self.programName, usage, cpuLimit, int(overLimitFor)))
+                return True
+        except Exception as e:
+            # If we got an exception, just log and try again next round.
+            logErr('Got an exception in CPU monitoring. Not restarting program. Program="%s"\n%s\nError: %s\n' %(self.programName, str(program), str(e)))
+
+        return False
+
+
+# vim:set ts=4 shiftwidth=4 softtabstop=4 expandtab :
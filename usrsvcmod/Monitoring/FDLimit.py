@@ -0,0 +1,89 @@
+'''
+    Copyright (c) 2016 Tim Savannah All Rights Reserved.
+    This software is licensed under the terms of the GPLv3.
+    This may change at my discretion, retroactively, and without notice.
+
+    You should have received a copy of this with the source distribution as a file titled, LICENSE.
+
+    The most current license can be found at:
+    https://github.com/kata198/usrsvc/LICENSE
+
+    This location may need to be changed at some point in the future, in which case
+    you are may email Tim Savannah <kata198 at gmail dot com>, or find them on the
+    current website intended for distribution of usrsvc.
+
+
+    FDLimitMonitor - Monitor the number of open file descriptors
+'''
+
+# vim:set ts=4 shiftwidth=4 softtabstop=4 expandtab :
+
+import os
+
+from . import MonitoringBase
+from ..logging import logMsg, logErr
+
+__all__ = ('FDLimitMonitor', )
+
+
+class FDLimitMonitor(MonitoringBase):
+    '''
+        FDLimitMonitor - Class for monitoring the number of open file descriptors (like a program leaking sockets)
+    '''
+
+    def __init__(self, programName, fdLimit):
+        '''
+            @param programName <str> - Name of program
+            @param fdLimit <int> - Maximum number of open file descriptors
+        '''
+        MonitoringBase.__init__(self)
+
+        self.programName = programName
+        self.fdLimit = fdLimit
+
+    @classmethod
+    def createFromConfig(cls, programConfig):
+        if not programConfig.Monitoring.fd_limit:
+            return None
+
+        return cls(programConfig.name, programConfig.Monitoring.fd_limit)
+
+    @staticmethod
+    def getNumFds(pid):
+        '''
+            getNumFds - Get the number of open file descriptors of a process
+
+            @param pid <int> - Process ID
+
+            @return <int> - Number of open file descriptors
+        '''
+        return len(os.listdir('/proc/%d/fd' %(pid,)))
+
+    def getBatchThreshold(self):
+        if self.fdLimit <= 0:
+            return None
+        return ('fds', self.fdLimit)
+
+    def shouldRestartFromBatch(self, program, value):
+        self.setReason('Restarting %s because %d open file descriptors exceeds limit of %d' %(self.programName, value, self.fdLimit))
+        return True
+
+    def shouldRestart(self, program):
+        fdLimit = self.fdLimit
+
+        if fdLimit <= 0:
+            # Yes this is checked twice if created through createFromConfig, but it may be called otherwise so better safe.
+            return False
+
+        try:
+            numFds = self.getNumFds(program.pid)
+            if numFds > fdLimit:
+                return self.shouldRestartFromBatch(program, numFds)
+        except Exception as e:
+            # If we got an exception, just log and try again next round.
+            logErr('Got an exception in fd monitoring. Not restarting program. Program="%s"\n%s\nError: %s\n' %(self.programName, str(program), str(e)))
+
+        return False
+
+
+# vim:set ts=4 shiftwidth=4 softtabstop=4 expandtab :
@@ -21,11 +21,17 @@
 from . import MonitoringList
 from .ActivityFile import ActivityFileMonitor
 from .RSSLimit import RSSLimitMonitor
+from .RSSTrend import RSSTrendMonitor
+from .PSSLimit import PSSLimitMonitor
+from .CPULimit import CPULimitMonitor
+from .FDLimit import FDLimitMonitor
 
 from ..logging import logErr
 
+__all__ = ('MonitoringFactory', 'MonitorRegistry', 'ALL_MONITORING_CLASSES')
 
-ALL_MONITORING_CLASSES = [ActivityFileMonitor, RSSLimitMonitor]
+
+ALL_MONITORING_CLASSES = [ActivityFileMonitor, RSSLimitMonitor, RSSTrendMonitor, PSSLimitMonitor, CPULimitMonitor, FDLimitMonitor]
 
 
 class MonitoringFactory(object):
@@ -54,4 +60,102 @@ class MonitoringFactory(object):
         return ret
 
 
+class MonitorRegistry(object):
+    '''
+        MonitorRegistry - Holds the monitors of every program, so they persist (and may keep state, like previous samples) from one pass to the next.
+
+            A program's monitors are only created again when its MonitoringConfig changes.
+
+            Monitors which have a batch threshold (see MonitoringBase.getBatchThreshold) are kept apart from the rest,
+              to be checked through a ThresholdBatch.
+    '''
+
+    def __init__(self):
+        # programName -> (MonitoringConfig the monitors were created from, MonitoringList, list of batch monitors)
+        self.entries = {}
+
+    def _getEntry(self, programConfig):
+        programName = programConfig.name
+        monitoringConfig = programConfig.Monitoring
+
+        entry = self.entries.get(programName, None)
+        if entry is not None and (entry[0] is monitoringConfig or entry[0] == monitoringConfig):
+            return entry
+
+        monitors = MonitoringList()
+        batchMonitors = MonitoringList()
+        for monitor in MonitoringFactory.getAsyncMonitorsForProgram(programConfig):
+            if monitor.getBatchThreshold() is not None:
+                batchMonitors.append(monitor)
+            else:
+                monitors.append(monitor)
+
+        entry = (monitoringConfig, monitors, batchMonitors)
+        self.entries[programName] = entry
+
+        return entry
+
+    def getMonitors(self, programConfig):
+        '''
+            getMonitors - Get the monitors for a program, creating them if the program is new or its monitoring config has changed.
+
+            @param programConfig <usrsvcmod.ProgramConfig obj> - The ProgramConfig for this program
+
+            @return <MonitoringList> - The program's monitors which are run through #executeList# (may be empty). Does not include batch monitors.
+        '''
+        return self._getEntry(programConfig)[1]
+
+    def getBatchMonitors(self, programConfig):
+        '''
+            getBatchMonitors - Get the monitors for a program which are checked through a ThresholdBatch
+
+            @param programConfig <usrsvcmod.ProgramConfig obj> - The ProgramConfig for this program
+
+            @return <MonitoringList> - The program's batch monitors (may be empty)
+        '''
+        return self._getEntry(programConfig)[2]
+
+    def update(self, programConfigs, programNames=None):
+        '''
+            update - Bring the registry up to date with a (new) config. Monitors of programs no longer configured are dropped.
+
+            @param programConfigs <dict> - program name <str> to ProgramConfig, for all programs
+            @param programNames <None/iterable<str>> - Names of programs which may have changed (like added+changed from UsrsvcConfig.getProgramChanges),
+                or None to check every program.
+        '''
+        for programName in list(self.entries.keys()):
+            if programName not in programConfigs:
+                del self.entries[programName]
+
+        if programNames is None:
+            programNames = programConfigs.keys()
+
+        for programName in programNames:
+            programConfig = programConfigs.get(programName, None)
+            if programConfig is not None:
+                self.getMonitors(programConfig)
+
+    def resetProgram(self, programName):
+        '''
+            resetProgram - Reset the state of a program's monitors, after it has been restarted.
+
+            @param programName <str> - Name of program
+        '''
+        entry = self.entries.get(programName, None)
+        if entry is not None:
+            entry[1].reset()
+            entry[2].reset()
+
+    def remove(self, programName):
+        '''
+            remove - Drop a program's monitors
+
+            @param programName <str> - Name of program
+        '''
+        self.entries.pop(programName, None)
+
+    def __len__(self):
+        return len(self.entries)
+
+
 # vim:set ts=4 shiftwidth=4 softtabstop=4 expandtab :
@@ -0,0 +1,82 @@
+'''
+    Copyright (c) 2016 Tim Savannah All Rights Reserved.
+    This software is licensed under the terms of the GPLv3.
+    This may change at my discretion, retroactively, and without notice.
+
+    You should have received a copy of this with the source distribution as a file titled, LICENSE.
+
+    The most current license can be found at:
+    https://github.com/kata198/usrsvc/LICENSE
+
+    This location may need to be changed at some point in the future, in which case
+    you are may email Tim Savannah <kata198 at gmail dot com>, or find them on the
+    current website intended for distribution of usrsvc.
+
+
+    PSSLimitMonitor - Monitor maximum PSS (Proportional Set Size) of a program's whole process tree
+'''
+
+# vim:set ts=4 shiftwidth=4 softtabstop=4 expandtab :
+
+from . import MonitoringBase
+from ..logging import logMsg, logErr
+from ..ProcessTable import readProcPssKB
+from ..Program import Program
+
+__all__ = ('PSSLimitMonitor', )
+
+
+class PSSLimitMonitor(MonitoringBase):
+    '''
+       PSSLimitMonitor - Class for monitoring the PSS of a program and all of its descendants.
+
+            PSS counts each shared page divided among the processes sharing it, so unlike RSS it can be summed over a pre-fork server
+              (a master and its workers) without counting shared memory once per worker.
+    '''
+
+    def __init__(self, programName, pssLimit):
+        '''
+            @param programName <str> - Name of program
+            @param pssLimit <int> - kB maximum total PSS
+        '''
+        MonitoringBase.__init__(self)
+
+        self.programName = programName
+        self.pssLimit = pssLimit
+
+    @classmethod
+    def createFromConfig(cls, programConfig):
+        if not programConfig.Monitoring.pss_limit:
+            return None
+
+        return cls(programConfig.name, programConfig.Monitoring.pss_limit)
+
+    def shouldRestart(self, program):
+        pssLimit = self.pssLimit
+
+        if pssLimit <= 0:
+            # Yes this is checked twice if created through createFromConfig, but it may be called otherwise so better safe.
+            return False
+
+        try:
+            pssKB = readProcPssKB(program.pid)
+            numProcesses = 1
+            for childPid in Program.getAllChildPidsInTree(program.pid):
+                try:
+                    pssKB += readProcPssKB(childPid)
+                    numProcesses += 1
+                except (IOError, OSError, ValueError):
+                    # Exited since we listed it
+                    pass
+
+            if pssKB > pssLimit:
+                self.setReason('Restarting %s because total PSS size of its %d processes %dkB exceeds limit of %dkB' %(self.programName, numProcesses, pssKB, pssLimit))
+                return True
+        except Exception as e:
+            # If we got an exception, just log and try again next round.
+            logErr('Got an exception in PSS monitoring. Not restarting program. Program="%s"\n%s\nError: %s\n' %(self.programName, str(program), str(e)))
+
+        return False
+
+
+# vim:set ts=4 shiftwidth=4 softtabstop=4 expandtab :
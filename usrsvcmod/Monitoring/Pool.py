@@ -0,0 +1,236 @@
+'''
+    Copyright (c) 2016 Tim Savannah All Rights Reserved.
+    This software is licensed under the terms of the GPLv3.
+    This may change at my discretion, retroactively, and without notice.
+
+    You should have received a copy of this with the source distribution as a file titled, LICENSE.
+
+    The most current license can be found at:
+    https://github.com/kata198/usrsvc/LICENSE
+
+    This location may need to be changed at some point in the future, in which case
+    you are may email Tim Savannah <kata198 at gmail dot com>, or find them on the
+    current website intended for distribution of usrsvc.
+
+
+    MonitorPool - A fixed pool of monitor worker threads, which run the checks of many programs at once, each with a deadline.
+'''
+
+# vim:set ts=4 shiftwidth=4 softtabstop=4 expandtab :
+
+import threading
+import time
+
+from collections import deque
+
+from ..logging import logErr
+
+__all__ = ('MonitorPool', 'CHECK_OK', 'CHECK_ERROR', 'CHECK_TIMEOUT', 'CHECK_STUCK')
+
+# The check completed, and its return value is the result
+CHECK_OK = 'ok'
+
+# The check raised an exception, which is the result
+CHECK_ERROR = 'error'
+
+# The check did not complete by its deadline. Its worker is quarantined.
+CHECK_TIMEOUT = 'timeout'
+
+# The check was not run, as the previous check with the same key is still stuck on a quarantined worker
+#  (or every worker is quarantined).
+CHECK_STUCK = 'stuck'
+
+
+class _MonitorWorker(object):
+
+    def __init__(self, pool):
+        self.pool = pool
+        # (key, function, args, batch) being run, and when it began
+        self.currentJob = None
+        self.startedAt = None
+        # Set when the current job blew its deadline. The thread exits once the job returns (if ever).
+        self.quarantined = False
+
+        self.thread = threading.Thread(target=self.pool._workerMain, args=(self, ))
+        self.thread.daemon = True
+
+
+class _Batch(object):
+
+    def __init__(self, numJobs):
+        # key -> (CHECK_*, result)
+        self.results = {}
+        self.numPending = numJobs
+
+
+class MonitorPool(object):
+    '''
+        MonitorPool - Runs checks concurrently on a fixed number of worker threads, with a deadline for each check.
+
+            A thread cannot be killed, so a check which is still running at its deadline (like a stat on a hung NFS mount)
+              has its worker quarantined: it is given up on, and a fresh worker takes its place. The stuck thread exits if the check
+              ever returns. Further checks with the same key are not run while it is stuck, and at most #maxQuarantined#
+              workers are quarantined at once, so a stuck check never leaks more than one thread.
+    '''
+
+    def __init__(self, numWorkers, maxQuarantined=None):
+        '''
+            @param numWorkers <int> - Number of worker threads
+            @param maxQuarantined <int/None> - Max number of quarantined workers before no more are replaced. Default is #numWorkers#
+        '''
+        self.numWorkers = max(int(numWorkers), 1)
+        if maxQuarantined is None:
+            maxQuarantined = self.numWorkers
+        self.maxQuarantined = maxQuarantined
+
+        self.condition = threading.Condition(threading.Lock())
+        self.queue = deque()
+
+        self.workers = []
+        # key -> _MonitorWorker, for checks which are stuck past their deadline
+        self.stuckKeys = {}
+
+        self.keepGoing = True
+        # Totals, for stats
+        self.numTimedOut = 0
+
+        with self.condition:
+            self._replenish()
+
+    def _replenish(self):
+        # Must hold self.condition
+        numQuarantined = len(self.stuckKeys)
+        while len(self.workers) < self.numWorkers and numQuarantined < self.maxQuarantined:
+            worker = _MonitorWorker(self)
+            self.workers.append(worker)
+            worker.thread.start()
+
+    def _workerMain(self, worker):
+        while True:
+            with self.condition:
+                while not self.queue and self.keepGoing is True and worker.quarantined is False:
+                    self.condition.wait()
+                if self.keepGoing is False or worker.quarantined is True:
+                    return
+                job = self.queue.popleft()
+                worker.currentJob = job
+                worker.startedAt = time.time()
+
+            (key, function, args, batch) = job
+            try:
+                result = (CHECK_OK, function(*args))
+            except Exception as e:
+                result = (CHECK_ERROR, e)
+
+            with self.condition:
+                worker.currentJob = None
+                worker.startedAt = None
+                if worker.quarantined is True:
+                    # Too late. Our slot was already filled with a timeout, and another worker took our place.
+                    if self.stuckKeys.get(key, None) is worker:
+                        del self.stuckKeys[key]
+                    logErr('MONITOR: Stuck check on %s finally returned after its deadline.\n' %(str(key), ))
+                    return
+
+                batch.results[key] = result
+                batch.numPending -= 1
+                self.condition.notify_all()
+
+    def isStuck(self, key):
+        '''
+            isStuck - Check if a check with the given key is stuck past its deadline (on a quarantined worker)
+
+            @param key - Key of the check
+
+            @return <bool>
+        '''
+        with self.condition:
+            return key in self.stuckKeys
+
+    def getNumQuarantined(self):
+        '''
+            getNumQuarantined - Get the number of workers currently quarantined (stuck on a check)
+
+            @return <int>
+        '''
+        with self.condition:
+            return len(self.stuckKeys)
+
+    def runAll(self, jobs, timeout):
+        '''
+            runAll - Run a batch of checks concurrently, and wait until each has completed or passed its deadline.
+
+            @param jobs list<tuple> - List of (key, function, args). Each key must be unique within the batch.
+            @param timeout <float> - Seconds each check may run (from when a worker begins it) before it is given up on.
+
+            @return <dict> - key -> (status, result), where status is one of CHECK_OK (result is the return value),
+                CHECK_ERROR (result is the exception), CHECK_TIMEOUT, or CHECK_STUCK (result is None).
+        '''
+        with self.condition:
+            self._replenish()
+
+            batch = _Batch(0)
+            for (key, function, args) in jobs:
+                if key in self.stuckKeys:
+                    batch.results[key] = (CHECK_STUCK, None)
+                    continue
+                self.queue.append( (key, function, args, batch) )
+                batch.numPending += 1
+            self.condition.notify_all()
+
+            while batch.numPending > 0:
+                now = time.time()
+                nextDeadline = None
+                for worker in self.workers[:]:
+                    job = worker.currentJob
+                    if job is None or job[3] is not batch:
+                        continue
+                    deadline = worker.startedAt + timeout
+                    if deadline > now:
+                        if nextDeadline is None or deadline < nextDeadline:
+                            nextDeadline = deadline
+                        continue
+
+                    # Past its deadline. Give up on it, and put a fresh worker in its place.
+                    key = job[0]
+                    worker.quarantined = True
+                    self.workers.remove(worker)
+                    self.stuckKeys[key] = worker
+                    self.numTimedOut += 1
+                    batch.results[key] = (CHECK_TIMEOUT, None)
+                    batch.numPending -= 1
+                    self._replenish()
+                    self.condition.notify_all()
+
+                if batch.numPending <= 0:
+                    break
+
+                if not self.workers:
+                    # Every worker is quarantined. Nothing left to run what is queued.
+                    for queuedJob in list(self.queue):
+                        if queuedJob[3] is batch:
+                            self.queue.remove(queuedJob)
+                            batch.results[queuedJob[0]] = (CHECK_STUCK, None)
+                            batch.numPending -= 1
+                    continue
+
+                if nextDeadline is None:
+                    # Nothing of ours is running yet (all workers are busy picking up)
+                    waitTime = timeout
+                else:
+                    waitTime = nextDeadline - now
+                self.condition.wait(max(waitTime, 0.01))
+
+            return batch.results
+
+    def shutdown(self):
+        '''
+            shutdown - Have all idle workers exit. Workers in the middle of a check exit after it.
+        '''
+        with self.condition:
+            self.keepGoing = False
+            self.queue.clear()
+            self.condition.notify_all()
+
+
+# vim:set ts=4 shiftwidth=4 softtabstop=4 expandtab :
@@ -18,10 +18,10 @@
 
 # vim:set ts=4 shiftwidth=4 softtabstop=4 expandtab :
 
-from func_timeout import FunctionTimedOut
-
 from . import MonitoringBase
 from ..logging import logMsg, logErr
+from ..Program import Program
+from ..ProcHandleCache import readProcFile
 
 
 
@@ -37,22 +37,68 @@ class RSSLimitMonitor(MonitoringBase):
        RSSLimitMonitor - Class for monitoring RSS
     '''
 
-    def __init__(self, programName, rssLimit):
+    def __init__(self, programName, rssLimit, rssLimitScope='process'):
         '''
             @param programName <str> - Name of program
             @param rssLimit <int> - kB maximum RSS size
+            @param rssLimitScope <str> - "process" for only the program's process, or "tree" for the sum over it and all of its descendants
         '''
         MonitoringBase.__init__(self)
 
         self.programName = programName
         self.rssLimit = rssLimit
+        self.rssLimitScope = rssLimitScope
 
     @classmethod
     def createFromConfig(cls, programConfig):
         if not programConfig.Monitoring.rss_limit:
             return None
 
-        return cls(programConfig.name, programConfig.Monitoring.rss_limit)
+        return cls(programConfig.name, programConfig.Monitoring.rss_limit, programConfig.Monitoring.rss_limit_scope)
+
+    @staticmethod
+    def getRSSKB(pid):
+        '''
+            getRSSKB - Get the RSS of a process. The statm file is kept open between calls (see ProcHandleCache).
+
+            @param pid <int> - Process ID
+
+            @return <int> - RSS in kB
+        '''
+        fields = readProcFile(pid, 'statm').split()
+        rssPages = int(fields[1])
+        return int((rssPages * PAGE_SIZE) / 1024)
+
+    def getTotalRSSKB(self, pid, stopAbove=None):
+        '''
+            getTotalRSSKB - Get the RSS of the program, or of its whole process tree with rss_limit_scope=tree
+
+            @param pid <int> - pid of the program
+            @param stopAbove <int/None> - If provided, stop adding up the tree once the total exceeds this
+
+            @return <int> - RSS in kB
+        '''
+        rssKB = self.getRSSKB(pid)
+        if self.rssLimitScope == 'tree':
+            for childPid in Program.getAllChildPidsInTree(pid):
+                try:
+                    rssKB += self.getRSSKB(childPid)
+                except (IOError, OSError, ValueError, IndexError):
+                    # Exited since we listed it
+                    pass
+                if stopAbove is not None and rssKB > stopAbove:
+                    break
+        return rssKB
+
+    def getBatchThreshold(self):
+        # Only the program's own process can be checked in a batch, the tree needs its children found first.
+        if self.rssLimitScope != 'process' or self.rssLimit <= 0:
+            return None
+        return ('rss', self.rssLimit)
+
+    def shouldRestartFromBatch(self, program, value):
+        self.setReason('Restarting %s because RSS size %dkB exceeds limit of %dkB' %(self.programName, value, self.rssLimit))
+        return True
 
     def shouldRestart(self, program):
         rssLimit = self.rssLimit
@@ -62,17 +108,14 @@ class RSSLimitMonitor(MonitoringBase):
             return False
 
         try:
-            with open('/proc/%d/statm' %(program.pid,), 'rt') as f:
-                contents = f.read()
-            fields = contents.split()
-            rssPages = int(fields[1])
-            rssKB = int((rssPages * PAGE_SIZE) / 1024)
+            # No need to read the rest of the tree once over the limit
+            rssKB = self.getTotalRSSKB(program.pid, stopAbove=rssLimit)
             if rssKB > self.rssLimit:
-                self.setReason('Restarting %s because RSS size %dkB exceeds limit of %dkB' %(self.programName, rssKB, rssLimit))
+                if self.rssLimitScope == 'tree':
+                    self.setReason('Restarting %s because total RSS size of its process tree %dkB exceeds limit of %dkB' %(self.programName, rssKB, rssLimit))
+                else:
+                    self.setReason('Restarting %s because RSS size %dkB exceeds limit of %dkB' %(self.programName, rssKB, rssLimit))
                 return True
-        except FunctionTimedOut:
-            logErr('MONITOR: RSSLimit timed out on %s\n' %(self.programName,))
-            raise
         except Exception as e:
             # If we got an exception, just log and try again next round.
             logErr('Got an exception in RSS monitoring. Not restarting program. Program="%s"\n%s\nlocals: %s\n' %(self.programName, str(program), str(locals())))
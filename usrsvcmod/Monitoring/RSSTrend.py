@@ -0,0 +1,261 @@
+'''
+    Copyright (c) 2016 Tim Savannah All Rights Reserved.
+    This software is licensed under the terms of the GPLv3.
+    This may change at my discretion, retroactively, and without notice.
+
+    You should have received a copy of this with the source distribution as a file titled, LICENSE.
+
+    The most current license can be found at:
+    https://github.com/kata198/usrsvc/LICENSE
+
+    This location may need to be changed at some point in the future, in which case
+    you are may email Tim Savannah <kata198 at gmail dot com>, or find them on the
+    current website intended for distribution of usrsvc.
+
+
+
+    RSSTrendMonitor - Detect a steady memory leak, and act before the RSS limit is reached
+'''
+
+# vim:set ts=4 shiftwidth=4 softtabstop=4 expandtab :
+
+import time
+
+from array import array
+
+from .RSSLimit import RSSLimitMonitor
+from ..logging import logMsg, logErr
+
+__all__ = ('RSSTrendMonitor', )
+
+# Bounds on the number of samples kept
+MIN_SAMPLES = 8
+MAX_SAMPLES = 4096
+
+# Samples must span at least this fraction of the trend window before a slope is trusted
+MIN_SPAN_FRACTION = .25
+
+
+class RSSTrendMonitor(RSSLimitMonitor):
+    '''
+        RSSTrendMonitor - Class for monitoring the growth of RSS.
+
+            Each check records a sample of (time, RSS) in a ring buffer. A least-squares line is fit over the samples within
+              #rssTrendWindow# seconds, and if RSS is growing fast enough to reach #rssLimit# within #rssTrendHorizon# seconds,
+              the program is restarted (or an alert is raised, with rssTrendAction="alert"). A window too long for MAX_SAMPLES
+              checks is downsampled, keeping samples evenly spaced across it.
+
+            With #rssTrendRestartWindow#, a restart is put off until that time of day, unless the limit is projected to be
+              hit before the window opens.
+    '''
+
+    def __init__(self, programName, rssLimit, rssTrendHorizon, rssTrendWindow=3600, rssTrendAction='restart', rssTrendRestartWindow=None, rssLimitScope='process', monitorInterval=5):
+        '''
+            @param programName <str> - Name of program
+            @param rssLimit <int> - kB maximum RSS size
+            @param rssTrendHorizon <float> - Act if rssLimit is projected to be reached within this many seconds
+            @param rssTrendWindow <float> - Seconds of samples to fit the trend over
+            @param rssTrendAction <str> - "restart" or "alert"
+            @param rssTrendRestartWindow <tuple/None> - (startMinute, endMinute) of the day in local time to restart within, or None for any time
+            @param rssLimitScope <str> - "process" or "tree", as with RSSLimitMonitor
+            @param monitorInterval <float> - Seconds between checks, used to size the ring buffer
+        '''
+        RSSLimitMonitor.__init__(self, programName, rssLimit, rssLimitScope)
+
+        self.rssTrendHorizon = rssTrendHorizon
+        self.rssTrendWindow = rssTrendWindow
+        self.rssTrendAction = rssTrendAction
+        self.rssTrendRestartWindow = rssTrendRestartWindow
+
+        # Enough samples to span the window even if checks run at twice the rate (adaptive_interval)
+        wantedSamples = int(rssTrendWindow * 2.0 / monitorInterval) + 3
+        self.numSamples = min(max(wantedSamples, MIN_SAMPLES), MAX_SAMPLES)
+
+        # A long window would need more than MAX_SAMPLES, so keep samples at least this many seconds apart (0 for every sample).
+        if wantedSamples > MAX_SAMPLES:
+            self.minSampleSpacing = rssTrendWindow / float(MAX_SAMPLES - 4)
+        else:
+            self.minSampleSpacing = 0
+
+        self.sampleTimes = array('d', [0.0]) * self.numSamples
+        self.sampleRSS = array('d', [0.0]) * self.numSamples
+        self.reset()
+
+    @classmethod
+    def createFromConfig(cls, programConfig):
+        monitoringConfig = programConfig.Monitoring
+        if not monitoringConfig.rss_trend_horizon or not monitoringConfig.rss_limit:
+            return None
+
+        return cls(programConfig.name, monitoringConfig.rss_limit, monitoringConfig.rss_trend_horizon, monitoringConfig.rss_trend_window,
+            monitoringConfig.rss_trend_action, monitoringConfig.rss_trend_restart_window, monitoringConfig.rss_limit_scope, monitoringConfig.monitor_interval)
+
+    def getBatchThreshold(self):
+        # Needs a history of samples, not just a limit
+        return None
+
+    def reset(self):
+        RSSLimitMonitor.reset(self)
+
+        # Next slot to write, and number of valid samples
+        self.sampleIdx = 0
+        self.sampleCount = 0
+
+        # pid the samples are from
+        self.pid = None
+        # pid we have already alerted on, so an alert is only sent once per process
+        self.alertedPid = None
+
+    def addSample(self, sampleTime, rssKB):
+        '''
+            addSample - Record a sample
+
+            @param sampleTime <float> - Epoch time of sample
+            @param rssKB <int> - RSS at that time
+        '''
+        if self.minSampleSpacing and self.sampleCount >= 2:
+            numSamples = self.numSamples
+            if sampleTime - self.sampleTimes[(self.sampleIdx - 2) % numSamples] < self.minSampleSpacing:
+                # Too soon after the sample before the newest. Replace the newest, so the fit still has the latest RSS.
+                idx = (self.sampleIdx - 1) % numSamples
+                self.sampleTimes[idx] = sampleTime
+                self.sampleRSS[idx] = rssKB
+                return
+
+        idx = self.sampleIdx
+        self.sampleTimes[idx] = sampleTime
+        self.sampleRSS[idx] = rssKB
+        self.sampleIdx = (idx + 1) % self.numSamples
+        if self.sampleCount < self.numSamples:
+            self.sampleCount += 1
+
+    def getSlope(self):
+        '''
+            getSlope - Get the growth rate of RSS, fit by least squares over the samples within the trend window.
+
+            @return <float/None> - kB per second, or None if the samples do not yet span enough of the window
+        '''
+        if self.sampleCount < 3:
+            return None
+
+        numSamples = self.numSamples
+        sampleTimes = self.sampleTimes
+        sampleRSS = self.sampleRSS
+
+        newestIdx = (self.sampleIdx - 1) % numSamples
+        newestTime = sampleTimes[newestIdx]
+        windowStart = newestTime - self.rssTrendWindow
+
+        # Times are taken relative to the newest sample, to keep the sums small
+        n = 0
+        sumX = sumY = sumXX = sumXY = 0.0
+        oldestTime = newestTime
+        for i in range(self.sampleCount):
+            idx = (newestIdx - i) % numSamples
+            sampleTime = sampleTimes[idx]
+            if sampleTime < windowStart:
+                break
+            x = sampleTime - newestTime
+            y = sampleRSS[idx]
+            n += 1
+            sumX += x
+            sumY += y
+            sumXX += x * x
+            sumXY += x * y
+            oldestTime = sampleTime
+
+        if n < 3 or (newestTime - oldestTime) < self.rssTrendWindow * MIN_SPAN_FRACTION:
+            return None
+
+        denominator = n * sumXX - sumX * sumX
+        if denominator <= 0:
+            return None
+
+        return (n * sumXY - sumX * sumY) / denominator
+
+    @staticmethod
+    def getSecondsUntilWindow(restartWindow, now=None):
+        '''
+            getSecondsUntilWindow - Get the number of seconds until a daily window of local time opens
+
+            @param restartWindow <tuple> - (startMinute, endMinute) of the day. endMinute may be less than startMinute, for a window past midnight.
+            @param now <float/None> - Epoch time, or None for current time
+
+            @return <float> - 0 if within the window now, otherwise seconds until it begins.
+        '''
+        if now is None:
+            now = time.time()
+
+        (startMinute, endMinute) = restartWindow
+        localTime = time.localtime(now)
+        secondOfDay = localTime.tm_hour * 3600 + localTime.tm_min * 60 + localTime.tm_sec + (now % 1)
+
+        startSecond = startMinute * 60
+        endSecond = endMinute * 60
+
+        if startSecond <= endSecond:
+            inWindow = startSecond <= secondOfDay < endSecond
+        else:
+            inWindow = secondOfDay >= startSecond or secondOfDay < endSecond
+
+        if inWindow:
+            return 0
+
+        return (startSecond - secondOfDay) % 86400
+
+    def shouldRestart(self, program):
+        rssLimit = self.rssLimit
+
+        if rssLimit <= 0 or self.rssTrendHorizon <= 0:
+            # Yes this is checked twice if created through createFromConfig, but it may be called otherwise so better safe.
+            return False
+
+        try:
+            if program.pid != self.pid:
+                # New process, the old samples are meaningless.
+                self.reset()
+                self.pid = program.pid
+
+            now = time.time()
+            rssKB = self.getTotalRSSKB(program.pid)
+            self.addSample(now, rssKB)
+
+            slope = self.getSlope()
+            if slope is None or slope <= 0:
+                return False
+
+            if rssKB >= rssLimit:
+                # Already over, RSSLimitMonitor handles that.
+                return False
+
+            secondsToLimit = (rssLimit - rssKB) / slope
+            if secondsToLimit > self.rssTrendHorizon:
+                return False
+
+            description = 'RSS size %dkB is growing at %.1fkB/min, and is projected to exceed limit of %dkB in %d seconds' %(rssKB, slope * 60.0, rssLimit, int(secondsToLimit))
+
+            if self.rssTrendAction == 'alert':
+                if self.alertedPid != program.pid:
+                    self.alertedPid = program.pid
+                    self.setAlert('%s: %s' %(self.programName, description))
+                return False
+
+            if self.rssTrendRestartWindow:
+                secondsUntilWindow = self.getSecondsUntilWindow(self.rssTrendRestartWindow, now)
+                if secondsUntilWindow > 0 and secondsToLimit > secondsUntilWindow:
+                    # Wait for the window, but say so once.
+                    if self.alertedPid != program.pid:
+                        self.alertedPid = program.pid
+                        self.setAlert('%s: %s. Will restart in the restart window, in %d seconds.' %(self.programName, description, int(secondsUntilWindow)))
+                    return False
+
+            self.setReason('Restarting %s because %s' %(self.programName, description))
+            return True
+        except Exception as e:
+            # If we got an exception, just log and try again next round.
+            logErr('Got an exception in RSS trend monitoring. Not restarting program. Program="%s"\n%s\nError: %s\n' %(self.programName, str(program), str(e)))
+
+        return False
+
+
+# vim:set ts=4 shiftwidth=4 softtabstop=4 expandtab :
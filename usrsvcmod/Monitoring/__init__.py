@@ -28,15 +28,16 @@ from ..util import camelToWords
 
 __all__ = ('MonitoringBase', 'MonitoringList')
 
-# TODO: Some monitoring will need to run as a separate thread and this base class should provide the means to launch and then later join and assert.
 class MonitoringBase(object):
     '''
-        MonitoringBase - A base class for monitoring. Right now mostly just a placeholder,
-            but will be used when more advanced monitors are created.
+        MonitoringBase - A base class for monitoring. Subclasses implement #createFromConfig# and #shouldRestart#
+            (or #getBatchThreshold#). Checks are run on the threads of a MonitorPool (see Monitoring.Pool), so a monitor need not manage threads itself.
     '''
 
     def __init__(self):
         self.reason = ''
+        # An alert raised by the last check (without a restart), see #setAlert#
+        self.alert = None
 
 
     @classmethod
@@ -60,6 +61,26 @@ class MonitoringBase(object):
         '''
         return False
 
+    def getBatchThreshold(self):
+        '''
+            getBatchThreshold - Monitors which only compare a single metric of the program's process against a limit may return it here,
+              and are then checked for all programs at once by a ThresholdBatch (see Monitoring.Batch), rather than through #shouldRestart#.
+
+            @return <None/tuple> - None to always use #shouldRestart#, otherwise (metric <str> - one of Batch.BATCH_METRICS, limit <float>)
+        '''
+        return None
+
+    def shouldRestartFromBatch(self, program, value):
+        '''
+            shouldRestartFromBatch - Called by ThresholdBatch when the program's metric (see #getBatchThreshold#) has exceeded the limit. Sets the reason.
+
+            @param program <usrsvcmod.Program> - The Program instance representing the running program being monitored
+            @param value <float> - The value of the metric
+
+            @return <bool> - True if we should trigger a restart.
+        '''
+        raise NotImplementedError('Monitor %s does not implement shouldRestartFromBatch.' %(str(self.__class__.__name__), ))
+
     def setReason(self, reason, logReason=True):
         self.reason = reason
         if logReason is True:
@@ -70,6 +91,39 @@ class MonitoringBase(object):
     def getReason(self):
         return getattr(self, 'reason', '')
 
+    def setAlert(self, alert, logAlert=True):
+        '''
+            setAlert - Raise an alert from #shouldRestart#, for something which should be reported but does not (yet) warrant a restart.
+                It is logged, and emailed when email_alerts is set on the program.
+
+            @param alert <str> - Description of the alert
+            @param logAlert <bool> - If True, also log it now
+        '''
+        self.alert = alert
+        if logAlert is True:
+            if alert[-1] != '\n':
+                alert += '\n'
+            logMsg('MONITOR ( %s ): ALERT: %s' %(self.name, alert, ))
+
+    def popAlert(self):
+        '''
+            popAlert - Get and clear the alert raised by the last check, if any.
+
+            @return <str/None> - The alert
+        '''
+        alert = getattr(self, 'alert', None)
+        self.alert = None
+        return alert
+
+    def reset(self):
+        '''
+            reset - Forget any state kept about the running process (like previous samples). Called after the program is restarted.
+
+                Monitors are kept for as long as the program's monitoring config is unchanged, so this is where per-process state is dropped.
+        '''
+        self.reason = ''
+        self.alert = None
+
     @classproperty
     def name(cls):
         return camelToWords(cls.__name__)
@@ -80,6 +134,13 @@ class MonitoringList(list):
         MonitoringList - A list of monitors. Has functions to simplify common usage
     '''
 
+    def reset(self):
+        '''
+            reset - Call #reset# on every monitor in the list
+        '''
+        for mon in self:
+            mon.reset()
+
     def executeList(self, program):
         '''
             executeList - Runs the monitors in order until all have been completed or one fails.
@@ -91,6 +152,7 @@ class MonitoringList(list):
                 'triggeredAlert' : <None/object> - The object of the monitor that triggered
                 'runtime' : <float> - The time it took to run the monitors
                 'numRan'  : <int> - The number of monitors that ran
+                'alerts'  : list<tuple> - (monitor, alert <str>) for any monitors which raised an alert (see MonitoringBase.setAlert)
             }
         '''
         ret = {
@@ -98,7 +160,8 @@ class MonitoringList(list):
             'triggeredAlert' : None,
             'reason' : '',
             'runtime' : time.time(),
-            'numRan' : 0
+            'numRan' : 0,
+            'alerts' : [],
         }
 
         shouldRestart = False
@@ -106,6 +169,9 @@ class MonitoringList(list):
             ret['numRan'] += 1
             try:
                 shouldRestart = mon.shouldRestart(program)
+                alert = mon.popAlert()
+                if alert:
+                    ret['alerts'].append( (mon, alert) )
                 if shouldRestart is True:
                     break
             except Exception as e: 
@@ -18,7 +18,7 @@
 
 # vim:set ts=4 shiftwidth=4 softtabstop=4 expandtab :
 
-from .configcommon import getConfigValueBool, getConfigValueInt, getConfigValueFloat
+from .configcommon import getConfigValueBool, getConfigValueInt, getConfigValueFloat, getConfigValueTimeWindow
 
 __all__ = ('MonitoringConfig',)
 
@@ -27,21 +27,42 @@ class MonitoringConfig(object):
         MonitoringConfig - The [[Monitor]] subsection of a Program
     '''
 
-    def __init__(self, monitor_after=30,
+    def __init__(self, monitor_after=30, monitor_interval=5,
         activityfile='', activityfile_limit=120,
-        rss_limit=0,
+        rss_limit=0, rss_limit_scope='process', pss_limit=0,
+        rss_trend_horizon=0, rss_trend_window=3600, rss_trend_action='restart', rss_trend_restart_window='',
+        cpu_limit=0, cpu_limit_duration=60, cpu_limit_window=10, cpu_limit_scope='process',
+        fd_limit=0,
         **kwargs):
         '''
             Config values:
 
             monitor_after - Minimum number of seconds that program needs to be running before monitoring will begin. Default 30. 0 disables this feature.
+            monitor_interval - Number of seconds between runs of the monitors. Default 5. May be stretched or shortened by the Program's adaptive_interval.
             activityfile - File or Directory which must be modified every #activityfile_limit# seconds, or program will be restarted. Default undefined/empty string disables this.
             activityfile_limit - Default 120. If activityfile is defined, this is the number of seconds is the maximum that can go between modifications of the provided #activityfile# before triggering a restart.
             rss_limit - Default 0. If > 0, specifies the maximum RSS (Resident Set Size) in kilobytes (1024 bytes)
+            rss_limit_scope - Default "process". "process" checks only the program's process, "tree" the sum over it and all of its descendants.
+            pss_limit - Default 0. If > 0, specifies the maximum PSS (Proportional Set Size) in kilobytes, summed over the program's process and all of its descendants.
+            rss_trend_horizon - Default 0. If > 0 (and rss_limit is set), the RSS trend of the program is tracked, and #rss_trend_action# is taken when, at the current rate of growth,
+                RSS is projected to reach rss_limit within this many seconds.
+            rss_trend_window - Default 3600. Number of seconds of RSS samples the trend is fitted over.
+            rss_trend_action - Default "restart". "restart" to restart the program, or "alert" to only log (and email, with email_alerts) a warning.
+            rss_trend_restart_window - Default empty. A daily window of local time, like "02:00-05:00". If set, trend restarts wait until this window, unless
+                rss_limit is projected to be reached before it opens.
+            cpu_limit - Default 0. If > 0, specifies the maximum CPU usage, in percent of one core (so 200 is two full cores)
+            cpu_limit_duration - Default 60. Number of seconds CPU usage must stay over #cpu_limit# before triggering a restart.
+            cpu_limit_window - Default 10. Number of seconds over which CPU usage is measured.
+            cpu_limit_scope - Default "process". "process" measures only the program's process, "tree" also includes all of its descendants.
+            fd_limit - Default 0. If > 0, specifies the maximum number of open file descriptors of the program's process.
         '''
 
         self.monitor_after = getConfigValueInt(monitor_after, 'monitor_after')
 
+        self.monitor_interval = getConfigValueFloat(monitor_interval, 'monitor_interval')
+        if self.monitor_interval <= 0:
+            raise ValueError('monitor_interval must be a positive number of seconds.')
+
         self.activityfile = activityfile
         if activityfile and activityfile[0] != '/':
             raise ValueError('activityfile must be an absolute path.\n')
@@ -50,6 +71,41 @@ class MonitoringConfig(object):
         self.rss_limit = getConfigValueInt(rss_limit, 'rss_limit')
         if self.rss_limit < 0:
             raise ValueError('rss_limit must be 0 to disable, or a positive integer for maximum kB of Resident Set Size')
+        if rss_limit_scope not in ('process', 'tree'):
+            raise ValueError('rss_limit_scope must be "process" or "tree"')
+        self.rss_limit_scope = rss_limit_scope
+
+        self.rss_trend_horizon = getConfigValueInt(rss_trend_horizon, 'rss_trend_horizon')
+        if self.rss_trend_horizon and not self.rss_limit:
+            raise ValueError('rss_trend_horizon requires rss_limit to be set')
+        self.rss_trend_window = getConfigValueInt(rss_trend_window, 'rss_trend_window')
+        if self.rss_trend_window <= 0:
+            raise ValueError('rss_trend_window must be a positive number of seconds')
+        if rss_trend_action not in ('restart', 'alert'):
+            raise ValueError('rss_trend_action must be "restart" or "alert"')
+        self.rss_trend_action = rss_trend_action
+        self.rss_trend_restart_window = getConfigValueTimeWindow(rss_trend_restart_window, 'rss_trend_restart_window')
+
+        self.pss_limit = getConfigValueInt(pss_limit, 'pss_limit')
+        if self.pss_limit < 0:
+            raise ValueError('pss_limit must be 0 to disable, or a positive integer for maximum kB of Proportional Set Size')
+
+        self.cpu_limit = getConfigValueFloat(cpu_limit, 'cpu_limit')
+        if self.cpu_limit < 0:
+            raise ValueError('cpu_limit must be 0 to disable, or a positive number for maximum percent of one CPU core')
+        self.cpu_limit_duration = getConfigValueFloat(cpu_limit_duration, 'cpu_limit_duration')
+        if self.cpu_limit_duration < 0:
+            raise ValueError('cpu_limit_duration must be a positive number of seconds')
+        self.cpu_limit_window = getConfigValueFloat(cpu_limit_window, 'cpu_limit_window')
+        if self.cpu_limit_window <= 0:
+            raise ValueError('cpu_limit_window must be a positive number of seconds')
+        if cpu_limit_scope not in ('process', 'tree'):
+            raise ValueError('cpu_limit_scope must be "process" or "tree"')
+        self.cpu_limit_scope = cpu_limit_scope
+
+        self.fd_limit = getConfigValueInt(fd_limit, 'fd_limit')
+        if self.fd_limit < 0:
+            raise ValueError('fd_limit must be 0 to disable, or a positive integer for maximum number of open file descriptors')
 
         if kwargs:
             raise ValueError('Unknown configuration options in Monitoring section: %s' %(str(list(kwargs.keys())),))
@@ -57,9 +113,22 @@ class MonitoringConfig(object):
 
     def isMonitoringActive(self):
         # "or" of all the various monitoring types.
-        return bool(self.activityfile) or bool(self.rss_limit)
+        return bool(self.activityfile) or bool(self.rss_limit) or bool(self.pss_limit) or bool(self.cpu_limit) or bool(self.fd_limit)
 
         
+    def __eq__(self, other):
+        # Equal if every option is equal, so monitors need only be rebuilt when monitoring options change.
+        if not isinstance(other, MonitoringConfig):
+            return False
+        return self.__dict__ == other.__dict__
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    def __hash__(self):
+        # Consistent with __eq__. Every option is a str, number, tuple, or None.
+        return hash(tuple(sorted(self.__dict__.items())))
+
     def __str__(self):
         return str(self.__dict__)
 
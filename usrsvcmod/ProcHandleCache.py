@@ -0,0 +1,271 @@
+'''
+    Copyright (c) 2016 Tim Savannah All Rights Reserved.
+    This software is licensed under the terms of the GPLv3.
+    This may change at my discretion, retroactively, and without notice.
+
+    You should have received a copy of this with the source distribution as a file titled, LICENSE.
+
+    The most current license can be found at:
+    https://github.com/kata198/usrsvc/LICENSE
+
+    This location may need to be changed at some point in the future, in which case
+    you are may email Tim Savannah <kata198 at gmail dot com>, or find them on the
+    current website intended for distribution of usrsvc.
+
+
+
+    ProcHandleCache - Keeps /proc/$PID/ files (stat, statm, io) of tracked processes open, and rereads them with pread,
+      rather than an open/read/close on every check.
+'''
+
+# vim:set ts=4 shiftwidth=4 softtabstop=4 expandtab :
+
+import errno
+import os
+import threading
+import time
+
+from collections import OrderedDict
+
+__all__ = ('ProcHandleCache', 'getProcHandleCache', 'readProcFile')
+
+# Max number of open handles, by default. Also limited to a quarter of RLIMIT_NOFILE.
+DEFAULT_MAX_HANDLES = 512
+
+# Handles not read in this many seconds are closed
+DEFAULT_MAX_IDLE = 300
+
+# Size of each read. Files larger than this are read in multiple chunks.
+READ_SIZE = 4096
+
+_HAS_PREAD = hasattr(os, 'pread')
+
+_O_CLOEXEC = getattr(os, 'O_CLOEXEC', 0)
+
+
+class _ProcHandle(object):
+
+    __slots__ = ('fd', 'users', 'evicted', 'lastUsed')
+
+    def __init__(self, fd):
+        self.fd = fd
+        # Number of threads currently reading from fd. It is only closed once this is 0.
+        self.users = 0
+        self.evicted = False
+        self.lastUsed = time.time()
+
+
+class ProcHandleCache(object):
+    '''
+        ProcHandleCache - Cache of open file descriptors on /proc/$PID/ files.
+
+            A descriptor on a /proc/$PID/ file refers to that exact process, so once it has exited (and been reaped)
+              a read fails with ESRCH, even if the pid has since been reused. When that happens the handle is evicted and the
+              file is opened again, so reads always reflect whatever process currently has the pid (as open/read/close would).
+
+            Handles are kept in LRU order up to #maxHandles#, and handles not read for #maxIdle# seconds are closed.
+              Safe to use from multiple threads.
+    '''
+
+    def __init__(self, maxHandles=None, maxIdle=DEFAULT_MAX_IDLE):
+        '''
+            @param maxHandles <int/None> - Max number of open handles, or None for the default (DEFAULT_MAX_HANDLES, or a quarter of RLIMIT_NOFILE if lower)
+            @param maxIdle <float> - Seconds a handle may go unread before it is closed
+        '''
+        if maxHandles is None:
+            maxHandles = DEFAULT_MAX_HANDLES
+            try:
+                import resource
+                softLimit = resource.getrlimit(resource.RLIMIT_NOFILE)[0]
+                if softLimit > 0:
+                    maxHandles = min(maxHandles, softLimit // 4)
+            except:
+                pass
+        self.maxHandles = max(int(maxHandles), 0)
+        self.maxIdle = maxIdle
+
+        self.lock = threading.Lock()
+        # (pid, name) -> _ProcHandle, least recently used first
+        self.handles = OrderedDict()
+        self.lastPrune = time.time()
+
+    def __len__(self):
+        return len(self.handles)
+
+    def _acquire(self, key):
+        # Get the open handle for key (opening it if needed), and mark it in use.
+        with self.lock:
+            handle = self.handles.pop(key, None)
+            if handle is not None:
+                self.handles[key] = handle
+                handle.users += 1
+                return handle
+
+        fd = os.open('/proc/%d/%s' %key, os.O_RDONLY | _O_CLOEXEC)
+        handle = _ProcHandle(fd)
+        handle.users = 1
+
+        with self.lock:
+            existing = self.handles.pop(key, None)
+            if existing is not None:
+                # Another thread opened it at the same time. Keep theirs.
+                self.handles[key] = existing
+                existing.users += 1
+                os.close(fd)
+                return existing
+
+            self.handles[key] = handle
+            while len(self.handles) > self.maxHandles:
+                (_oldKey, oldHandle) = self.handles.popitem(last=False)
+                self._evictLocked(oldHandle)
+
+        return handle
+
+    def _release(self, handle):
+        with self.lock:
+            handle.users -= 1
+            handle.lastUsed = time.time()
+            if handle.evicted is True and handle.users == 0:
+                os.close(handle.fd)
+
+    def _evictLocked(self, handle):
+        # Must hold self.lock. The fd is closed now if idle, otherwise by the last user.
+        handle.evicted = True
+        if handle.users == 0:
+            os.close(handle.fd)
+
+    def _evict(self, key, handle):
+        with self.lock:
+            if self.handles.get(key, None) is handle:
+                del self.handles[key]
+                self._evictLocked(handle)
+
+    @staticmethod
+    def _readAll(fd):
+        chunks = []
+        offset = 0
+        while True:
+            chunk = os.pread(fd, READ_SIZE, offset)
+            chunks.append(chunk)
+            if len(chunk) < READ_SIZE:
+                break
+            offset += len(chunk)
+        return b''.join(chunks)
+
+    def read(self, pid, name):
+        '''
+            read - Read the contents of /proc/$PID/$NAME
+
+            @param pid <int> - Process ID
+            @param name <str> - File name, like "stat", "statm", or "io"
+
+            @return <str> - File contents
+
+            @raises - IOError/OSError if process is not running (or the file cannot be read)
+        '''
+        pid = int(pid)
+
+        if not _HAS_PREAD or self.maxHandles == 0:
+            with open('/proc/%d/%s' %(pid, name), 'rt') as f:
+                return f.read()
+
+        self._maybePrune()
+
+        key = (pid, name)
+        for attempt in (1, 2):
+            handle = self._acquire(key)
+            try:
+                contents = self._readAll(handle.fd)
+            except OSError as e:
+                self._release(handle)
+                self._evict(key, handle)
+                if e.errno == errno.ESRCH and attempt == 1:
+                    # The process we had open is gone. Try again with whatever has the pid now.
+                    continue
+                raise
+            self._release(handle)
+            return contents.decode('utf-8', 'replace')
+
+    def forget(self, pid):
+        '''
+            forget - Close every handle of a process
+
+            @param pid <int> - Process ID
+        '''
+        with self.lock:
+            for key in [key for key in self.handles if key[0] == pid]:
+                self._evictLocked(self.handles.pop(key))
+
+    def prune(self, maxIdle=None):
+        '''
+            prune - Close handles which have not been read recently
+
+            @param maxIdle <float/None> - Seconds, or None for #maxIdle#
+        '''
+        if maxIdle is None:
+            maxIdle = self.maxIdle
+
+        with self.lock:
+            now = time.time()
+            self.lastPrune = now
+            cutoff = now - maxIdle
+            for key in [key for (key, handle) in self.handles.items() if handle.users == 0 and handle.lastUsed < cutoff]:
+                self._evictLocked(self.handles.pop(key))
+
+    def _maybePrune(self):
+        if time.time() - self.lastPrune >= self.maxIdle:
+            self.prune()
+
+    def clear(self):
+        '''
+            clear - Close all handles
+        '''
+        with self.lock:
+            for handle in self.handles.values():
+                self._evictLocked(handle)
+            self.handles.clear()
+
+
+global _PROC_HANDLE_CACHE
+_PROC_HANDLE_CACHE = None
+_PROC_HANDLE_CACHE_LOCK = threading.Lock()
+
+def _resetLocksInChild():
+    # A fork (like of a launcher worker) may happen while another thread holds a lock, and that thread does not exist in the child
+    global _PROC_HANDLE_CACHE_LOCK
+    _PROC_HANDLE_CACHE_LOCK = threading.Lock()
+    if _PROC_HANDLE_CACHE is not None:
+        _PROC_HANDLE_CACHE.lock = threading.Lock()
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_resetLocksInChild)
+
+def getProcHandleCache():
+    '''
+        getProcHandleCache - Get the ProcHandleCache shared by this process (created on first call)
+
+        @return <ProcHandleCache>
+    '''
+    global _PROC_HANDLE_CACHE
+    if _PROC_HANDLE_CACHE is None:
+        with _PROC_HANDLE_CACHE_LOCK:
+            if _PROC_HANDLE_CACHE is None:
+                _PROC_HANDLE_CACHE = ProcHandleCache()
+    return _PROC_HANDLE_CACHE
+
+
+def readProcFile(pid, name):
+    '''
+        readProcFile - Read /proc/$PID/$NAME through the shared ProcHandleCache
+
+        @param pid <int> - Process ID
+        @param name <str> - File name, like "stat", "statm", or "io"
+
+        @return <str> - File contents
+
+        @raises - IOError/OSError if process is not running
+    '''
+    return getProcHandleCache().read(pid, name)
+
+
+# vim:set ts=4 shiftwidth=4 softtabstop=4 expandtab :
@@ -0,0 +1,446 @@
+'''
+    Copyright (c) 2016 Tim Savannah All Rights Reserved.
+    This software is licensed under the terms of the GPLv3.
+    This may change at my discretion, retroactively, and without notice.
+
+    You should have received a copy of this with the source distribution as a file titled, LICENSE.
+
+    The most current license can be found at:
+    https://github.com/kata198/usrsvc/LICENSE
+
+    This location may need to be changed at some point in the future, in which case
+    you are may email Tim Savannah <kata198 at gmail dot com>, or find them on the
+    current website intended for distribution of usrsvc.
+
+
+    'ProcessTable' is a point-in-time snapshot of the processes running as the current user.
+'''
+
+# vim:set ts=4 shiftwidth=4 softtabstop=4 expandtab :
+
+import os
+import time
+
+from .ProcHandleCache import readProcFile
+
+__all__ = ('ProcessTable', 'ProcessInfo', 'parseProcStat', 'readProcStat', 'isProcessRunning', 'readProcCmdline', 'hasKernelChildren', 'getKernelChildPids',
+    'getBootTime', 'startTimeToEpoch', 'parseProcStatCpuTicks', 'readProcCpuTicks', 'readProcPssKB', 'CLOCK_TICKS',
+)
+
+try:
+    CLOCK_TICKS = os.sysconf('SC_CLK_TCK')
+except:
+    CLOCK_TICKS = 100
+
+
+def parseProcStat(contents):
+    '''
+        parseProcStat - Parse the contents of a /proc/$PID/stat file.
+
+            The "comm" field (2) may itself contain spaces and parenthesis, so we split on the LAST ")" rather than use a regex.
+
+        @param contents <str> - Contents of the stat file
+
+        @return <tuple> - (pid <int>, state <str>, ppid <int>, starttime <int>)
+
+        @raises ValueError if the contents cannot be parsed
+    '''
+    try:
+        commStart = contents.index(' (')
+        commEnd = contents.rindex(')')
+        # Fields after comm start at field 3 (state). starttime is field 22.
+        fields = contents[commEnd+2:].split(' ')
+        return ( int(contents[:commStart]), fields[0], int(fields[1]), int(fields[19]) )
+    except (IndexError, ValueError):
+        raise ValueError('Could not parse stat contents: %s' %(repr(contents[:128]), ))
+
+
+def readProcStat(pid):
+    '''
+        readProcStat - Read and parse /proc/$PID/stat for a single process
+
+        @param pid <int> - Process ID
+
+        @return <tuple> - (pid <int>, state <str>, ppid <int>, starttime <int>), see parseProcStat
+
+        @raises - IOError/OSError if process is not running, ValueError if cannot be parsed.
+    '''
+    with open('/proc/%d/stat' %(pid,), 'rt') as f:
+        contents = f.read()
+
+    return parseProcStat(contents)
+
+
+def isProcessRunning(pid):
+    '''
+        isProcessRunning - Check if a process is running. A zombie (exited, but not yet reaped by its parent) is not.
+
+            The parent may not reap it for a while, like a launcher worker busy with another action on the same program.
+
+        @param pid <int> - Process ID
+
+        @return <bool> - True if running
+    '''
+    try:
+        state = readProcStat(pid)[1]
+    except (IOError, OSError):
+        return False
+    except ValueError:
+        return os.path.exists('/proc/%d' %(pid, ))
+
+    return state not in ('Z', 'X')
+
+
+def parseProcStatCpuTicks(contents, includeChildren=False):
+    '''
+        parseProcStatCpuTicks - Parse the CPU time used by a process from the contents of a /proc/$PID/stat file.
+
+        @param contents <str> - Contents of the stat file
+        @param includeChildren <bool> - If True, also include the time of children which have exited and been waited for (cutime + cstime)
+
+        @return <int> - utime + stime (+ cutime + cstime), in clock ticks (see CLOCK_TICKS)
+
+        @raises ValueError if the contents cannot be parsed
+    '''
+    try:
+        # utime, stime, cutime, cstime are fields 14-17
+        fields = contents[contents.rindex(')')+2:].split(' ')
+        ticks = int(fields[11]) + int(fields[12])
+        if includeChildren:
+            ticks += int(fields[13]) + int(fields[14])
+        return ticks
+    except (IndexError, ValueError):
+        raise ValueError('Could not parse stat contents: %s' %(repr(contents[:128]), ))
+
+
+def readProcCpuTicks(pid, includeChildren=False):
+    '''
+        readProcCpuTicks - Read the CPU time used by a process, see parseProcStatCpuTicks
+
+            The stat file is kept open between calls (see ProcHandleCache), as this is called on every monitoring pass.
+
+        @param pid <int> - Process ID
+        @param includeChildren <bool> - If True, also include the time of children which have exited and been waited for
+
+        @return <int> - Clock ticks
+
+        @raises - IOError/OSError if process is not running, ValueError if cannot be parsed.
+    '''
+    return parseProcStatCpuTicks(readProcFile(pid, 'stat'), includeChildren)
+
+
+global _HAS_SMAPS_ROLLUP
+_HAS_SMAPS_ROLLUP = None
+
+def readProcPssKB(pid):
+    '''
+        readProcPssKB - Read the Proportional Set Size of a process: its private memory, plus its share of memory shared with other processes.
+
+            Unlike RSS, the PSS of several processes can be summed without counting shared pages more than once.
+
+            Uses /proc/$PID/smaps_rollup (Linux 4.14+), otherwise sums every mapping in /proc/$PID/smaps (much slower).
+
+        @param pid <int> - Process ID
+
+        @return <int> - PSS in kB
+
+        @raises - IOError/OSError if process is not running (or not readable).
+    '''
+    global _HAS_SMAPS_ROLLUP
+    if _HAS_SMAPS_ROLLUP is None:
+        _HAS_SMAPS_ROLLUP = os.path.exists('/proc/self/smaps_rollup')
+
+    if _HAS_SMAPS_ROLLUP:
+        path = '/proc/%d/smaps_rollup' %(pid,)
+    else:
+        path = '/proc/%d/smaps' %(pid,)
+
+    pssKB = 0
+    with open(path, 'rt') as f:
+        for line in f:
+            # Also skip Pss_Anon, Pss_File, etc. of newer kernels
+            if line.startswith('Pss:'):
+                pssKB += int(line.split()[1])
+
+    return pssKB
+
+
+global _BOOT_TIME
+_BOOT_TIME = None
+
+def getBootTime():
+    '''
+        getBootTime - Get the time the system booted, as an epoch timestamp ("btime" from /proc/stat). Cached after first call.
+
+        @return <int>
+    '''
+    global _BOOT_TIME
+    if _BOOT_TIME is None:
+        with open('/proc/stat', 'rt') as f:
+            for line in f:
+                if line.startswith('btime '):
+                    _BOOT_TIME = int(line.split()[1])
+                    break
+            else:
+                raise ValueError('Cannot find btime in /proc/stat')
+
+    return _BOOT_TIME
+
+def startTimeToEpoch(starttime):
+    '''
+        startTimeToEpoch - Convert a process starttime (field 22 of /proc/$PID/stat, clock ticks after boot) into an epoch timestamp.
+
+        @param starttime <int> - starttime
+
+        @return <float> - epoch timestamp the process was started
+    '''
+    return getBootTime() + (float(starttime) / CLOCK_TICKS)
+
+
+def readProcCmdline(pid):
+    '''
+        readProcCmdline - Gets the /proc/$pid/cmdline , split into string, executable, and args, for a given pid.
+
+        @return - dict {
+            cmdline - string of commandline
+            executable - string of executable
+            args - list of arguments
+            }
+
+        @raises - KeyError if process has an empty cmdline (kernel thread or zombie), or IOError/OSError if it cannot be read.
+    '''
+    with open('/proc/%d/cmdline' %(pid,), 'rb') as f:
+        cmdlineContents = f.read()
+
+    if not cmdlineContents:
+        raise KeyError('Process pid=%d has empty cmdline' %(pid,))
+
+    # Split by null, and strip the trailing null
+    cmdlineSplit = cmdlineContents.split(b'\x00')[:-1]
+    executable = cmdlineSplit[0].decode('utf-8')
+    args = [x.decode('utf-8') for x in cmdlineSplit[1:]]
+
+    cmdline = ' '.join([executable] + args)
+
+    return {
+        'cmdline' : cmdline,
+        'executable' : executable,
+        'args' : args
+    }
+
+
+global _HAS_KERNEL_CHILDREN
+_HAS_KERNEL_CHILDREN = None
+
+def hasKernelChildren():
+    '''
+        hasKernelChildren - Check if this kernel provides /proc/$PID/task/$TID/children (CONFIG_PROC_CHILDREN)
+
+        @return <bool> - True if supported. Result is cached after first call.
+    '''
+    global _HAS_KERNEL_CHILDREN
+    if _HAS_KERNEL_CHILDREN is None:
+        myPid = os.getpid()
+        _HAS_KERNEL_CHILDREN = os.path.exists('/proc/%d/task/%d/children' %(myPid, myPid))
+
+    return _HAS_KERNEL_CHILDREN
+
+
+def getKernelChildPids(pid):
+    '''
+        getKernelChildPids - Get the children of a process as reported by the kernel, by reading
+            /proc/$PID/task/$TID/children for every thread of the process.
+
+            Only call this if hasKernelChildren() is True.
+
+        @param pid <int> - Process ID
+
+        @return list<int> - Child pids. Empty list if process has no children or is not running.
+    '''
+    taskDir = '/proc/%d/task' %(pid,)
+    try:
+        tids = os.listdir(taskDir)
+    except:
+        return []
+
+    childPids = []
+    for tid in tids:
+        try:
+            with open(taskDir + '/' + tid + '/children', 'rt') as f:
+                contents = f.read()
+        except:
+            # Thread exited
+            continue
+        childPids += [int(x) for x in contents.split()]
+
+    return childPids
+
+
+class ProcessInfo(object):
+    '''
+        ProcessInfo - The information on a single process held within a ProcessTable
+    '''
+
+    def __init__(self, pid, uid, ppid, state, starttime):
+        '''
+            @param pid <int> - Process ID
+            @param uid <int> - Owning uid
+            @param ppid <int> - Parent process ID
+            @param state <str> - State code (R, S, D, Z, etc)
+            @param starttime <int> - Field 22 of /proc/$PID/stat, clock ticks after boot the process started
+        '''
+        self.pid = pid
+        self.uid = uid
+        self.ppid = ppid
+        self.state = state
+        self.starttime = starttime
+
+        # Read on first request, then cached for the lifetime of the table.
+        self.cmdline = None
+
+    def __str__(self):
+        return str(self.__dict__)
+
+
+class ProcessTable(object):
+    '''
+        ProcessTable - A snapshot of all processes running as a given user.
+
+            /proc is listed, and each owned process' stat is read, exactly once when the table is created (or refreshed).
+            Cmdlines are read the first time they are requested, and then cached.
+
+            A parent -> children index is built at the same time, so children/descendant queries are O(subtree).
+
+            Build one of these per "tick" and pass it to everything that needs to look at running processes, so that
+              the cost of a tick is O(processes) instead of O(programs * processes).
+    '''
+
+    def __init__(self, uid=None):
+        '''
+            Create an empty ProcessTable. Use ProcessTable.createSnapshot to create a populated table.
+
+            @param uid <int/None> - The uid whose processes we gather. None for the current user.
+        '''
+        if uid is None:
+            uid = os.getuid()
+
+        self.uid = uid
+        self.processes = {}
+        self.childrenMap = {}
+        self.createdAt = None
+
+    @classmethod
+    def createSnapshot(cls, uid=None):
+        '''
+            createSnapshot - Create a ProcessTable populated with the currently running processes.
+
+            @param uid <int/None> - The uid whose processes we gather. None for the current user.
+
+            @return <ProcessTable>
+        '''
+        processTable = cls(uid)
+        processTable.refresh()
+        return processTable
+
+    def refresh(self):
+        '''
+            refresh - Rescan /proc, replacing the contents of this table.
+        '''
+        uid = self.uid
+        processes = {}
+        childrenMap = {}
+
+        # Do in a loop incase processes are created/destroyed between getting the list and checking it
+        for procItem in os.listdir('/proc'):
+            if not procItem.isdigit():
+                continue
+            procDir = '/proc/' + procItem
+            try:
+                procUid = os.stat(procDir).st_uid
+                if procUid != uid:
+                    continue
+                (pid, state, ppid, starttime) = readProcStat(int(procItem))
+            except:
+                continue
+
+            processes[pid] = ProcessInfo(pid, procUid, ppid, state, starttime)
+            if ppid in childrenMap:
+                childrenMap[ppid].append(pid)
+            else:
+                childrenMap[ppid] = [pid]
+
+        self.processes = processes
+        self.childrenMap = childrenMap
+        self.createdAt = time.time()
+
+    def getPids(self):
+        '''
+            getPids - Get all pids within this table
+
+            @return list<int> - List of pids
+        '''
+        return list(self.processes.keys())
+
+    def getProcessInfo(self, pid):
+        '''
+            getProcessInfo - Get the ProcessInfo for a given pid
+
+            @param pid <int> - Process ID
+
+            @return <ProcessInfo/None> - The info, or None if pid was not running (as our user) when this snapshot was taken.
+        '''
+        return self.processes.get(pid, None)
+
+    def getChildPids(self, pid):
+        '''
+            getChildPids - Get pids of children of a given process, from this snapshot.
+
+            @param pid <int> - A process pid
+
+            @return list<int> - List of children pids
+        '''
+        return self.childrenMap.get(pid, [])[:]
+
+    def getAllChildPidsInTree(self, rootPid):
+        '''
+            getAllChildPidsInTree - Get pids of children of given process, and their children, and their children... from this snapshot.
+
+            @param rootPid <int> - A process pid
+
+            @return list<int> - Flat list of all child pids and their children, breadth-first.
+        '''
+        childrenMap = self.childrenMap
+
+        childPids = childrenMap.get(rootPid, [])[:]
+        i = 0
+        # childPids grows as we go, so walk by index.
+        while i < len(childPids):
+            childPids += childrenMap.get(childPids[i], [])
+            i += 1
+
+        return childPids
+
+    def getCmdline(self, pid):
+        '''
+            getCmdline - Get the cmdline of a process within this table. Read on first call, and cached after.
+
+            @param pid <int> - Process ID
+
+            @return - dict, same as Program._getProcCmdline
+
+            @raises - KeyError if pid is not in this table or has no cmdline, or IOError/OSError if it stopped running since the snapshot.
+        '''
+        processInfo = self.processes[pid]
+        if processInfo.cmdline is None:
+            processInfo.cmdline = readProcCmdline(pid)
+
+        return processInfo.cmdline
+
+    def __contains__(self, pid):
+        return pid in self.processes
+
+    def __len__(self):
+        return len(self.processes)
+
+
+# vim:set ts=4 shiftwidth=4 softtabstop=4 expandtab :
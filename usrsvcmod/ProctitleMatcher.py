@@ -0,0 +1,127 @@
+'''
+    Copyright (c) 2016 Tim Savannah All Rights Reserved.
+    This software is licensed under the terms of the GPLv3.
+    This may change at my discretion, retroactively, and without notice.
+
+    You should have received a copy of this with the source distribution as a file titled, LICENSE.
+
+    The most current license can be found at:
+    https://github.com/kata198/usrsvc/LICENSE
+
+    This location may need to be changed at some point in the future, in which case
+    you are may email Tim Savannah <kata198 at gmail dot com>, or find them on the
+    current website intended for distribution of usrsvc.
+
+
+    ProctitleMatcher - Match the proctitles of many programs against running processes in a single pass
+'''
+
+# vim:set ts=4 shiftwidth=4 softtabstop=4 expandtab :
+
+__all__ = ('ProctitleMatcher', )
+
+
+class ProctitleMatcher(object):
+    '''
+        ProctitleMatcher - Combined matcher of every program's proctitle_re, built at config load.
+
+            Programs using the default proctitle_re ( "(<escaped command>)$" ) are matched by a plain string suffix
+              check. Suffixes are grouped by length, so each process costs one dict lookup per distinct suffix length,
+              regardless of how many programs there are. Programs with a custom proctitle_re are tested by regex.
+    '''
+
+    def __init__(self, programConfigs):
+        '''
+            @param programConfigs dict<str, ProgramConfig> - All program configs, name -> ProgramConfig
+        '''
+        # length -> { suffix -> [ programName, ... ] }
+        self.suffixesByLength = {}
+        # list of (programName, compiled regex)
+        self.regexPrograms = []
+
+        # Programs with useshell=True must not match the wrapping shell
+        self.skipShellPrograms = set()
+
+        for programName, programConfig in programConfigs.items():
+            if programConfig.useshell is True:
+                self.skipShellPrograms.add(programName)
+
+            suffix = getattr(programConfig, 'proctitle_suffix', None)
+            if suffix:
+                suffixLen = len(suffix)
+                if suffixLen not in self.suffixesByLength:
+                    self.suffixesByLength[suffixLen] = {}
+                bySuffix = self.suffixesByLength[suffixLen]
+                if suffix not in bySuffix:
+                    bySuffix[suffix] = [programName]
+                else:
+                    bySuffix[suffix].append(programName)
+            elif programConfig.proctitle_re is not None:
+                self.regexPrograms.append( (programName, programConfig.proctitle_re) )
+
+        # Sort longest first, purely so the common case of many equal lengths groups together
+        self.suffixLengths = sorted(self.suffixesByLength.keys(), reverse=True)
+
+    def matchCmdline(self, cmdline, programNames=None):
+        '''
+            matchCmdline - Get all programs whose proctitle matches a given cmdline
+
+            @param cmdline <str> - The cmdline of a process
+            @param programNames <set/None> - If provided, only return programs within this set.
+
+            @return list<str> - Names of matching programs
+        '''
+        isShell = cmdline.startswith('/bin/sh -c')
+        cmdlineLen = len(cmdline)
+
+        matched = []
+        for suffixLen in self.suffixLengths:
+            if suffixLen > cmdlineLen:
+                continue
+            names = self.suffixesByLength[suffixLen].get(cmdline[-suffixLen:], None)
+            if names:
+                matched += names
+
+        for (programName, proctitleRE) in self.regexPrograms:
+            if programNames is not None and programName not in programNames:
+                continue
+            if proctitleRE.search(cmdline):
+                matched.append(programName)
+
+        if programNames is not None or isShell:
+            matched = [name for name in matched if (programNames is None or name in programNames) and not (isShell and name in self.skipShellPrograms)]
+
+        return matched
+
+    def matchProcesses(self, processTable, programNames):
+        '''
+            matchProcesses - Sweep the process table once, and find the first matching process for every requested program.
+
+            @param processTable <ProcessTable> - Snapshot of running processes
+            @param programNames <list/set> - Names of programs to find
+
+            @return dict<str, int> - programName -> matching pid, for every program that found a match.
+        '''
+        remaining = set(programNames)
+        found = {}
+        if not remaining:
+            return found
+
+        for pid in processTable.getPids():
+            try:
+                cmdline = processTable.getCmdline(pid)['cmdline']
+            except:
+                # Process stopped running, or a kernel thread/zombie
+                continue
+
+            for programName in self.matchCmdline(cmdline, remaining):
+                found[programName] = pid
+                remaining.discard(programName)
+
+            if not remaining:
+                break
+
+        return found
+
+
+# vim:set ts=4 shiftwidth=4 softtabstop=4 expandtab :
@@ -28,6 +28,9 @@ import traceback
 
 from .constants import ReturnCodes
 from .logging import logMsg, logErr
+from .LogPump import startLogPump
+from .ProcHandleCache import readProcFile
+from .ProcessTable import ProcessTable, readProcCmdline, readProcStat, isProcessRunning, hasKernelChildren, getKernelChildPids, startTimeToEpoch
 from .util import  waitUpTo
 from usrsvcmod.debug import isDebugEnabled
 
@@ -41,7 +44,7 @@ class Program(object):
     '''
 
 
-    def __init__(self, pidfile=None, pid=None, cmdline=None, executable=None, args=None, running=False):
+    def __init__(self, pidfile=None, pid=None, cmdline=None, executable=None, args=None, running=False, starttime=None):
         '''
             Create a program.
 
@@ -51,6 +54,7 @@ class Program(object):
             @param executable - <str/None> - executable or None
             @param args - <list/None> - List of args, or None.
             @param running - <bool> - True/False.
+            @param starttime - <int/None> - Kernel starttime of the process (field 22 of /proc/$PID/stat). Together with pid, this identifies a process even across pid reuse.
 
             Should not be created direcly, use one of the static methods to create this.
         '''
@@ -60,6 +64,7 @@ class Program(object):
         self.executable = executable or None
         self.args = args or []
         self.running = running
+        self.starttime = starttime
 
         
     @staticmethod
@@ -74,25 +79,7 @@ class Program(object):
                 }
 
         '''
-        cmdlineContents = b''
-        with open('/proc/%d/cmdline' %(pid,), 'rb') as f:
-            cmdlineContents = f.read()
-
-        if not cmdlineContents:
-            raise KeyError('Process pid=%d has empty cmdline' %(pid,))
-        
-        # Split by null, and strip the trailing null
-        cmdlineSplit = cmdlineContents.split(b'\x00')[:-1]
-        executable = cmdlineSplit[0].decode('utf-8')
-        args = [x.decode('utf-8') for x in cmdlineSplit[1:]]
-
-        cmdline = ' '.join([executable] + args)
-
-        return {
-            'cmdline' : cmdline,
-            'executable' : executable,
-            'args' : args
-        }
+        return readProcCmdline(pid)
 
     def setCmdlineFromProc(self, forcePid=None):
         '''
@@ -144,8 +131,7 @@ class Program(object):
         '''
         statFilename = '/proc/%d/stat' %(int(pid),)
         try:
-            with open(statFilename, 'rt') as f:
-                contents = f.read()
+            contents = readProcFile(pid, 'stat')
         except Exception as e:
             raise KeyError('Cannot read stat file "%s" : %s' %(statFilename, str(e)))
 
@@ -159,7 +145,7 @@ class Program(object):
         return groupDict
 
     @classmethod
-    def getChildPids(cls, pid):
+    def getChildPids(cls, pid, processTable=None):
         '''
             getChildPids - Get pids of children of a given process.
 
@@ -167,47 +153,48 @@ class Program(object):
 
             @param pid <int> - A process pid
 
+            @param processTable <ProcessTable/None> - If provided, children are taken from this snapshot.
+                If None, the kernel's children list is used when available, otherwise a new snapshot is taken.
+
             @return list<int> - List of children pids
         '''
-        myPids = cls.getMyRunningPids()
         pid = int(pid)
 
-        childPids = []
-
-        for myPid in myPids:
-            try:
-                statInfo = cls.getStatInfo(myPid)
-            except:
-                continue
-            if pid == statInfo['ppid']:
-                childPids.append(myPid)
+        if processTable is None:
+            if hasKernelChildren():
+                return getKernelChildPids(pid)
+            processTable = ProcessTable.createSnapshot()
 
-        return childPids
+        return processTable.getChildPids(pid)
 
     @classmethod
-    def getAllChildPidsInTree(cls, rootPid):
+    def getAllChildPidsInTree(cls, rootPid, processTable=None):
         '''
             getAllChildPidsInTree - Get pids of children of given process, and their children, and their children...
 
             @param rootPid <int> - A process pid
 
+            @param processTable <ProcessTable/None> - If provided, the tree is taken from this snapshot.
+                If None, the kernel's children lists are walked when available (reading only the subtree),
+                otherwise a single new snapshot is taken and walked.
+
             @return list<int> - Flat list of all child pids and their children.
         '''
-        childPids = Program.getChildPids(rootPid)
-        if not childPids:
-            return []
+        rootPid = int(rootPid)
+
+        if processTable is None:
+            if hasKernelChildren():
+                childPids = getKernelChildPids(rootPid)
+                i = 0
+                # childPids grows as we go, so walk by index.
+                while i < len(childPids):
+                    childPids += getKernelChildPids(childPids[i])
+                    i += 1
+                return childPids
 
-        # Get children of all children as well
-        newChildPids = childPids[:]
-        while newChildPids:
-            newChildPids2 = []
-            for newChildPid in newChildPids:
-                childChildPids = Program.getChildPids(newChildPid)
-                newChildPids2 += childChildPids
-                childPids += childChildPids
-            newChildPids = newChildPids2
+            processTable = ProcessTable.createSnapshot()
 
-        return childPids
+        return processTable.getAllChildPidsInTree(rootPid)
 
     @classmethod
     def getParentPid(cls, pid):
@@ -227,21 +214,81 @@ class Program(object):
         return statInfo['ppid']
 
 
+    @staticmethod
+    def readPidFile(pidfile):
+        '''
+            readPidFile - Read a pidfile.
+
+                The first line is the pid. Pidfiles written by usrsvc also contain a "starttime=" line,
+                  which identifies the exact process (see Program.getIdentity). Pidfiles with only a pid are also supported.
+
+            @param pidfile <str> - Path to pid file
+
+            @return tuple( pid<int>, starttime<int/None> )
+
+            @raises - IOError/OSError if cannot be read, ValueError if pid is invalid.
+        '''
+        with open(pidfile, 'rt') as f:
+            contents = f.read()
+
+        lines = contents.strip().split('\n')
+        pid = int(lines[0].strip())
+
+        starttime = None
+        for line in lines[1:]:
+            line = line.strip()
+            if line.startswith('starttime='):
+                try:
+                    starttime = int(line[len('starttime='):])
+                except ValueError:
+                    pass
+
+        return (pid, starttime)
+
+    def getIdentity(self):
+        '''
+            getIdentity - Get the identity of the process represented by this Program, which is (pid, starttime).
+
+                A pid may be reused once a process ends, but the (pid, starttime) pair is unique for the uptime of the system.
+
+            @return tuple( pid<int>, starttime<int> ), or None if not running.
+        '''
+        if not self.pid:
+            return None
+        if self.starttime is None:
+            try:
+                self.starttime = readProcStat(self.pid)[3]
+            except:
+                return None
+
+        return (self.pid, self.starttime)
+
     @classmethod
-    def createFromPidFile(cls, pidfile):
+    def createFromPidFile(cls, pidfile, processTable=None):
         '''
             createFromPidFile - Creates a Program from a pidfile.
 
             @param pidfile <str> - Path to pid file
 
-            @raises - An exception if no process can be created from the pidfile. Specific exception depends on error. Not validated with proctitle_re, do that in an additional call.
+            @param processTable <ProcessTable/None> - If provided, the cmdline will be taken from this snapshot when the pid is present within it.
+
+            @raises - An exception if no process can be created from the pidfile. Specific exception depends on error.
+                ValueError if the pidfile has a starttime, and the process with that pid has another (the pid was reused).
+                Not validated with proctitle_re, do that in an additional call.
         '''
-        with open(pidfile, 'rt') as f:
-            pid = f.read().strip()
-        pid = int(pid)
-        procCmdline = cls._getProcCmdline(pid)
+        (pid, pidfileStarttime) = cls.readPidFile(pidfile)
+        if processTable is not None and pid in processTable:
+            procCmdline = processTable.getCmdline(pid)
+            starttime = processTable.getProcessInfo(pid).starttime
+        else:
+            # Not in the snapshot (maybe started after it was taken), go to /proc directly.
+            procCmdline = cls._getProcCmdline(pid)
+            starttime = readProcStat(pid)[3]
+
+        if pidfileStarttime is not None and pidfileStarttime != starttime:
+            raise ValueError('pid %d in %s was reused by a different process (starttime %d != %d).' %(pid, pidfile, starttime, pidfileStarttime))
 
-        return cls(pidfile, pid, running=True, **procCmdline)
+        return cls(pidfile, pid, running=True, starttime=starttime, **procCmdline)
 
     @classmethod
     def getMyRunningPids(cls):
@@ -266,30 +313,36 @@ class Program(object):
         return allMyPids
 
     @classmethod
-    def createFromRunningProcesses(cls, programConfig):
+    def createFromRunningProcesses(cls, programConfig, processTable=None):
         '''
             createFromRunningProcesses - Create a Program using programConfig. scans all running processes, and returns a constructed Program if a match is found.
 
             @param programConfig <ProgramConfig.ProgramConfig> - The config for a program
 
+            @param processTable <ProcessTable/None> - A snapshot of running processes to scan. If None, a new snapshot is taken.
+
             @return - A constructed "Program" if a match found, ootherwise None.
 
             Should not raise anything.
         '''
-        allMyPids = cls.getMyRunningPids()
+        if processTable is None:
+            try:
+                processTable = ProcessTable.createSnapshot()
+            except:
+                return None
 
         proctitleRE = programConfig.proctitle_re
 
-        for pid in allMyPids:
+        for pid in processTable.getPids():
             try:
-                # Do in a loop incase processes are created/destroyed between getting the list and checking it
-                procCmdline = cls._getProcCmdline(pid)
+                # Do in a loop incase processes are destroyed between taking the snapshot and checking it
+                procCmdline = processTable.getCmdline(pid)
 
                 # Make sure we match actual process and not the wrapping shell.
                 if programConfig.useshell is True and procCmdline['cmdline'].startswith('/bin/sh -c'):
                     continue
                 if bool(proctitleRE.search(procCmdline['cmdline'])):
-                    prog = cls(programConfig.pidfile, pid, running=True, **procCmdline)
+                    prog = cls(programConfig.pidfile, pid, running=True, starttime=processTable.getProcessInfo(pid).starttime, **procCmdline)
                     return prog
             except:
                 pass
@@ -337,19 +390,38 @@ class Program(object):
             @return - time process was started, or None if no program found matching this Program's pid.
         '''
         try:
-            statInfo = os.stat('/proc/' + str(self.pid))
-            if not statInfo:
+            identity = self.getIdentity()
+            if identity is None:
                 return None
-            # Try ctime first, but may not be present everywhere, so fallback to st_mtime
-            if hasattr(statInfo, 'st_ctime') and statInfo.st_ctime:
-                return statInfo.st_ctime
-            return statInfo.st_mtime
+            return startTimeToEpoch(identity[1])
         except Exception:
             pass
 
         return None
 
 
+    @staticmethod
+    def _startLogPumps(programConfig):
+        '''
+            _startLogPumps - Start the log pumps for a program with log_mode=managed
+
+            @param programConfig <ProgramConfig.ProgramConfig> - The program config
+
+            @return tuple<int, int> - (stdout, stderr) file descriptors for the program. These are the same if stdout and stderr are the same file.
+        '''
+        pumpArgs = (int(programConfig.log_max_size * 1024 * 1024), programConfig.log_max_age, programConfig.log_keep, programConfig.log_compress)
+
+        stdout = startLogPump(programConfig.stdout, *pumpArgs)
+        if programConfig.stdout == programConfig.stderr:
+            return (stdout, stdout)
+
+        try:
+            stderr = startLogPump(programConfig.stderr, *pumpArgs)
+        except:
+            os.close(stdout)
+            raise
+        return (stdout, stderr)
+
     def startProgram(self, programConfig):
         '''
             startProgram - Start the program and update this object.
@@ -363,21 +435,28 @@ class Program(object):
         else:
             command = programConfig.command
 
-        try:
-            stdout = open(programConfig.stdout, 'at')
-        except Exception as e:
-            logErr('(%s) - Cannot open stdout %s for writing: %s\n' %(programConfig.name, programConfig.stdout, str(e)))
-            return ReturnCodes.INSUFFICIENT_PERMISSIONS
-#            raise ValueError('Cannot open %s for writing.' %(programConfig.stdout,))
-        if programConfig.stdout == programConfig.stderr:
-            stderr = stdout
+        if programConfig.log_mode == 'managed':
+            try:
+                (stdout, stderr) = self._startLogPumps(programConfig)
+            except Exception as e:
+                logErr('(%s) - Cannot start log pump for %s: %s\n' %(programConfig.name, programConfig.stdout, str(e)))
+                return ReturnCodes.INSUFFICIENT_PERMISSIONS
         else:
             try:
-                stderr = open(programConfig.stderr, 'at')
+                stdout = open(programConfig.stdout, 'at')
             except Exception as e:
-                logErr('(%s) - Cannot open stderr %s for writing: %s\n' %(programConfig.name, programConfig.stderr, str(e)))
+                logErr('(%s) - Cannot open stdout %s for writing: %s\n' %(programConfig.name, programConfig.stdout, str(e)))
                 return ReturnCodes.INSUFFICIENT_PERMISSIONS
-#                raise ValueError('Cannot open %s for writing.' %(programConfig.stderr,))
+#                raise ValueError('Cannot open %s for writing.' %(programConfig.stdout,))
+            if programConfig.stdout == programConfig.stderr:
+                stderr = stdout
+            else:
+                try:
+                    stderr = open(programConfig.stderr, 'at')
+                except Exception as e:
+                    logErr('(%s) - Cannot open stderr %s for writing: %s\n' %(programConfig.name, programConfig.stderr, str(e)))
+                    return ReturnCodes.INSUFFICIENT_PERMISSIONS
+#                    raise ValueError('Cannot open %s for writing.' %(programConfig.stderr,))
 
         if programConfig.inherit_env:
             env = os.environ
@@ -396,6 +475,11 @@ class Program(object):
         except Exception as e:
             logErr('(%s) - Failed to run command ( %s ): %s\n' %(programConfig.name, str(command), str(e)))
             return ReturnCodes.PROGRAM_FAILED_TO_LAUNCH
+        finally:
+            if programConfig.log_mode == 'managed':
+                # The program has its own copies now. Once it (and its children) exit, the pumps see end of file.
+                for pumpFd in set( (stdout, stderr) ):
+                    os.close(pumpFd)
         
         time.sleep(.1) # Give a chance to start program
         now = time.time()
@@ -483,7 +567,7 @@ class Program(object):
                 if foundMatchingChild is True:
                     while time.time() < successAfter:
                         time.sleep(pollTime)
-                        if not os.path.exists('/proc/%d' %(self.pid,)):
+                        if not isProcessRunning(self.pid):
                             logMsg('(%s) - Found child process pid=%d cmdline=%s, but it stopped running. Checking other children...\n' %(programConfig.name, self.pid, str(cmdline)))
                             self.pid = None
                             foundMatchingChild = False
@@ -505,6 +589,10 @@ class Program(object):
             return ReturnCodes.PROGRAM_EXITED_UNEXPECTEDLY
 
         self.running = True
+        try:
+            self.starttime = readProcStat(self.pid)[3]
+        except:
+            self.starttime = None
 
         self.writePidFile(programConfig, self.pid)
 
@@ -531,7 +619,8 @@ class Program(object):
                 termToKillSeconds = programConfig.term_to_kill_seconds
 
                 pollInterval = min(termToKillSeconds / 10.0, .1)
-                processDied = waitUpTo(os.path.exists, ('/proc/%d' %(self.pid,) , ), timeout=termToKillSeconds, interval=pollInterval)
+                # A zombie has exited, as its parent (like the launcher worker which started it) may not reap it until we return
+                processDied = waitUpTo(isProcessRunning, (self.pid, ), timeout=termToKillSeconds, interval=pollInterval)
                 if processDied is False:
                     # If program has not terminated given the threshold, send 'er the ol' boot.
                     os.kill(self.pid, signal.SIGKILL)
@@ -554,18 +643,30 @@ class Program(object):
             
             @param forcePid <int/None> - if provided, use this pid instead of self.pid
 
+            The pid is written on the first line, followed by a "starttime=" line with the process' kernel starttime, which
+              lets later checks identify the process without reading its cmdline.
+
             @return - False if not written (no autopid), otherwise True if written.
         '''
-        if forcePid:
+        if forcePid and forcePid != self.pid:
             pid = forcePid
+            try:
+                starttime = readProcStat(pid)[3]
+            except:
+                starttime = None
         else:
             pid = self.pid
+            identity = self.getIdentity()
+            starttime = identity and identity[1]
 
         # Note: pidfile should never be undefined... but just incase somehow.
         if programConfig.autopid is False or not programConfig.pidfile:
             return False
         with open(programConfig.pidfile, 'wt') as f:
-            f.write("%s\n" %(str(pid),))
+            if starttime is not None:
+                f.write("%s\nstarttime=%d\n" %(str(pid), starttime))
+            else:
+                f.write("%s\n" %(str(pid),))
         return True
         
 
@@ -18,12 +18,80 @@
 
 # vim:set ts=4 shiftwidth=4 softtabstop=4 expandtab :
 
+import os
+import threading
+
 from .Program import Program
+from .ProcessTable import readProcStat
 from .logging import logErr, logMsg
 
+__all__ = ('getRunningProgram', 'getRunningPrograms', 'forgetValidatedIdentity')
+
 # TODO: Notification system
 
-def getRunningProgram(programConfig):
+# Cache of process identities which have already passed proctitle validation.
+#   programName -> (pid, starttime, proctitle_re pattern, cmdline dict)
+global _validatedIdentities
+_validatedIdentities = {}
+_validatedIdentitiesLock = threading.Lock()
+
+def _resetLocksInChild():
+    # A fork (like of a launcher worker) may happen while another thread holds the lock, and that thread does not exist in the child
+    global _validatedIdentitiesLock
+    _validatedIdentitiesLock = threading.Lock()
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_resetLocksInChild)
+
+
+def _getCurrentStartTime(pid, processTable):
+    '''
+        _getCurrentStartTime - Get the kernel starttime of a running pid, from the snapshot if present, otherwise /proc.
+
+        @return <int/None> - starttime, or None if the process is not running (or is a zombie)
+    '''
+    if processTable is not None and pid in processTable:
+        processInfo = processTable.getProcessInfo(pid)
+        state = processInfo.state
+        starttime = processInfo.starttime
+    else:
+        try:
+            (_pid, state, _ppid, starttime) = readProcStat(pid)
+        except:
+            return None
+
+    if state == 'Z':
+        # Zombie, has exited but not been reaped.
+        return None
+
+    return starttime
+
+
+def _rememberIdentity(programConfig, prog):
+    identity = prog.getIdentity()
+    if identity is None:
+        return
+
+    cmdlineInfo = {
+        'cmdline' : prog.cmdline,
+        'executable' : prog.executable,
+        'args' : prog.args,
+    }
+    with _validatedIdentitiesLock:
+        _validatedIdentities[programConfig.name] = (identity[0], identity[1], programConfig.proctitle_re.pattern, cmdlineInfo)
+
+
+def forgetValidatedIdentity(programName):
+    '''
+        forgetValidatedIdentity - Forget the cached identity for a program, so its next check fully revalidates the proctitle.
+
+        @param programName <str> - Name of program
+    '''
+    with _validatedIdentitiesLock:
+        _validatedIdentities.pop(programName, None)
+
+
+def getRunningProgram(programConfig, processTable=None):
     '''
         getRunningProgram - Get a "Program" object representing a running program, or None if not running.
 
@@ -32,39 +100,147 @@ def getRunningProgram(programConfig):
             Tries pidfile first, if no match then if scan_for_process is set on the programConfig, running processes will
               be scanned and if a proctitle match is found, a pidfile wiil be written and the program returned.
 
+            Once a process has matched proctitle_re, its identity (pid, starttime) is cached. Later calls where the pidfile
+              still points to that same identity only need the process' starttime, and skip reading the cmdline and the regex.
+              A pidfile whose recorded starttime does not match the running pid is stale (the pid was reused).
+
          @param programConfig <ProgramConfig obj> - The ProgramConfig object representing the program to fetch.
 
+         @param processTable <ProcessTable/None> - A snapshot of running processes to use. Pass one shared snapshot when
+                checking many programs at once. If None, /proc is read directly (and scanned if required).
+
          @return <None/Program> - A running Program if match was found, otherwise None.
     '''
+    prog = _getRunningProgramFromPidFile(programConfig, processTable)
+    if prog is not None:
+        return prog
+
+    if programConfig.scan_for_process is True:
+        # No PID or failed proctitle match, scan running processes
+        prog = Program.createFromRunningProcesses(programConfig, processTable)
+        if prog:
+            _adoptScannedProgram(programConfig, prog)
+            return prog
+
+    return None
+
+
+def getRunningPrograms(programConfigs, processTable, proctitleMatcher=None):
+    '''
+        getRunningPrograms - Get the running Program for many programs at once. Same as calling getRunningProgram on each,
+            except that all programs which need to scan for their process ( scan_for_process ) are matched in a single
+            sweep over #processTable# using #proctitleMatcher#.
+
+        @param programConfigs list<ProgramConfig> - The ProgramConfigs to fetch
+
+        @param processTable <ProcessTable> - A snapshot of running processes
+
+        @param proctitleMatcher <ProctitleMatcher/None> - Combined matcher (see UsrsvcConfig.getProctitleMatcher). If None, one is built for the given programs.
+
+        @return dict<str, None/Program> - program name -> running Program, or None if not running.
+    '''
+    ret = {}
+    needScan = {}
+
+    for programConfig in programConfigs:
+        programName = programConfig.name
+        try:
+            prog = _getRunningProgramFromPidFile(programConfig, processTable)
+        except Exception as e:
+            logErr('Unexpected error checking pidfile for %s: %s\n' %(programName, str(e)))
+            prog = None
+
+        ret[programName] = prog
+        if prog is None and programConfig.scan_for_process is True:
+            needScan[programName] = programConfig
+
+    if not needScan:
+        return ret
+
+    if proctitleMatcher is None:
+        from .ProctitleMatcher import ProctitleMatcher
+        proctitleMatcher = ProctitleMatcher(needScan)
+
+    for programName, pid in proctitleMatcher.matchProcesses(processTable, needScan.keys()).items():
+        programConfig = needScan[programName]
+        try:
+            procCmdline = processTable.getCmdline(pid)
+            prog = Program(programConfig.pidfile, pid, running=True, starttime=processTable.getProcessInfo(pid).starttime, **procCmdline)
+            _adoptScannedProgram(programConfig, prog)
+        except Exception as e:
+            logErr('Unexpected error adopting matched process pid=%d for %s: %s\n' %(pid, programName, str(e)))
+            continue
+
+        ret[programName] = prog
+
+    return ret
+
+
+def _adoptScannedProgram(programConfig, prog):
+    '''
+        _adoptScannedProgram - Handle a process found by scanning. Writes the pidfile and remembers its identity.
+    '''
+    logMsg('Matched %s from running process:\n\n%s\n' %(programConfig.name, prog.__dict__))
+    prog.writePidFile(programConfig)
+    _rememberIdentity(programConfig, prog)
+
+
+def _getRunningProgramFromPidFile(programConfig, processTable):
+    '''
+        _getRunningProgramFromPidFile - The pidfile portion of getRunningProgram. Validates the process in the pidfile,
+            removing the pidfile if it is stale.
+
+        @return <None/Program> - Running Program if pidfile is valid, otherwise None.
+    '''
     programName = programConfig.name
 
     prog = None
+    pid = None
+    pidfileStarttime = None
     try:
-        # Try to get program from pidfile
-        prog = Program.createFromPidFile(programConfig.pidfile)
+        (pid, pidfileStarttime) = Program.readPidFile(programConfig.pidfile)
     except:
         pass
 
-    if prog is not None:
-        # A program is running, check if it is the RIGHT program
-        isCorrectApp = prog.validateProcTitle(programConfig)
-        if not isCorrectApp:
-            logErr('Warning: Detected stale pid file for %s at %s (%d). REMOVING\n  Proctitle for %d was: %s\n' %(programName, programConfig.pidfile, prog.pid, prog.pid, prog.cmdline))
-            prog.removePidFile(programConfig)
-            prog = None
-        else:
-            # Program is running, and matched proctitle
-            return prog
-            
-    if prog is None:
-        if programConfig.scan_for_process is True:
-            # No PID or failed proctitle match, scan running processes
-            prog = Program.createFromRunningProcesses(programConfig)
-            if prog:
-                logMsg('Matched %s from running process:\n\n%s\n' %(programName, prog.__dict__))
-                prog.writePidFile(programConfig)
-                return prog
+    if pid is None:
+        return None
+
+    starttime = _getCurrentStartTime(pid, processTable)
+    if starttime is None:
+        return None
+
+    if pidfileStarttime is not None and pidfileStarttime != starttime:
+        logErr('Warning: Detected stale pid file for %s at %s (%d). REMOVING\n  pid %d was reused by a different process (starttime %d != %d).\n' %(programName, programConfig.pidfile, pid, pid, starttime, pidfileStarttime))
+        forgetValidatedIdentity(programName)
+        Program(programConfig.pidfile).removePidFile(programConfig)
+        return None
 
+    cached = _validatedIdentities.get(programName, None)
+    if cached is not None and cached[0] == pid and cached[1] == starttime and cached[2] == programConfig.proctitle_re.pattern:
+        # Same process that already passed validation
+        return Program(programConfig.pidfile, pid, running=True, starttime=starttime, **cached[3])
+
+    try:
+        prog = Program.createFromPidFile(programConfig.pidfile, processTable)
+    except:
+        return None
+
+    # A program is running, check if it is the RIGHT program
+    isCorrectApp = prog.validateProcTitle(programConfig)
+    if not isCorrectApp:
+        logErr('Warning: Detected stale pid file for %s at %s (%d). REMOVING\n  Proctitle for %d was: %s\n' %(programName, programConfig.pidfile, prog.pid, prog.pid, prog.cmdline))
+        forgetValidatedIdentity(programName)
+        prog.removePidFile(programConfig)
+        return None
+
+    # Program is running, and matched proctitle
+    _rememberIdentity(programConfig, prog)
+    if pidfileStarttime is None:
+        # Upgrade a pid-only pidfile, so other usrsvc processes can verify the identity too
+        try:
+            prog.writePidFile(programConfig)
+        except:
+            pass
     return prog
 
 
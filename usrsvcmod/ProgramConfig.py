@@ -23,6 +23,7 @@ import re
 import shlex
 
 from .configcommon import getConfigValueBool, getConfigValueInt, getConfigValueFloat
+from .LogPump import LOG_MODES
 from .MonitoringConfig import MonitoringConfig
 
 from .logging import logMsg
@@ -40,10 +41,12 @@ class ProgramConfig(object):
             autopid=True, useshell=False, proctitle_re=None, 
             success_seconds=2.0, term_to_kill_seconds=8.0, scan_for_process=True,
             stdout=None, stderr=None,
+            log_mode='file', log_max_size=100, log_max_age=86400, log_keep=7, log_compress=True,
             enabled=True,
             inherit_env=True, Env=None, Monitoring=None,
             defaults=None,
             email_alerts=None,
+            check_interval=2.0, adaptive_interval=False,
             **kwargs):
         '''
             name - Determined from section name [Program:TheName] has "TheName"
@@ -65,12 +68,21 @@ class ProgramConfig(object):
                 * restart_delay - Default 0, integer on the miminum number of seconds between a failing "start" and the next "restart" attmept by "usrsvcd". 
                 * success_seconds - Default 2, Float, The number of seconds usrsvc will wait before considering a program successfully started. The created process must both match and still be running at the end of this period to be marked successful.
                 * term_to_kill_seconds : Default 8, Float on the number of seconds the application is given between SIGTERM and SIGKILL.
+                * check_interval - Default 2, Float, the number of seconds between checks by "usrsvcd" that the program is running.
+                * adaptive_interval - Default False, boolean. If True, check_interval and the Monitoring monitor_interval are doubled for every hour the program has been
+                    running (up to 8x), and halved for 10 minutes after usrsvcd restarts it.
 
 
 
                 NOTE: The following stdout/stderr are opened in "append" mode always. 
                 * stdout - REQUIRED - Absolute path to a file to be used for stdout
                 * stderr - Absolute path to a file to be used for stderr, or "stdout" to redirect to stdout. Default is to redirect stderr to stdout. May be same filename as stdout.
+                * log_mode - Default "file". With "file", stdout/stderr are handed to the program directly. With "managed", the program writes to a pipe,
+                    and a log pump process writes to stdout/stderr and rotates them (by renaming) according to the log_* options below.
+                * log_max_size - Default 100, Float. With log_mode=managed, rotate once a log reaches this many megabytes. 0 disables.
+                * log_max_age - Default 86400, Float. With log_mode=managed, rotate once a log has been written for this many seconds. 0 disables.
+                * log_keep - Default 7, integer. With log_mode=managed, the number of rotated segments of each log to keep.
+                * log_compress - Default True, boolean. With log_mode=managed, rotated segments are compressed with gzip in the background.
                 * defaults - This can reference a "DefaultSettings" section defined elsewhere, i.e. to reference [DefaultSettings:MySettings] use "defaults=MySettings". If provided, this Program will inherit the settings defined in the DefaultSettings as the defaults. Anything provided explicitly in this Program will override those found in the defaults.
                 * inherit_env - Boolean, default True. If True, will inherit the env from "usrsvc" or "usrsvcd". Otherwise, will only use the Env as defined in the Env subsection.
 
@@ -114,6 +126,11 @@ class ProgramConfig(object):
         if self.term_to_kill_seconds < 0:
             raise ValueError('term_to_kill_seconds is required and must be a positive number.')
 
+        self.check_interval = getConfigValueFloat(check_interval, 'check_interval')
+        if self.check_interval <= 0:
+            raise ValueError('check_interval must be a positive number of seconds.')
+        self.adaptive_interval = getConfigValueBool(adaptive_interval, 'adaptive_interval')
+
         self.inherit_env = getConfigValueBool(inherit_env, 'inherit_env')
         self.defaults = defaults
         
@@ -122,7 +139,8 @@ class ProgramConfig(object):
 
         if Env is None:
             Env = {}
-        self.Env = Env
+        # Plain dict, so we don't reference (or pickle) the whole parsed config file
+        self.Env = dict(Env)
 
         if not issubclass(Monitoring.__class__, (type(None), dict)):
             raise ValueError('Monitoring must be a subsection, like [[Monitoring]]')
@@ -145,12 +163,15 @@ class ProgramConfig(object):
 
         # If proctitle_re is not defined, default to the provided command.
         #   Do not use start because given a shebang line, the executable may change.
+        #   In that case, also keep the plain string, so matching can be done with a simple "endswith" (see ProctitleMatcher)
+        self.proctitle_suffix = None
         if not proctitle_re:
             proctitleCommandSplit = commandSplit
             # If this is a shell, and && is provided, skip past that.
             if self.useshell and '&&' in command:
                 proctitleCommandSplit = shlex.split(command[command.rindex('&&')+2:])
-            proctitle_re = re.compile('(%s)$' %(re.escape(' '.join(proctitleCommandSplit)), ))
+            self.proctitle_suffix = ' '.join(proctitleCommandSplit)
+            proctitle_re = re.compile('(%s)$' %(re.escape(self.proctitle_suffix), ))
         else:
             try:
                 proctitle_re = re.compile(proctitle_re)
@@ -179,6 +200,22 @@ class ProgramConfig(object):
 
             self.stderr = stderr
 
+        log_mode = (log_mode or 'file').strip().lower()
+        if log_mode not in LOG_MODES:
+            raise ValueError('Program %s has invalid log_mode "%s", must be one of: %s' %(name, log_mode, ', '.join(LOG_MODES)))
+        self.log_mode = log_mode
+
+        self.log_max_size = getConfigValueFloat(log_max_size, 'log_max_size')
+        if self.log_max_size < 0:
+            raise ValueError('log_max_size must be 0 (disabled) or a positive number of megabytes.')
+        self.log_max_age = getConfigValueFloat(log_max_age, 'log_max_age')
+        if self.log_max_age < 0:
+            raise ValueError('log_max_age must be 0 (disabled) or a positive number of seconds.')
+        self.log_keep = getConfigValueInt(log_keep, 'log_keep')
+        if self.log_keep < 1:
+            raise ValueError('log_keep must be at least 1.')
+        self.log_compress = getConfigValueBool(log_compress, 'log_compress')
+
         self.email_alerts = email_alerts
 
         if kwargs:
@@ -0,0 +1,223 @@
+'''
+    Copyright (c) 2016 Tim Savannah All Rights Reserved.
+    This software is licensed under the terms of the GPLv3.
+    This may change at my discretion, retroactively, and without notice.
+
+    You should have received a copy of this with the source distribution as a file titled, LICENSE.
+
+    The most current license can be found at:
+    https://github.com/kata198/usrsvc/LICENSE
+
+    This location may need to be changed at some point in the future, in which case
+    you are may email Tim Savannah <kata198 at gmail dot com>, or find them on the
+    current website intended for distribution of usrsvc.
+
+
+    Reaper - Child-subreaper support, so usrsvcd can collect the exit status of the programs it launches.
+'''
+
+# vim:set ts=4 shiftwidth=4 softtabstop=4 expandtab :
+
+import os
+import signal
+import subprocess
+import threading
+import time
+
+from .ProcessTable import ProcessTable, hasKernelChildren, getKernelChildPids
+
+__all__ = ('Reaper', 'setChildSubreaper', 'describeExitStatus', 'startWaitedChild', 'finishWaitedChild')
+
+# From linux/prctl.h
+PR_SET_CHILD_SUBREAPER = 36
+
+# Pids of children started through #startWaitedChild# which are still being waited on by whoever started them.
+#  Held by Reaper.reap for the whole pass, so a child is always registered before a reap can see it.
+_waitedChildPids = set()
+_waitedChildLock = threading.Lock()
+
+def startWaitedChild(*args, **kwargs):
+    '''
+        startWaitedChild - Start a subprocess.Popen whose exit status is collected by the caller (like with #wait#),
+            so it must never be reaped by a Reaper. Call #finishWaitedChild# once done with it.
+
+            Otherwise, a reap between its exit and the caller's wait takes the status, and Popen reports a returncode of 0.
+
+        Arguments are as subprocess.Popen
+
+        @return <subprocess.Popen> - The started process
+    '''
+    with _waitedChildLock:
+        pipe = subprocess.Popen(*args, **kwargs)
+        _waitedChildPids.add(pipe.pid)
+
+    return pipe
+
+def finishWaitedChild(pipe):
+    '''
+        finishWaitedChild - Mark a child started through #startWaitedChild# as waited on (or given up on), so it may be reaped again.
+
+        @param pipe <subprocess.Popen> - The process, as returned by #startWaitedChild#
+    '''
+    with _waitedChildLock:
+        _waitedChildPids.discard(pipe.pid)
+
+def setChildSubreaper():
+    '''
+        setChildSubreaper - Mark the current process as a child subreaper (Linux 3.4+), so that orphaned
+            descendants are reparented to us instead of init.
+
+        @return <bool> - True on success, False if not supported.
+    '''
+    try:
+        import ctypes
+        import ctypes.util
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        return libc.prctl(PR_SET_CHILD_SUBREAPER, 1, 0, 0, 0) == 0
+    except:
+        return False
+
+
+def _getSignalName(signum):
+    for name in dir(signal):
+        if name.startswith('SIG') and not name.startswith('SIG_') and getattr(signal, name) == signum:
+            return name
+    return 'UNKNOWN'
+
+def describeExitStatus(status):
+    '''
+        describeExitStatus - Convert a wait status into a readable string
+
+        @param status <int> - Status, as returned by os.waitpid
+
+        @return <str> - Like "exited with code=1" or "killed by signal 9 (SIGKILL)"
+    '''
+    if os.WIFSIGNALED(status):
+        signum = os.WTERMSIG(status)
+        ret = 'killed by signal %d (%s)' %(signum, _getSignalName(signum))
+        if hasattr(os, 'WCOREDUMP') and os.WCOREDUMP(status):
+            ret += ', core dumped'
+        return ret
+    if os.WIFEXITED(status):
+        return 'exited with code=%d' %(os.WEXITSTATUS(status), )
+
+    return 'unknown status=%d' %(status, )
+
+
+class Reaper(object):
+    '''
+        Reaper - Reaps children (including programs reparented to us as a subreaper) and records their exit status.
+
+            Children which belong to multiprocessing, were started through #startWaitedChild#, or any pid returned by #getExcludedPids#,
+              are left alone, because they are joined elsewhere.
+    '''
+
+    def __init__(self, getExcludedPids=None):
+        '''
+            @param getExcludedPids <None/function> - If provided, a function that returns a collection of additional
+                child pids which should NOT be reaped here.
+        '''
+        self.getExcludedPids = getExcludedPids
+
+        # pid -> (time reaped, wait status)
+        self.exitStatuses = {}
+
+        # Notified whenever an exit status is recorded
+        self.condition = threading.Condition()
+
+    def _getChildPids(self):
+        myPid = os.getpid()
+        if hasKernelChildren():
+            return getKernelChildPids(myPid)
+
+        return ProcessTable.createSnapshot().getChildPids(myPid)
+
+    def reap(self):
+        '''
+            reap - Reap any exited children, recording their exit status.
+
+            @return dict<int, int> - pid -> wait status of children reaped by this call
+        '''
+        import multiprocessing
+
+        # Gather exclusions BEFORE looking at children, so that anything multiprocessing starts after is still alive (and not reaped) when we check it.
+        excludedPids = set([child.pid for child in multiprocessing.active_children()])
+        if self.getExcludedPids is not None:
+            excludedPids.update(self.getExcludedPids())
+
+        reaped = {}
+        with _waitedChildLock:
+            excludedPids.update(_waitedChildPids)
+
+            for childPid in self._getChildPids():
+                if childPid in excludedPids:
+                    continue
+                try:
+                    (pid, status) = os.waitpid(childPid, os.WNOHANG)
+                except OSError:
+                    # Not our child (anymore)
+                    continue
+                if pid == 0:
+                    # Still running
+                    continue
+                reaped[pid] = status
+
+        if reaped:
+            now = time.time()
+            with self.condition:
+                for pid, status in reaped.items():
+                    self.exitStatuses[pid] = (now, status)
+                self.condition.notify_all()
+
+        return reaped
+
+    def recordExitStatus(self, pid, status):
+        '''
+            recordExitStatus - Record the exit status of a pid which was reaped elsewhere.
+
+            @param pid <int> - Process ID
+            @param status <int> - Wait status
+        '''
+        with self.condition:
+            self.exitStatuses[pid] = (time.time(), status)
+            self.condition.notify_all()
+
+    def popExitStatus(self, pid, timeout=None):
+        '''
+            popExitStatus - Get and forget the recorded exit status of a pid.
+
+            @param pid <int> - Process ID
+            @param timeout <float/None> - If provided, wait up to this many seconds for the status to be recorded.
+                Use when the pid is known to be reaped elsewhere (like by a launcher worker), but may not have been yet.
+
+            @return <int/None> - The wait status, or None if we did not reap this pid.
+        '''
+        with self.condition:
+            if timeout:
+                deadline = time.time() + timeout
+                while pid not in self.exitStatuses:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        break
+                    self.condition.wait(remaining)
+
+            item = self.exitStatuses.pop(pid, None)
+
+        if item is None:
+            return None
+        return item[1]
+
+    def expire(self, maxAge=3600):
+        '''
+            expire - Forget exit statuses older than #maxAge# seconds, which nobody asked about (like untracked grandchildren).
+
+            @param maxAge <float> - Max age in seconds
+        '''
+        cutoff = time.time() - maxAge
+        with self.condition:
+            for pid in list(self.exitStatuses.keys()):
+                if self.exitStatuses[pid][0] < cutoff:
+                    del self.exitStatuses[pid]
+
+
+# vim:set ts=4 shiftwidth=4 softtabstop=4 expandtab :
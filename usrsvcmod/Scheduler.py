@@ -0,0 +1,247 @@
+'''
+    Copyright (c) 2016 Tim Savannah All Rights Reserved.
+    This software is licensed under the terms of the GPLv3.
+    This may change at my discretion, retroactively, and without notice.
+
+    You should have received a copy of this with the source distribution as a file titled, LICENSE.
+
+    The most current license can be found at:
+    https://github.com/kata198/usrsvc/LICENSE
+
+    This location may need to be changed at some point in the future, in which case
+    you are may email Tim Savannah <kata198 at gmail dot com>, or find them on the
+    current website intended for distribution of usrsvc.
+
+
+    Scheduler - A deadline heap of per-program tasks, which usrsvcd sleeps upon until the next task is due.
+'''
+
+# vim:set ts=4 shiftwidth=4 softtabstop=4 expandtab :
+
+import heapq
+import threading
+import time
+
+__all__ = ('Scheduler', 'getAdaptiveInterval', 'TASK_CHECK', 'TASK_MONITOR', 'TASK_RESTART_DELAY', 'TASK_START_COMPLETE')
+
+# Check if a program is running, and start it if needed.
+TASK_CHECK = 'check'
+
+# Run the monitors of a program.
+TASK_MONITOR = 'monitor'
+
+# The restart_delay of a program, following a failed restart, has expired.
+TASK_RESTART_DELAY = 'restart_delay'
+
+# Poll whether a start (or restart) action on a program has completed.
+TASK_START_COMPLETE = 'start_complete'
+
+# Tasks due within this many seconds of each other are returned together, so they can share a single process table snapshot.
+BATCH_WINDOW = .1
+
+# Never block longer than this without re-checking. On python2, a Condition wait without a timeout cannot be interrupted by signals.
+MAX_WAIT = 30.0
+
+# With adaptive_interval, a program restarted within this many seconds is checked twice as often
+ADAPTIVE_RECENT_RESTART_SECONDS = 600
+
+# With adaptive_interval, the interval doubles for every this many seconds a program has been running (up to ADAPTIVE_MAX_FACTOR)
+ADAPTIVE_STABLE_SECONDS = 3600
+
+ADAPTIVE_MAX_FACTOR = 8
+
+# Adaptive intervals are never shortened below this
+ADAPTIVE_MIN_INTERVAL = .5
+
+
+def getAdaptiveInterval(interval, runningSince, lastRestartAt, now=None):
+    '''
+        getAdaptiveInterval - Get the interval to use for a program with adaptive_interval=True.
+
+            A program restarted within the last ADAPTIVE_RECENT_RESTART_SECONDS gets half the interval (so flapping is caught sooner).
+            Otherwise, the interval doubles for every ADAPTIVE_STABLE_SECONDS the program has been running, up to ADAPTIVE_MAX_FACTOR times.
+
+        @param interval <float> - The configured interval
+        @param runningSince <float/None> - Epoch time the current process started, or None if unknown
+        @param lastRestartAt <float/None> - Epoch time usrsvcd last started or restarted the program, or None if never
+        @param now <float/None> - Current time, or None to use time.time()
+
+        @return <float> - The interval to use
+    '''
+    if now is None:
+        now = time.time()
+
+    if lastRestartAt and now - lastRestartAt < ADAPTIVE_RECENT_RESTART_SECONDS:
+        return max(interval / 2.0, min(interval, ADAPTIVE_MIN_INTERVAL))
+
+    if runningSince:
+        stableFor = now - runningSince
+        if stableFor >= ADAPTIVE_STABLE_SECONDS:
+            return interval * min(2 ** int(stableFor // ADAPTIVE_STABLE_SECONDS), ADAPTIVE_MAX_FACTOR)
+
+    return interval
+
+
+class Scheduler(object):
+    '''
+        Scheduler - Holds a heap of (due time, programName, task) entries.
+
+            Each (programName, task) pair is scheduled at most once; scheduling it again replaces the old due time.
+              Replaced and cancelled entries are left in the heap, and discarded when they reach the top.
+
+            #waitForDue# sleeps on a condition variable until the earliest entry is due, or until #wake# is called
+              (like from the SIGTERM or SIGUSR1 handlers), so nothing waits on a fixed sleep.
+
+            All methods are thread-safe.
+    '''
+
+    def __init__(self):
+        # Heap of (due time, sequence, programName, task). The sequence number keeps ordering stable, and avoids comparing names.
+        self.heap = []
+        # (programName, task) -> due time, for every live entry
+        self.entries = {}
+
+        self.sequence = 0
+        self.woken = False
+
+        # RLock, so that #wake# may be called from a signal handler which interrupts this same thread within a scheduler method
+        self.condition = threading.Condition(threading.RLock())
+
+    def schedule(self, programName, task, when):
+        '''
+            schedule - Schedule a task for a program, replacing any existing due time for the same task.
+
+            @param programName <str> - Name of program
+            @param task <str> - One of the TASK_* constants
+            @param when <float> - Epoch time the task is due
+        '''
+        key = (programName, task)
+        with self.condition:
+            self.entries[key] = when
+            self.sequence += 1
+            heapq.heappush(self.heap, (when, self.sequence, programName, task))
+
+            # Let a waiter recalculate its timeout, as this may be sooner than what it is sleeping until.
+            self.condition.notify_all()
+
+    def scheduleIn(self, programName, task, delay):
+        '''
+            scheduleIn - Schedule a task for a program #delay# seconds from now. See #schedule#
+
+            @param programName <str> - Name of program
+            @param task <str> - One of the TASK_* constants
+            @param delay <float> - Number of seconds from now
+        '''
+        self.schedule(programName, task, time.time() + delay)
+
+    def cancel(self, programName, task=None):
+        '''
+            cancel - Cancel a scheduled task for a program.
+
+            @param programName <str> - Name of program
+            @param task <str/None> - One of the TASK_* constants, or None to cancel all tasks for this program.
+        '''
+        with self.condition:
+            if task is not None:
+                self.entries.pop( (programName, task), None )
+                return
+
+            for key in list(self.entries.keys()):
+                if key[0] == programName:
+                    del self.entries[key]
+
+    def getDueTime(self, programName, task):
+        '''
+            getDueTime - Get when a task is scheduled for a program
+
+            @param programName <str> - Name of program
+            @param task <str> - One of the TASK_* constants
+
+            @return <float/None> - Epoch time it is due, or None if not scheduled.
+        '''
+        with self.condition:
+            return self.entries.get( (programName, task), None )
+
+    def getScheduledNames(self):
+        '''
+            getScheduledNames - Get the names of all programs which have at least one task scheduled
+
+            @return set<str> - Program names
+        '''
+        with self.condition:
+            return set([key[0] for key in self.entries.keys()])
+
+    def wake(self):
+        '''
+            wake - Cause a current (or the next) #waitForDue# to return immediately, even if nothing is due.
+        '''
+        with self.condition:
+            self.woken = True
+            self.condition.notify_all()
+
+    def _discardStale(self):
+        heap = self.heap
+        entries = self.entries
+        while heap:
+            (when, sequence, programName, task) = heap[0]
+            if entries.get( (programName, task), None) == when:
+                return
+            heapq.heappop(heap)
+
+    def _popDue(self, now):
+        due = []
+        heap = self.heap
+        entries = self.entries
+        cutoff = now + BATCH_WINDOW
+
+        self._discardStale()
+        while heap and heap[0][0] <= cutoff:
+            (when, sequence, programName, task) = heapq.heappop(heap)
+            key = (programName, task)
+            if entries.get(key, None) != when:
+                # Replaced or cancelled
+                continue
+            del entries[key]
+            due.append(key)
+
+        return due
+
+    def waitForDue(self, maxWait=None):
+        '''
+            waitForDue - Block until at least one task is due, #wake# is called, or #maxWait# seconds pass.
+
+                Returned tasks are removed from the schedule, so the caller must schedule the next run of each itself.
+
+            @param maxWait <float/None> - Max number of seconds to wait, or None to wait only on due tasks and #wake#.
+
+            @return list<tuple> - List of (programName, task) which are due, in due order. May be empty if woken or #maxWait# passed.
+        '''
+        if maxWait is not None:
+            deadline = time.time() + maxWait
+        else:
+            deadline = None
+
+        with self.condition:
+            while True:
+                now = time.time()
+                due = self._popDue(now)
+                if due or self.woken or (deadline is not None and now >= deadline):
+                    self.woken = False
+                    return due
+
+                if self.heap:
+                    timeout = self.heap[0][0] - now
+                else:
+                    timeout = MAX_WAIT
+
+                if deadline is not None:
+                    timeout = min(timeout, deadline - now)
+
+                self.condition.wait(max(min(timeout, MAX_WAIT), 0))
+
+    def __len__(self):
+        with self.condition:
+            return len(self.entries)
+
+
+# vim:set ts=4 shiftwidth=4 softtabstop=4 expandtab :
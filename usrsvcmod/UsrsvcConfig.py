@@ -19,16 +19,90 @@
 
 # vim:set ts=4 shiftwidth=4 softtabstop=4 expandtab :
 
-import copy
-import os
 import glob
+import hashlib
+import io
+import os
+import sys
 
-from configobj import ConfigObj
-
+from . import __version__
 from .MainConfig import MainConfig
 from .ProgramConfig import ProgramConfig
+from .MonitoringConfig import MonitoringConfig
+from .ProctitleMatcher import ProctitleMatcher
+
+__all__ = ('UsrsvcConfig', 'getConfigCachePath')
+
+# Bump whenever the layout of the config cache, or of anything pickled within it (like ProgramConfig), changes.
+#  The usrsvc version and the options of each config class (see _getConfigSchema) are checked as well, so a cache written by
+#  another version is never loaded even if this is forgotten.
+CONFIG_CACHE_VERSION = 3
+
+
+def _getConfigSchema():
+    '''
+        _getConfigSchema - Get the options of every config class pickled in the config cache, as the names of their __init__ arguments.
+
+        @return tuple<tuple<str, tuple<str>>> - (class name, option names) of each class
+    '''
+    schema = []
+    for configClass in (MainConfig, ProgramConfig, MonitoringConfig):
+        code = configClass.__init__.__code__
+        schema.append( (configClass.__name__, tuple(code.co_varnames[:code.co_argcount])) )
+    return tuple(schema)
+
+
+def getConfigCachePath(uid=None):
+    '''
+        getConfigCachePath - Get the path of the compiled config cache for a user.
+
+        @param uid <int/None> - uid, or None for current user
+
+        @return <str> - Path
+    '''
+    if uid is None:
+        uid = os.getuid()
+    return os.environ.get('HOME', '/tmp') + '/.%d_usrsvc.cfgcache' %(uid, )
+
+
+class _ConfigFileCacheEntry(object):
+    '''
+        _ConfigFileCacheEntry - The parsed contents of a single config file, and what we need to tell if it changed.
+    '''
+
+    def __init__(self, statKey, digest, data):
+        # (mtime, size, inode) when last read
+        self.statKey = statKey
+        # sha1 of the contents
+        self.digest = digest
+        # The parsed ConfigObj. Must never be modified, as it is shared between config generations.
+        self.data = data
+
+
+def _getStatKey(fname):
+    st = os.stat(fname)
+    return (st.st_mtime, st.st_size, st.st_ino)
+
+
+def _mergeDefaults(defaultsItem, item):
+    '''
+        _mergeDefaults - Shallow merge a Program section over its DefaultSettings section, without modifying either.
+
+            The "Env" and "Monitoring" subsections are merged key-by-key, everything else the Program section overrides.
+
+        @return <dict> - Merged options
+    '''
+    merged = dict(defaultsItem)
+    for key, value in item.items():
+        if key in ('Env', 'Monitoring') and key in defaultsItem:
+            subsection = dict(defaultsItem[key])
+            subsection.update(value)
+            merged[key] = subsection
+        else:
+            merged[key] = value
+
+    return merged
 
-__all__ = ('UsrsvcConfig', )
 
 class UsrsvcConfig(object):
     '''
@@ -43,19 +117,74 @@ class UsrsvcConfig(object):
 
         self.mainConfig = None
         self.programConfigs = {}
+        self.proctitleMatcher = None
+
+        # filename -> _ConfigFileCacheEntry
+        self.fileCache = {}
+        # programName -> merged options the ProgramConfig was created from
+        self.programOptions = {}
+
+        # When loaded from the config cache, programName -> pickled ProgramConfig, for programs not yet requested.
+        self.pickledProgramConfigs = {}
+        # (path, (mtime, size, inode)) of config_dir when parsed
+        self.configDirStatKey = None
 
-    def parse(self):
+    def _readConfigFile(self, fname, previousFileCache):
+        '''
+            _readConfigFile - Get the parsed contents of a config file, reusing the previous parse if it has not changed.
+
+                Unchanged mtime/size/inode means no read at all. Otherwise the contents are read and hashed, and only parsed if the hash differs.
+        '''
+        statKey = _getStatKey(fname)
+        cacheEntry = previousFileCache.get(fname, None)
+        if cacheEntry is not None and cacheEntry.statKey == statKey:
+            self.fileCache[fname] = cacheEntry
+            return cacheEntry.data
+
+        with open(fname, 'rb') as f:
+            contents = f.read()
+        digest = hashlib.sha1(contents).hexdigest()
+
+        if cacheEntry is not None and cacheEntry.digest == digest:
+            # Touched, but not changed
+            self.fileCache[fname] = _ConfigFileCacheEntry(statKey, digest, cacheEntry.data)
+            return cacheEntry.data
+
+        # Only imported when we actually have something to parse, which the usrsvc client often does not.
+        from configobj import ConfigObj, ConfigObjError
+
+        try:
+            data = ConfigObj(io.BytesIO(contents))
+        except ConfigObjError as e:
+            # Report syntax errors like any other config error, so a bad (or half-written) file never takes down a reload.
+            raise ValueError('Cannot parse "%s": %s' %(fname, str(e)))
+        self.fileCache[fname] = _ConfigFileCacheEntry(statKey, digest, data)
+        return data
+
+    def parse(self, previousConfig=None):
         '''
             parse - Parse the config data.
+
+            @param previousConfig <UsrsvcConfig/None> - If provided (like on a reread), files which have not changed since
+                #previousConfig# was parsed are not parsed again, and any program whose options did not change keeps the same
+                ProgramConfig object. Use #getProgramChanges# to find what changed.
         '''
         if not os.path.exists(self.mainConfigFile):
             raise ValueError('File does not exist: %s' %(self.mainConfigFile,))
 
+        if previousConfig is not None:
+            previousFileCache = previousConfig.fileCache
+            previousProgramConfigs = previousConfig.programConfigs
+            previousProgramOptions = previousConfig.programOptions
+        else:
+            previousFileCache = previousProgramConfigs = previousProgramOptions = {}
+
         self.datas = []
         self.filenames = [self.mainConfigFile]
+        self.fileCache = {}
 
         # Process main config
-        mainData = ConfigObj(self.mainConfigFile)
+        mainData = self._readConfigFile(self.mainConfigFile, previousFileCache)
         self.datas.append(mainData)
 
         if 'Main' not in mainData:
@@ -68,9 +197,14 @@ class UsrsvcConfig(object):
         # Get additional configs, read all data.
         programConfigDir =  self.mainConfig.getProgramConfigDir()
         if programConfigDir:
+            # Stat before listing, so anything added after is seen as a change by the config cache
+            try:
+                self.configDirStatKey = (programConfigDir, _getStatKey(programConfigDir))
+            except OSError:
+                self.configDirStatKey = (programConfigDir, None)
             programConfigFiles = glob.glob(programConfigDir + '/*.cfg')
             for fname in programConfigFiles:
-                data = ConfigObj(fname)
+                data = self._readConfigFile(fname, previousFileCache)
                 self.datas.append(data)
                 self.filenames.append(fname)
 
@@ -89,6 +223,8 @@ class UsrsvcConfig(object):
 
                     self.defaultSettings[name] = item
 
+        self.programConfigs = {}
+        self.programOptions = {}
         for i in range(len(self.datas)):
             data = self.datas[i]
             fname = self.filenames[i]
@@ -100,23 +236,139 @@ class UsrsvcConfig(object):
                         defaultName = item['defaults']
                         if defaultName not in self.defaultSettings:
                             raise ValueError('Program "%s" in file "%s" uses a "defaults" of "%s", but no such DefaultSettings section exists in read configuration files!' %( name, fname, defaultName))
-                        item2 = self.defaultSettings[defaultName]
-                        item2 = copy.deepcopy(item2)
-                        # Merge subsections if present
-                        if 'Env' in item2 and 'Env' in item:
-                            item2['Env'].update(item['Env'])
-                            item['Env'] = item2['Env']
-                            del item2['Env']
-                        if 'Monitoring' in item2 and 'Monitoring' in item:
-                            item2['Monitoring'].update(item['Monitoring'])
-                            item['Monitoring'] = item2['Monitoring']
-                            del item2['Monitoring']
+                        item = _mergeDefaults(self.defaultSettings[defaultName], item)
+                    else:
+                        item = dict(item)
+
+                    if name in previousProgramConfigs and previousProgramOptions.get(name, None) == item:
+                        # Unchanged, keep the same object (and anything keyed off of it)
+                        self.programConfigs[name] = previousProgramConfigs[name]
+                    else:
+                        self.programConfigs[name] = ProgramConfig(name, **item)
+                    self.programOptions[name] = item
+
+        self.proctitleMatcher = ProctitleMatcher(self.programConfigs)
+
+    def writeCache(self, cachePath=None):
+        '''
+            writeCache - Write this (parsed) config to the compiled config cache, for #loadFromCache# to use.
+
+                Each ProgramConfig is pickled separately, so a loader only unpickles the programs it asks for.
+
+            @param cachePath <str/None> - Path to write, or None for getConfigCachePath()
+
+            @return <bool> - True if written. Errors are not raised, as the cache is just an optimization.
+        '''
+        import pickle
+        if cachePath is None:
+            cachePath = getConfigCachePath()
+
+        tmpPath = '%s.%d.tmp' %(cachePath, os.getpid())
+        try:
+            cacheData = {
+                'version' : CONFIG_CACHE_VERSION,
+                'usrsvcVersion' : __version__,
+                'schema' : _getConfigSchema(),
+                'python' : tuple(sys.version_info[:2]),
+                'mainConfigFile' : self.mainConfigFile,
+                'files' : dict( [ (fname, self.fileCache[fname].statKey) for fname in self.filenames ] ),
+                'configDir' : self.configDirStatKey,
+                'mainConfig' : self.mainConfig,
+                'programs' : dict( [ (programName, pickle.dumps(programConfig, pickle.HIGHEST_PROTOCOL)) for (programName, programConfig) in self.getProgramConfigs().items() ] ),
+            }
+
+            fd = os.open(tmpPath, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with os.fdopen(fd, 'wb') as f:
+                pickle.dump(cacheData, f, pickle.HIGHEST_PROTOCOL)
+            os.rename(tmpPath, cachePath)
+        except Exception:
+            try:
+                os.unlink(tmpPath)
+            except:
+                pass
+            return False
+
+        return True
+
+    @classmethod
+    def loadFromCache(cls, mainConfigFile, cachePath=None):
+        '''
+            loadFromCache - Load a config from the compiled config cache, if it is still valid.
+
+                The cache is valid if it was written by this version of usrsvc (and python), with the same config options, for the same main config file,
+                  and every config file (and config_dir itself) has the same mtime, size, and inode as when it was parsed.
 
-                        item2.update(item)
-                        item = item2
+                ProgramConfigs are unpickled when first requested.
 
-                    self.programConfigs[name] = ProgramConfig(name, **item)
+            @param mainConfigFile <str> - Path to main config
+            @param cachePath <str/None> - Path of cache, or None for getConfigCachePath()
 
+            @return <UsrsvcConfig/None> - The config, or None if there is no valid cache (parse instead).
+        '''
+        import pickle
+        if cachePath is None:
+            cachePath = getConfigCachePath()
+
+        try:
+            with open(cachePath, 'rb') as f:
+                # Never unpickle something another user could have written
+                if os.fstat(f.fileno()).st_uid != os.getuid():
+                    return None
+                cacheData = pickle.load(f)
+
+            if cacheData['version'] != CONFIG_CACHE_VERSION or cacheData['python'] != tuple(sys.version_info[:2]) or cacheData['mainConfigFile'] != mainConfigFile:
+                return None
+
+            # Pickled by a usrsvc with other options would give configs missing attributes
+            if cacheData.get('usrsvcVersion', None) != __version__ or cacheData.get('schema', None) != _getConfigSchema():
+                return None
+
+            for fname, statKey in cacheData['files'].items():
+                if _getStatKey(fname) != statKey:
+                    return None
+
+            if cacheData['configDir'] is not None:
+                (configDir, dirStatKey) = cacheData['configDir']
+                if dirStatKey is None or _getStatKey(configDir) != dirStatKey:
+                    return None
+        except Exception:
+            return None
+
+        config = cls(mainConfigFile)
+        config.mainConfig = cacheData['mainConfig']
+        config.pickledProgramConfigs = cacheData['programs']
+        config.filenames = list(cacheData['files'].keys())
+        config.configDirStatKey = cacheData['configDir']
+
+        return config
+
+    def getProgramChanges(self, otherConfig):
+        '''
+            getProgramChanges - Compare the programs in this config against those in another (like the config before a reread).
+
+                A program is "changed" if it is not the same ProgramConfig object, see #parse#.
+
+            @param otherConfig <UsrsvcConfig/None> - The other config. If None, every program is "added".
+
+            @return tuple( set<str>, set<str>, set<str> ) - Names of programs (added, removed, changed) in this config compared to #otherConfig#
+        '''
+        programConfigs = self.getProgramConfigs()
+        if otherConfig is None:
+            return (set(programConfigs.keys()), set(), set())
+
+        otherProgramConfigs = otherConfig.getProgramConfigs()
+
+        added = set()
+        changed = set()
+        for programName, programConfig in programConfigs.items():
+            if programName not in otherProgramConfigs:
+                added.add(programName)
+            elif otherProgramConfigs[programName] is not programConfig:
+                changed.add(programName)
+
+        removed = set([programName for programName in otherProgramConfigs.keys() if programName not in programConfigs])
+
+        return (added, removed, changed)
 
 
     def getProgramConfig(self, programName):
@@ -129,6 +381,10 @@ class UsrsvcConfig(object):
 
             @return ProgramConfig of the program
         '''
+        if programName not in self.programConfigs and programName in self.pickledProgramConfigs:
+            import pickle
+            self.programConfigs[programName] = pickle.loads(self.pickledProgramConfigs.pop(programName))
+
         return self.programConfigs[programName]
 
     def getProgramConfigs(self):
@@ -137,7 +393,21 @@ class UsrsvcConfig(object):
 
             @return <dict> - program name <str> to ProgramConfig
         '''
+        if self.pickledProgramConfigs:
+            for programName in list(self.pickledProgramConfigs.keys()):
+                self.getProgramConfig(programName)
+
         return self.programConfigs
 
+    def getProctitleMatcher(self):
+        '''
+            getProctitleMatcher - Get the combined proctitle matcher for all programs in this config.
+
+            @return <ProctitleMatcher>
+        '''
+        if self.proctitleMatcher is None:
+            self.proctitleMatcher = ProctitleMatcher(self.getProgramConfigs())
+        return self.proctitleMatcher
+
 
 # vim:set ts=4 shiftwidth=4 softtabstop=4 expandtab :
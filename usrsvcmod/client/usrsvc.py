@@ -21,8 +21,8 @@
 import os
 import copy
 import signal
-import multiprocessing
 import sys
+import time
 import traceback
 
 from NamedAtomicLock import NamedAtomicLock
@@ -30,39 +30,151 @@ from NamedAtomicLock import NamedAtomicLock
 from usrsvcmod.UsrsvcConfig import UsrsvcConfig
 from usrsvcmod.Program import Program
 from usrsvcmod.ProgramActions import getRunningProgram
+from usrsvcmod.ProcessTable import ProcessTable
+from usrsvcmod.ControlSocket import ControlClient
+from usrsvcmod.LogIndex import LogIndex, readLogRange, parseLogTime, RECORD_RESTART
+from usrsvcmod.debug import isDebugEnabled
 from usrsvcmod.logging import logMsg, logErr
 from usrsvcmod.constants import ReturnCodes
 
 class Usrsvc(object):
 
-    def __init__(self, config=None):
-        if not config:
-            config = UsrsvcConfig(os.environ['HOME'] + '/usrsvc.cfg')
-            try:
-                config.parse()
-            except ValueError as e:
-                sys.stderr.write('ERROR in config: %s\n'  %(str(e),))
-                raise e
+    def __init__(self, config=None, useDaemon=None):
+        '''
+            @param config <UsrsvcConfig/None> - The config. If None, it is parsed from $HOME/usrsvc.cfg (only once needed, if a usrsvcd may be running to answer instead).
+            @param useDaemon <bool/None> - If True, actions are sent to a running usrsvcd over its control socket when possible, falling back to
+                performing them directly. Default (None) is True only when #config# is not provided, as usrsvcd passes its own config.
+        '''
+        if useDaemon is None:
+            useDaemon = not config
+
+        self.controlClient = None
+        if useDaemon:
+            controlClient = ControlClient()
+            if controlClient.isAvailable():
+                self.controlClient = controlClient
+
+        if not config and self.controlClient is None:
+            # Nobody else to ask, so report any config errors right away.
+            config = self._parseConfig()
+
+        self._config = config
+
+    @staticmethod
+    def _parseConfig():
+        mainConfigFile = os.environ['HOME'] + '/usrsvc.cfg'
+
+        # Use the compiled config cache, unless any config file has changed since it was written.
+        config = UsrsvcConfig.loadFromCache(mainConfigFile)
+        if config is not None:
+            return config
+
+        config = UsrsvcConfig(mainConfigFile)
+        try:
+            config.parse()
+        except ValueError as e:
+            sys.stderr.write('ERROR in config: %s\n'  %(str(e),))
+            raise e
+
+        config.writeCache()
+
+        return config
+
+    @property
+    def config(self):
+        '''
+            config - The UsrsvcConfig, parsed on first access if not provided.
+        '''
+        if self._config is None:
+            self._config = self._parseConfig()
+        return self._config
+
+    def _requestFromDaemon(self, action, programName=None):
+        '''
+            _requestFromDaemon - Send a request to usrsvcd over the control socket.
+
+            @return <dict/None> - The response, or None if usrsvcd could not be reached (and we should act directly).
+        '''
+        controlClient = self.controlClient
+        if controlClient is None:
+            return None
+
+        try:
+            return controlClient.request(action, programName)
+        except Exception as e:
+            if isDebugEnabled():
+                logErr('DEBUG: Cannot reach usrsvcd ( %s ), acting directly: %s\n' %(controlClient.path, str(e)))
+            # Don't try again for the rest of this run
+            self.controlClient = None
+            return None
+
+    def _doActionViaDaemon(self, action, programName):
+        '''
+            _doActionViaDaemon - Have the running usrsvcd perform an action.
+
+            @return <int/None> - The ReturnCodes value, or None if usrsvcd could not be reached.
+        '''
+        response = self._requestFromDaemon(action, programName)
+        if response is None:
+            return None
+
+        ret = response['returnCode']
+        if ret == ReturnCodes.PROGRAM_UNDEFINED:
+            # Likely added to config since usrsvcd last read it. Act directly, from the config as it is now.
+            if isDebugEnabled():
+                logErr('DEBUG: usrsvcd does not know %s, acting directly.\n' %(programName, ))
+            return None
+
+        if response.get('error', None):
+            logErr('%s\n' %(response['error'], ))
+            return ret
+
+        prog = response.get('program', None)
+        if action == 'status':
+            if ret == ReturnCodes.SUCCESS:
+                logMsg('%s is running:\n\n%s\n' %(programName, str(prog)))
+            else:
+                logErr('%s is NOT running\n' %(programName,))
+        elif action == 'stop':
+            if ret == ReturnCodes.SUCCESS:
+                logMsg('%s is stopped.\n' %(programName, ))
+            else:
+                logErr('Failed to stop %s! Err=%d (%s)\n' %(programName, ret, ReturnCodes.returnCodeToString(ret)))
+        else:
+            if ret == ReturnCodes.SUCCESS:
+                logMsg('Started %s:\n\n%s\n' %(programName, str(prog)))
+            else:
+                logErr('Failed to %s %s! Err=%d (%s)\n' %(action, programName, ret, ReturnCodes.returnCodeToString(ret)))
+
+        return ret
 
-        self.config = config
+    def _getProgramNames(self):
+        '''
+            _getProgramNames - Get the names of all configured programs, from config as it is now (usually the compiled cache).
+
+                Not from usrsvcd, which may not have reread config since programs were added or removed.
+        '''
+        return list(self.config.getProgramConfigs().keys())
 
     def call(self, args):
         argv = args[:]
         if argv[0] != 'usrsvc':
             argv = ['usrsvc'] + args
 
+        import multiprocessing
         process = multiprocessing.Process(target=self._call_main, args=(argv,))
         process.start()
 
         return process
 
     def _call_main(self, argv):
+        # Don't carry over any SIGCHLD handler from usrsvcd (subreaper mode)
+        signal.signal(signal.SIGCHLD, signal.SIG_DFL)
         sys.exit(self.main(argv))
 
     def doActionParallel(self, action):
-        config = self.config
-
-        allProgramNames = config.getProgramConfigs().keys()
+        import multiprocessing
+        allProgramNames = self._getProgramNames()
         processes = {}
         for programName in allProgramNames:
             process = multiprocessing.Process(target=self.doActionAndExit, args=([action, programName], ))
@@ -82,16 +194,18 @@ class Usrsvc(object):
 
         return ret
 
-    def doAction(self, args):
-        config = self.config
-
+    def doAction(self, args, processTable=None):
         action = args[0]
         if args[1] == 'all':
             # Serial start, parallel is handled elsewhere
             ret = 0
-            for programName in config.getProgramConfigs().keys():
+            allProgramNames = self._getProgramNames()
+            if action == 'status' and self.controlClient is None:
+                # Status does not modify anything, so every program can be checked against one snapshot.
+                processTable = ProcessTable.createSnapshot()
+            for programName in allProgramNames:
                 try:
-                    exitCode = self.doAction([action, programName])
+                    exitCode = self.doAction([action, programName], processTable)
                 except Exception as e:
                     logErr('Unexpected exception (%s) trying to %s %s: %s\n' %(str(e.__class__.__name__), action, programName, str(e)))
                     traceback.print_exc()
@@ -103,12 +217,16 @@ class Usrsvc(object):
         
         programName = args[1]
 
-        lock = NamedAtomicLock('.lock_usrsvc' + programName, maxLockAge=30)
-        if not lock.acquire(31):
-            logErr('Cannot acquire lock for %s. Is something else looping trying to access it? Try the command again.\n' %(programName,))
+        if processTable is None:
+            ret = self._doActionViaDaemon(action, programName)
+            if ret is not None:
+                return ret
+
+        lock = self._acquireProgramLock(programName)
+        if lock is None:
             return ReturnCodes.TRY_AGAIN
         try:
-            ret = self._doAction(args)
+            ret = self._doAction(args, processTable)
         except Exception as e:
             logErr('Got exception %s for %s %s\n' %(str(e), programName, str(args)) )
             lock.release()
@@ -117,7 +235,37 @@ class Usrsvc(object):
         lock.release()
         return ret
 
-    def _doAction(self, args):
+    @staticmethod
+    def _acquireProgramLock(programName):
+        lock = NamedAtomicLock('.lock_usrsvc' + programName, maxLockAge=30)
+        if not lock.acquire(31):
+            logErr('Cannot acquire lock for %s. Is something else looping trying to access it? Try the command again.\n' %(programName,))
+            return None
+        return lock
+
+    def doLockedProgramAction(self, action, programConfig):
+        '''
+            doLockedProgramAction - Perform an action on a program, given its config, holding the program's lock (like #doAction#).
+
+                This does not require the program to be in self.config, so usrsvcd can pass the config as of the time of the request.
+
+            @param action <str> - start/stop/restart/status
+            @param programConfig <ProgramConfig> - The program's config
+
+            @return <int> - A ReturnCodes value
+        '''
+        lock = self._acquireProgramLock(programConfig.name)
+        if lock is None:
+            return ReturnCodes.TRY_AGAIN
+        try:
+            return self.doProgramAction(action, programConfig)
+        except Exception as e:
+            logErr('Got exception %s for %s %s\n' %(str(e), programConfig.name, action) )
+            raise e
+        finally:
+            lock.release()
+
+    def _doAction(self, args, processTable=None):
         config = self.config
 
         action = args[0]
@@ -129,6 +277,20 @@ class Usrsvc(object):
             logErr('No such program: %s\n' %(programName,))
             return ReturnCodes.PROGRAM_UNDEFINED
 
+        return self.doProgramAction(action, programConfig, processTable)
+
+    def doProgramAction(self, action, programConfig, processTable=None):
+        '''
+            doProgramAction - Perform an action on a program, given its config. The caller must hold the program's lock.
+
+            @param action <str> - start/stop/restart/status
+            @param programConfig <ProgramConfig> - The program's config
+            @param processTable <None/ProcessTable> - If provided, use this snapshot for "status"
+
+            @return <int> - A ReturnCodes value
+        '''
+        programName = programConfig.name
+
         if programConfig.enabled is False and action not in ('stop', 'status'):
             logErr('Program %s is currently disabled in config. Only the "stop" and "status" actions are supported on disabled programs.\n' %(programName,))
             return ReturnCodes.PROGRAM_DISABLED
@@ -167,10 +329,10 @@ class Usrsvc(object):
                 logMsg('%s was not running.\n' %(programName,))
             return ReturnCodes.SUCCESS
         elif action == 'restart':
-            self._doAction(['stop'] + args[1:])
-            return self._doAction(['start'] + args[1:])
+            self.doProgramAction('stop', programConfig)
+            return self.doProgramAction('start', programConfig)
         elif action == 'status':
-            prog = getRunningProgram(programConfig)
+            prog = getRunningProgram(programConfig, processTable)
             if prog:
                 logMsg('%s is running:\n\n%s\n' %(programName, str(prog.__dict__)))
                 return ReturnCodes.SUCCESS
@@ -182,6 +344,117 @@ class Usrsvc(object):
             return ReturnCodes.INVALID_ACTION
      
 
+    def doList(self):
+        '''
+            doList - Print all configured programs, and the pid they were last seen running as (if usrsvcd is running)
+        '''
+        response = self._requestFromDaemon('list')
+        if response is not None and response['returnCode'] == ReturnCodes.SUCCESS:
+            for program in response['programs']:
+                if program['enabled'] is False:
+                    state = 'disabled'
+                elif program['pid']:
+                    state = 'pid=%d' %(program['pid'], )
+                else:
+                    state = 'not running'
+                sys.stdout.write('%s\t%s\n' %(program['name'], state))
+            return ReturnCodes.SUCCESS
+
+        for programName, programConfig in sorted(self.config.getProgramConfigs().items()):
+            if programConfig.enabled is False:
+                sys.stdout.write('%s\tdisabled\n' %(programName, ))
+            else:
+                sys.stdout.write('%s\n' %(programName, ))
+        return ReturnCodes.SUCCESS
+
+    def doStats(self):
+        '''
+            doStats - Print statistics from the running usrsvcd
+        '''
+        response = self._requestFromDaemon('stats')
+        if response is None:
+            logErr('usrsvcd is not running (or cannot be reached), no stats available.\n')
+            return ReturnCodes.GENERAL_FAILURE
+
+        for key, value in sorted(response['stats'].items()):
+            sys.stdout.write('%s: %s\n' %(key, str(value)))
+        return response['returnCode']
+
+    def doLogs(self, programName, args):
+        '''
+            doLogs - Print the part of a program's log written in a range of time, found through the log's index.
+
+            @param programName <str> - Name of program
+            @param args list<str> - Options: --stderr, --since=TIME, --until=TIME, --around-restart[=N], --window=SECONDS
+
+            @return <int> - A ReturnCodes value
+        '''
+        useStderr = False
+        since = None
+        until = None
+        aroundRestart = None
+        window = 60.0
+
+        try:
+            for arg in args:
+                if arg == '--stderr':
+                    useStderr = True
+                elif arg.startswith('--since='):
+                    since = parseLogTime(arg[len('--since='):])
+                elif arg.startswith('--until='):
+                    until = parseLogTime(arg[len('--until='):])
+                elif arg == '--around-restart':
+                    aroundRestart = 1
+                elif arg.startswith('--around-restart='):
+                    aroundRestart = int(arg[len('--around-restart='):])
+                    if aroundRestart < 1:
+                        raise ValueError('--around-restart must be at least 1 (the most recent restart).')
+                elif arg.startswith('--window='):
+                    window = float(arg[len('--window='):])
+                else:
+                    raise ValueError('Unknown option: %s' %(arg, ))
+        except ValueError as e:
+            logErr('%s\n' %(str(e), ))
+            self.printUsage()
+            return ReturnCodes.GENERAL_FAILURE
+
+        try:
+            programConfig = self.config.getProgramConfig(programName)
+        except KeyError:
+            logErr('No such program: %s\n' %(programName,))
+            return ReturnCodes.PROGRAM_UNDEFINED
+
+        logPath = useStderr and programConfig.stderr or programConfig.stdout
+
+        if aroundRestart is not None:
+            logIndex = LogIndex(logPath)
+            try:
+                restarts = logIndex.getEvents(RECORD_RESTART, aroundRestart)
+            finally:
+                logIndex.close()
+            if len(restarts) < aroundRestart:
+                logErr('Only %d restarts of %s are recorded in the index of %s.\n' %(len(restarts), programName, logPath))
+                return ReturnCodes.GENERAL_FAILURE
+
+            restartTime = restarts[-1][0]
+            sys.stderr.write('== %s restarted at %s, showing %s from %g seconds before to %g seconds after ==\n' %(programName, time.ctime(restartTime), logPath, window, window))
+            since = restartTime - window
+            until = restartTime + window
+
+        if hasattr(sys.stdout, 'buffer'):
+            outFile = sys.stdout.buffer
+        else:
+            outFile = sys.stdout
+
+        try:
+            readLogRange(logPath, outFile, since, until)
+            outFile.flush()
+        except (IOError, OSError) as e:
+            logErr('Cannot read %s: %s\n' %(logPath, str(e)))
+            return ReturnCodes.GENERAL_FAILURE
+
+        return ReturnCodes.SUCCESS
+
     def doActionAndExit(self, args):
         sys.exit(self.doAction(args))
 
@@ -192,6 +465,17 @@ class Usrsvc(object):
  Performs the requested action on the given program name.
 
  "all" can be used in place of "program name" to perform the given task on all configured programs. (see Parallel below)
+
+       usrsvc [list/stats]
+ "list" lists all configured programs. "stats" shows statistics from the running usrsvcd.
+
+       usrsvc logs [program name] (--stderr) (--since=TIME) (--until=TIME) (--around-restart(=N)) (--window=SECONDS)
+ Prints the part of a program's stdout (or stderr) log written in a range of time, found using the log's index.
+   TIME is seconds since epoch, "YYYY-mm-dd HH:MM[:SS]", "HH:MM[:SS]" (today), or a time ago, like "-10m", "-2h".
+   --around-restart shows from --window (default 60) seconds before to after the most recent restart
+   by usrsvcd (or the Nth most recent, with --around-restart=N).
+
+ When usrsvcd is running, actions are sent to it over its control socket, and otherwise performed directly.
  
 usrsvc is the tool for performing specific actions on services, usrsvcd is the related daemon for autorestart/monitoring, etc.
 
@@ -227,6 +511,12 @@ usrsvc is the tool for performing specific actions on services, usrsvcd is the r
 
             if len(argv) == 4 and argv[1] in ('start', 'stop', 'restart') and argv[2] == 'all' and (argv[3] == '--parallel' or argv[3] == '-P'):
                 parallelAll = True
+            elif len(argv) == 2 and argv[1] == 'list':
+                return self.doList()
+            elif len(argv) == 2 and argv[1] == 'stats':
+                return self.doStats()
+            elif len(argv) >= 3 and argv[1] == 'logs':
+                return self.doLogs(argv[2], argv[3:])
             elif len(argv) != 3:
                 logErr('Invalid number of arguments.\n')
                 self.printUsage()
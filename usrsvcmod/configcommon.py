@@ -20,7 +20,7 @@
 
 import re
 
-__all__ = ('getConfigValueBool', 'getConfigValueInt', 'getConfigValueFloat')
+__all__ = ('getConfigValueBool', 'getConfigValueInt', 'getConfigValueFloat', 'getConfigValueTimeWindow')
 
 # Following functions all name the value, and the config name.
 
@@ -72,5 +72,32 @@ def getConfigValueFloat(value, name=''):
         return float(value)
 
 
+TIME_WINDOW_RE = re.compile('^(?P<start_hour>[\d]{1,2}):(?P<start_minute>[\d]{2})[ ]*[-][ ]*(?P<end_hour>[\d]{1,2}):(?P<end_minute>[\d]{2})$')
+
+def getConfigValueTimeWindow(value, name=''):
+    '''
+        getConfigValueTimeWindow - Parse a daily window of local time, like "02:00-05:30". The end may be before the start, to span midnight.
+
+        @return <None/tuple> - None if empty, otherwise (start, end) in minutes after midnight.
+    '''
+    if value is None or type(value) == tuple:
+        return value
+    value = str(value).strip()
+    if not value:
+        return None
+
+    matchObj = TIME_WINDOW_RE.match(value)
+    if not matchObj:
+        raise ValueError('Invalid value for config parameter %s. Should be a time window like 02:00-05:30. Got %s' %(name, value))
+
+    groupDict = matchObj.groupdict()
+    start = int(groupDict['start_hour']) * 60 + int(groupDict['start_minute'])
+    end = int(groupDict['end_hour']) * 60 + int(groupDict['end_minute'])
+    if start >= 24 * 60 or end > 24 * 60 or int(groupDict['start_minute']) >= 60 or int(groupDict['end_minute']) >= 60:
+        raise ValueError('Invalid value for config parameter %s. Hours must be 0-23 and minutes 0-59. Got %s' %(name, value))
+
+    return (start, end)
+
+
         
 # vim:set ts=4 shiftwidth=4 softtabstop=4 expandtab :
@@ -19,30 +19,229 @@
 # vim:set ts=4 shiftwidth=4 softtabstop=4 expandtab :
 
 import datetime
+import os
 import sys
+import threading
+import time
 
-__all__ = ('logMsg', 'logErr')
+from collections import deque
+
+__all__ = ('logMsg', 'logErr', 'startAsyncLogging', 'stopAsyncLogging', 'flushLogs', 'getLogStats', 'logForkLock')
 
 # TODO: Notification system
 
+# Default max number of lines buffered by the async logger. Beyond this, lines are dropped (and counted).
+ASYNC_LOG_MAX_BUFFERED = 10000
+
+# (epoch second, ctime string) of the last timestamp formatted, so it is only formatted once per second.
+_lastCtime = (None, '')
+
+# Held by the async writer while it writes. Hold it around any fork made while async logging runs, so the child never
+#  starts with a stream lock held by a writer thread which does not exist in it.
+logForkLock = threading.Lock()
+
 def _getCtime():
-    return datetime.datetime.now().ctime()
+    global _lastCtime
+    now = int(time.time())
+    (lastSecond, lastCtime) = _lastCtime
+    if now != lastSecond:
+        lastCtime = datetime.datetime.fromtimestamp(now).ctime()
+        _lastCtime = (now, lastCtime)
+    return lastCtime
+
+
+class _AsyncLogWriter(object):
+    '''
+        _AsyncLogWriter - Queues log lines, and writes them from a dedicated thread, in batches, so logging never blocks
+          the thread which logs (like on a slow or full disk).
+
+            The streams are looked up (sys.stdout / sys.stderr) as each batch is written, so they may be replaced at any time.
+    '''
+
+    def __init__(self, maxBuffered):
+        self.maxBuffered = maxBuffered
+
+        # RLock, as a signal handler may log while the main thread is within #add#
+        self.condition = threading.Condition(threading.RLock())
+        # (isErr <bool>, line <str>)
+        self.queue = deque()
+        # Number of lines taken by the writer but not yet written
+        self.numWriting = 0
+
+        self.keepGoing = True
+        # Only the process which started the writer has the thread. Forked children log directly.
+        self.pid = os.getpid()
+
+        self.numWritten = 0
+        self.numDropped = 0
+        self.numDroppedReported = 0
+
+        self.thread = threading.Thread(target=self._writerMain)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def add(self, isErr, line):
+        with self.condition:
+            if len(self.queue) >= self.maxBuffered:
+                self.numDropped += 1
+                return
+            self.queue.append( (isErr, line) )
+            self.condition.notify()
+
+    def _writerMain(self):
+        while True:
+            with self.condition:
+                while not self.queue and self.keepGoing is True:
+                    self.condition.wait()
+                if not self.queue:
+                    return
+                items = list(self.queue)
+                self.queue.clear()
+                self.numWriting = len(items)
+
+                numDropped = self.numDropped - self.numDroppedReported
+                self.numDroppedReported = self.numDropped
+
+            if numDropped:
+                items.append( (True, "[%s] - Dropped %d log messages, as the log buffer was full.\n" %(_getCtime(), numDropped)) )
+
+            with logForkLock:
+                numWritten = self._writeBatch(items)
+
+            with self.condition:
+                self.numWriting = 0
+                self.numWritten += numWritten
+                self.numDropped += len(items) - numWritten
+                self.numDroppedReported += len(items) - numWritten
+                self.condition.notify_all()
+
+    @staticmethod
+    def _writeBatch(items):
+        # Write each run of lines to the same stream at once. Returns the number of lines written.
+        numWritten = 0
+        idx = 0
+        numItems = len(items)
+        while idx < numItems:
+            isErr = items[idx][0]
+            endIdx = idx + 1
+            while endIdx < numItems and items[endIdx][0] == isErr:
+                endIdx += 1
+            data = ''.join([line for (_isErr, line) in items[idx:endIdx]])
+
+            for attempt in (1, 2):
+                stream = sys.stderr if isErr else sys.stdout
+                try:
+                    stream.write(data)
+                    stream.flush()
+                    numWritten += endIdx - idx
+                    break
+                except ValueError:
+                    # Closed, as it was just replaced. Try the new one.
+                    continue
+                except Exception:
+                    # Like a full disk. Nothing we can log to.
+                    break
+
+            idx = endIdx
+
+        return numWritten
+
+    def flush(self, timeout):
+        # Wait until everything queued so far has been written, or #timeout# seconds
+        deadline = time.time() + timeout
+        with self.condition:
+            while self.queue or self.numWriting:
+                remaining = deadline - time.time()
+                if remaining <= 0 or not self.thread.is_alive():
+                    return False
+                self.condition.wait(remaining)
+        return True
+
+    def stop(self, timeout):
+        with self.condition:
+            self.keepGoing = False
+            self.condition.notify_all()
+        self.thread.join(timeout)
+
+
+global _asyncWriter
+_asyncWriter = None
+
+def startAsyncLogging(maxBuffered=ASYNC_LOG_MAX_BUFFERED):
+    '''
+        startAsyncLogging - From now on, #logMsg# and #logErr# queue their lines, and a background thread writes them.
+
+            If more than #maxBuffered# lines are waiting, further lines are dropped and counted (and the count is logged).
+              Processes forked after this log directly, as before.
+
+        @param maxBuffered <int> - Max number of lines waiting to be written
+    '''
+    global _asyncWriter
+    if _asyncWriter is None:
+        _asyncWriter = _AsyncLogWriter(maxBuffered)
+
+def stopAsyncLogging(timeout=5):
+    '''
+        stopAsyncLogging - Write anything queued (waiting up to #timeout# seconds), and go back to logging directly.
+
+        @param timeout <float> - Max seconds to wait
+    '''
+    global _asyncWriter
+    writer = _asyncWriter
+    if writer is not None and writer.pid == os.getpid():
+        _asyncWriter = None
+        writer.stop(timeout)
+
+def flushLogs(timeout=5):
+    '''
+        flushLogs - Wait until all lines logged so far have been written (like before replacing stdout/stderr)
+
+        @param timeout <float> - Max seconds to wait
+
+        @return <bool> - True if everything was written
+    '''
+    writer = _asyncWriter
+    if writer is None or writer.pid != os.getpid():
+        return True
+    return writer.flush(timeout)
+
+def getLogStats():
+    '''
+        getLogStats - Get counters of the async logger
+
+        @return <dict> - "buffered", "written", and "dropped" lines. Empty if async logging is not running.
+    '''
+    writer = _asyncWriter
+    if writer is None:
+        return {}
+    with writer.condition:
+        return {'buffered' : len(writer.queue) + writer.numWriting, 'written' : writer.numWritten, 'dropped' : writer.numDropped}
+
+
+def _log(isErr, msg, includeDate):
+    if includeDate is True:
+        msg = "[%s] - %s" %(_getCtime(), msg)
+
+    writer = _asyncWriter
+    if writer is not None and writer.pid == os.getpid():
+        writer.add(isErr, msg)
+        return
+
+    stream = sys.stderr if isErr else sys.stdout
+    stream.write(msg)
+    stream.flush()
 
 
 def logMsg(msg, includeDate=True):
     '''
         logMsg - log a message (stdout)
     '''
-    if includeDate is True:
-        sys.stdout.write("[%s] - %s" %(_getCtime(), msg))
-    sys.stdout.flush()
+    _log(False, msg, includeDate)
 
 def logErr(msg, includeDate=True):
     '''
         logErr - log an error (stderr)
     '''
-    if includeDate is True:
-        sys.stderr.write("[%s] - %s" %(_getCtime(), msg))
-    sys.stderr.flush()
+    _log(True, msg, includeDate)
 
 # vim:set ts=4 shiftwidth=4 softtabstop=4 expandtab :
@@ -13,41 +13,97 @@
     current website intended for distribution of usrsvc.
 
 
-    usrsvc mail function
+    usrsvc mail functions, and the transports mail is sent through ("sendmail" or "smtp")
 '''
 
 # vim:set ts=4 shiftwidth=4 softtabstop=4 expandtab :
 
+import socket
+import threading
+import time
+
 import subprocess2 as subprocess
 
 from .util import getUsername, getHostname
+from .Reaper import startWaitedChild, finishWaitedChild
 
-__all__ =  ('SendmailFailedException', 'sendmail' )
+__all__ =  ('SendmailFailedException', 'sendmail', 'getFromAddress', 'setFromAddress', 'buildMessage',
+    'MailTransport', 'SendmailTransport', 'SMTPTransport', 'createTransport', 'MAIL_TRANSPORTS',
+)
 
 SENDMAIL_TIMEOUT = 2
 
+# Seconds to wait on the SMTP server, for connecting and each command
+SMTP_TIMEOUT = 10
+
+# Seconds an idle SMTP connection is kept open for reuse. Servers commonly drop idle clients after a few minutes.
+SMTP_MAX_IDLE = 60
+
+# Values of mail_transport
+MAIL_TRANSPORTS = ('sendmail', 'smtp')
+
 class SendmailFailedException(Exception):
     pass
 
-def sendmail(sendmailPath, to, subject, body):
-    mailHeaders = ["To: " + to, "Subject: " + subject]
 
-    username = getUsername()
-    hostname = getHostname()
+global _FROM_ADDRESS
+_FROM_ADDRESS = None
+
+def getFromAddress():
+    '''
+        getFromAddress - Get the address mail is sent from, user@host. Resolved on first call, and then cached
+          (getHostname may do a slow fqdn lookup).
 
-    mailHeaders.append('From: %s@%s' %(username, hostname))
+        @return <str>
+    '''
+    global _FROM_ADDRESS
+    if _FROM_ADDRESS is None:
+        _FROM_ADDRESS = '%s@%s' %(getUsername(), getHostname())
+    return _FROM_ADDRESS
 
-    pipe = subprocess.Popen([sendmailPath, to], shell=False, stdin=subprocess.PIPE)
+def setFromAddress(fromAddress):
+    '''
+        setFromAddress - Set the address mail is sent from (like when username and hostname are already known)
+
+        @param fromAddress <str> - user@host
+    '''
+    global _FROM_ADDRESS
+    _FROM_ADDRESS = fromAddress
+
+
+def buildMessage(to, subject, body):
+    '''
+        buildMessage - Build the headers and body of a message
+
+        @param to <str> - Recipients
+        @param subject <str> - Subject
+        @param body <str> - Body
+
+        @return <bytes> - The message
+    '''
+    mailHeaders = ["To: " + to, "Subject: " + subject, 'From: %s' %(getFromAddress(), )]
 
-    pipe.stdin.write( ('\r\n'.join(mailHeaders)).encode('utf-8'))
-    pipe.stdin.write(b'\r\n\r\n')
     if bytes != str and type(body) == str:
         body = body.encode('utf-8')
 
-    pipe.stdin.write(body)
-    pipe.stdin.close()
+    return ('\r\n'.join(mailHeaders)).encode('utf-8') + b'\r\n\r\n' + body
+
+
+def sendmail(sendmailPath, to, subject, body):
+    # Not reaped by usrsvcd in subreaper mode while we wait on it, or a failure would look like a return code of 0
+    pipe = startWaitedChild([sendmailPath, to], shell=False, stdin=subprocess.PIPE)
+    try:
+        try:
+            pipe.stdin.write(buildMessage(to, subject, body))
+            pipe.stdin.close()
+        except (IOError, OSError):
+            # Exited without reading it all. Its return code says why.
+            pass
+
+        ret = pipe.waitOrTerminate(SENDMAIL_TIMEOUT, .05, 1)
+    finally:
+        finishWaitedChild(pipe)
 
-    ret = pipe.waitOrTerminate(SENDMAIL_TIMEOUT, .05, 1)
     if ret['actionTaken'] == subprocess.SUBPROCESS2_PROCESS_COMPLETED:
         if ret['returnCode'] == 0:
             return True
@@ -57,4 +113,157 @@ def sendmail(sendmailPath, to, subject, body):
         raise SendmailFailedException('Sendmail at %s failed to send email in %d seconds and had to be terminated. to=%s subject=%s' %(sendmailPath, SENDMAIL_TIMEOUT, to, subject))
 
 
+class MailTransport(object):
+    '''
+        MailTransport - Base class of a way to send mail
+    '''
+
+    def getKey(self):
+        '''
+            getKey - Get the options this transport was created with, to compare against a (reloaded) config
+
+            @return <tuple>
+        '''
+        raise NotImplementedError('Transport %s does not implement getKey.' %(self.__class__.__name__, ))
+
+    def send(self, to, subject, body):
+        '''
+            send - Send a message
+
+            @param to <str> - Recipients, separated by commas
+            @param subject <str> - Subject
+            @param body <str> - Body
+
+            @raises SendmailFailedException on failure
+        '''
+        raise NotImplementedError('Transport %s does not implement send.' %(self.__class__.__name__, ))
+
+    def close(self):
+        '''
+            close - Release anything held open
+        '''
+        pass
+
+
+class SendmailTransport(MailTransport):
+    '''
+        SendmailTransport - Send mail by running sendmail, once per message
+    '''
+
+    def __init__(self, sendmailPath):
+        '''
+            @param sendmailPath <str> - Path to the sendmail application
+        '''
+        self.sendmailPath = sendmailPath
+
+    def getKey(self):
+        return ('sendmail', self.sendmailPath)
+
+    def send(self, to, subject, body):
+        if not self.sendmailPath:
+            raise SendmailFailedException('sendmail_path is not configured')
+        return sendmail(self.sendmailPath, to, subject, body)
+
+
+class SMTPTransport(MailTransport):
+    '''
+        SMTPTransport - Send mail directly to an SMTP server (like a relay on localhost:25).
+
+            The connection is kept open and reused for following messages, until idle for SMTP_MAX_IDLE seconds.
+              If the server has dropped it, one new connection is made and the message tried again.
+    '''
+
+    def __init__(self, host='localhost', port=25, timeout=SMTP_TIMEOUT, maxIdle=SMTP_MAX_IDLE):
+        '''
+            @param host <str> - SMTP server
+            @param port <int> - SMTP port
+            @param timeout <float> - Seconds to wait on the server
+            @param maxIdle <float> - Seconds to keep an idle connection for reuse
+        '''
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.maxIdle = maxIdle
+
+        self.lock = threading.Lock()
+        self.connection = None
+        self.lastUsed = None
+
+        # Totals, for stats
+        self.numConnects = 0
+
+    def getKey(self):
+        return ('smtp', self.host, self.port)
+
+    def _connect(self):
+        import smtplib
+
+        connection = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+        connection.ehlo_or_helo_if_needed()
+        self.numConnects += 1
+        return connection
+
+    def _disconnect(self):
+        connection = self.connection
+        self.connection = None
+        if connection is not None:
+            try:
+                connection.quit()
+            except:
+                try:
+                    connection.close()
+                except:
+                    pass
+
+    def send(self, to, subject, body):
+        import smtplib
+
+        recipients = [recipient.strip() for recipient in to.split(',') if recipient.strip()]
+        message = buildMessage(to, subject, body)
+
+        with self.lock:
+            if self.connection is not None and time.time() - self.lastUsed > self.maxIdle:
+                self._disconnect()
+
+            # A reused connection may have been dropped by the server, so allow one fresh connection.
+            for attempt in (1, 2):
+                isReused = self.connection is not None
+                try:
+                    if self.connection is None:
+                        self.connection = self._connect()
+                    refused = self.connection.sendmail(getFromAddress(), recipients, message)
+                    self.lastUsed = time.time()
+                    if refused:
+                        raise SendmailFailedException('SMTP server %s:%d refused recipients: %s. subject=%s' %(self.host, self.port, str(refused), subject))
+                    return True
+                except SendmailFailedException:
+                    raise
+                except smtplib.SMTPRecipientsRefused as e:
+                    self.lastUsed = time.time()
+                    raise SendmailFailedException('SMTP server %s:%d refused all recipients: to=%s subject=%s' %(self.host, self.port, to, subject))
+                except (smtplib.SMTPException, socket.error, IOError, OSError) as e:
+                    self._disconnect()
+                    if isReused and attempt == 1:
+                        continue
+                    raise SendmailFailedException('Failed to send email through SMTP server %s:%d. to=%s subject=%s. Error: %s' %(self.host, self.port, to, subject, str(e)))
+
+    def close(self):
+        with self.lock:
+            self._disconnect()
+
+
+def createTransport(mainConfig):
+    '''
+        createTransport - Create the MailTransport selected by the [Main] config
+
+        @param mainConfig <usrsvcmod.MainConfig> - The main config
+
+        @return <MailTransport>
+    '''
+    if mainConfig.mail_transport == 'smtp':
+        return SMTPTransport(mainConfig.smtp_host, mainConfig.smtp_port)
+
+    return SendmailTransport(mainConfig.sendmail_path)
+
+
 # vim:set ts=4 shiftwidth=4 softtabstop=4 expandtab :
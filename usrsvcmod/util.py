@@ -54,7 +54,7 @@ def waitUpTo(testFunc, funcArgs, timeout, interval=0.1):
 
 def getUsername():
     try:
-        return pwd.getpwuid(os.getuid()).pw_nam
+        return pwd.getpwuid(os.getuid()).pw_name
     except:
         try:
             return os.environ['USER']